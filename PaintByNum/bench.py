@@ -0,0 +1,63 @@
+# Times the solver on a corpus of puzzles, reporting solve time, line
+# evaluations, line cache hit rate and peak memory for each.
+#
+#   python3 bench.py                 # uses puzzles/bench.txt
+#   python3 bench.py -k jazz FILE    # only puzzles whose name contains 'jazz'
+#   python3 bench.py --search        # finish stuck puzzles by guessing
+
+import argparse
+import os
+import time
+import tracemalloc
+from solver import parse_puzzles, solve_puzzle, line_cache
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "puzzles", "bench.txt")
+
+
+# Solves twice: once for timing, and once under tracemalloc (which slows
+# things down too much to time) for the peak memory.  The line cache is
+# emptied before each run, so each puzzle is measured on its own.
+def bench_one(row_clues, col_clues, search):
+  line_cache.clear()
+  start = time.perf_counter()
+  puzzle = solve_puzzle(row_clues, col_clues, search)
+  elapsed = time.perf_counter() - start
+  lookups = line_cache.hits + line_cache.misses
+  hit_rate = 100.0 * line_cache.hits / lookups if lookups else 0.0
+  line_cache.clear()
+  tracemalloc.start()
+  solve_puzzle(row_clues, col_clues, search)
+  (_, peak) = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return (puzzle, elapsed, hit_rate, peak)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark the Paint-By-Numbers solver")
+  parser.add_argument("files", nargs="*", default=[DEFAULT_CORPUS], help="puzzle files")
+  parser.add_argument("-k", dest="name_filter", default="", help="only run puzzles whose name contains this")
+  parser.add_argument("-s", "--search", action="store_true", help="guess and backtrack when line logic gets stuck")
+  args = parser.parse_args()
+
+  print("%-20s %8s %10s %8s %8s %10s %8s %8s" % ("puzzle", "size", "time (ms)", "lines", "cache %", "peak KiB",
+                                                 "unknown", "guesses"))
+  total_time = 0.0
+  total_lines = 0
+  for path in args.files:
+    with open(path, "r") as f:
+      puzzles = parse_puzzles(f.read())
+    for (name, row_clues, col_clues) in puzzles:
+      if args.name_filter not in name:
+        continue
+      (puzzle, elapsed, hit_rate, peak) = bench_one(row_clues, col_clues, args.search)
+      total_time += elapsed
+      total_lines += puzzle.num_line_evals
+      size = "%dx%d" % (puzzle.num_rows, puzzle.num_cols)
+      print("%-20s %8s %10.1f %8d %8.1f %10.1f %8d %8d" % (name, size, elapsed * 1000, puzzle.num_line_evals,
+                                                             hit_rate, peak / 1024, puzzle.num_unknown(),
+                                                             puzzle.num_guesses))
+  print("%-20s %8s %10.1f %8d" % ("total", "", total_time * 1000, total_lines))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,48 @@
+# Solves Paint-By-Numbers puzzles from the command line, in batches.
+#
+#   python3 solve_cli.py puzzles/bench.txt
+#   python3 solve_cli.py --quiet puzzles/*.txt
+#   python3 solve_cli.py --search puzzles/bench.txt
+#
+# See solver.parse_puzzles() for the file format.
+
+import argparse
+import sys
+import time
+from solver import parse_puzzles, solve_puzzle, line_cache
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Solve Paint-By-Numbers puzzles")
+  parser.add_argument("files", nargs="+", help="puzzle files")
+  parser.add_argument("-q", "--quiet", action="store_true", help="don't print the solved grids")
+  parser.add_argument("-s", "--search", action="store_true", help="guess and backtrack when line logic gets stuck")
+  args = parser.parse_args()
+
+  all_solved = True
+  for path in args.files:
+    with open(path, "r") as f:
+      puzzles = parse_puzzles(f.read())
+    for (name, row_clues, col_clues) in puzzles:
+      start = time.perf_counter()
+      puzzle = solve_puzzle(row_clues, col_clues, args.search)
+      elapsed = time.perf_counter() - start
+      unknown = puzzle.num_unknown()
+      if unknown > 0:
+        status = "%d cells unknown" % unknown
+        all_solved = False
+      elif puzzle.check_solution(row_clues, col_clues):
+        status = "solved"
+      else:
+        status = "WRONG"
+        all_solved = False
+      print("%s (%dx%d): %s in %.3fs" % (name, puzzle.num_rows, puzzle.num_cols, status, elapsed))
+      if not args.quiet:
+        print(puzzle.grid_text())
+        print()
+  print(line_cache.stats())
+  return 0 if all_solved else 1
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,736 @@
+# Paint-By-Numbers solving logic, with no browser code in it.
+# main.html imports this (Brython finds it next to the page), and
+# solve_cli.py and bench.py import it under regular Python.
+#
+# Only builtins are used here (bar heapq, where there is one), since the
+# Brython build in this repo ships without its standard library.
+
+# Line state is kept as integer bitmasks: bit i stands for cell i.
+# That lets a whole line be checked with a handful of big-int ops
+# instead of a Python loop over cells.
+
+def mask_of(known_state, c):
+  m = 0
+  for i in range(len(known_state)):
+    if known_state[i] == c:
+      m |= 1 << i
+  return m
+
+# Keeps bit s only if bits s...s+width-1 of m are all set.
+def runs_of(m, width):
+  done = 1
+  while done < width:
+    step = min(done, width - done)
+    m &= m >> step
+    done += step
+  return m
+
+# Copies every set bit of m into the width-1 bits above it.
+def smear_up(m, width):
+  done = 1
+  while done < width:
+    step = min(done, width - done)
+    m |= m << step
+    done += step
+  return m
+
+# Returns the positions reachable from 'seeds' by stepping right over
+# cells in 'allowed'.  Adding a seed to a run of 1's in 'allowed'
+# carries all the way to the end of the run, which flips exactly the
+# cells the seed can slide across.
+def slide(seeds, allowed):
+  x = seeds & allowed
+  covered = (allowed & ~(allowed + x)) | x
+  return seeds | (covered << 1)
+
+def mirror(m, width):
+  return int(bin(m)[2:].zfill(width)[::-1], 2)
+
+# Works left to right through the pieces.
+# reach[k] has bit p if pieces[:k] fit in cells 0...p-1 with cell p-1 blank.
+# starts[k] has bit s if pieces[k] can start at cell s, given reach[k].
+# Cell 0 must be a blank, so the caller pads the line at both ends.
+def reach_forward(pieces, not_x, not_b):
+  reach = [slide(2, not_x)]
+  starts = []
+  for size in pieces:
+    ok = reach[-1] & runs_of(not_b, size) & (not_x >> size)
+    starts.append(ok)
+    reach.append(slide(ok << (size + 1), not_x))
+  return (reach, starts)
+
+# Solves one row or column without listing its options.
+# filled and blank are bitmasks of the cells known to be 'X' and '_'.
+# Returns (can_fill, can_blank) bitmasks, or None if no option fits.
+def solve_line(total_len, pieces, filled, blank):
+  # Pad with a blank cell at each end, so cell i moves to bit i+1.
+  width = total_len + 2
+  every = (1 << total_len) - 1
+  not_x = ((every & ~filled) << 1) | 1 | (1 << (width - 1))
+  not_b = (every & ~blank) << 1
+  (reach, starts) = reach_forward(pieces, not_x, not_b)
+  if not (reach[-1] >> width) & 1:
+    return None
+
+  # The same sweep over the mirrored line gives, for each k, the
+  # positions from which pieces[k:] fit up to the right end.
+  (reach_rev, _) = reach_forward(list(reversed(pieces)),
+                                 mirror(not_x, width), mirror(not_b, width))
+  k_max = len(pieces)
+  back = [mirror(reach_rev[k_max - k], width + 1) for k in range(k_max + 1)]
+
+  can_fill = 0
+  can_blank = 0
+  for k in range(k_max + 1):
+    can_blank |= (reach[k] >> 1) & back[k]
+    if k < k_max:
+      size = pieces[k]
+      can_fill |= smear_up(starts[k] & (back[k + 1] >> size), size)
+  return ((can_fill >> 1) & every, (can_blank >> 1) & every)
+
+# Counts the options for a line; only needed by numOptions() and fill_odds().
+# ways[i] is the number of ways to place the remaining pieces in cells i...
+def count_options(total_len, pieces, filled, blank):
+  n = total_len
+  every = (1 << n) - 1
+  ways = [0 if filled >> i else 1 for i in range(n + 1)]
+  for size in reversed(pieces):
+    nxt = ways
+    ways = [0] * (n + 1)
+    run = (1 << size) - 1
+    for i in reversed(range(n + 1 - size)):
+      count = 0
+      if not (filled >> i) & 1:
+        count += ways[i + 1]
+      if not blank & (run << i):
+        end = i + size
+        if end == n:
+          count += nxt[n]
+        elif not (filled >> end) & 1:
+          count += nxt[end + 1]
+      ways[i] = count
+  return ways[0]
+
+############### The LineCache Class #############
+# Remembers solve_line() results by (clue, line length, known cells).
+# The same line states come up over and over: puzzles repeat clues, and
+# each probe and guess in the search re-solves lines it has seen before.
+#
+# Instead of a true LRU list, it keeps two dicts.  New entries go in
+# 'recent'; when that holds half the capacity, 'older' is dropped and
+# 'recent' takes its place.  A hit in 'older' moves the entry back to
+# 'recent', so whatever was used lately stays.
+class LineCache:
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.recent = {}
+    self.older = {}
+    self.hits = 0
+    self.misses = 0
+
+  # Returns the cached (can_fill, can_blank), or None
+  def get(self, key):
+    result = self.recent.get(key)
+    if result is None:
+      result = self.older.get(key)
+      if result is None:
+        self.misses += 1
+        return None
+      self.put(key, result)
+    self.hits += 1
+    return result
+
+  def put(self, key, result):
+    if len(self.recent) * 2 >= self.capacity:
+      self.older = self.recent
+      self.recent = {}
+    self.recent[key] = result
+
+  def clear(self):
+    self.recent = {}
+    self.older = {}
+    self.hits = 0
+    self.misses = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    rate = 100.0 * self.hits / lookups if lookups else 0.0
+    return "line cache: %d hits, %d misses (%.1f%% hits), %d entries" % (
+        self.hits, self.misses, rate, len(self.recent) + len(self.older))
+
+############### End of LineCache Class #############
+
+# Shared by every OptionSet, so work carries over between puzzles too
+LINE_CACHE_SIZE = 20000
+line_cache = LineCache(LINE_CACHE_SIZE)
+
+############### The OptionSet Class #############
+class OptionSet:
+  def __init__(self, dimension, pattern, known_state):
+    # Eg, pattern = "8 3 1"
+    # Rather than listing every way to fit groups of 8, 3 and 1 X's
+    # in the line, just remember the pieces and the known cells as
+    # a pair of bitmasks.  solve_line() works out the consensus.
+    self.pieces = [int(s) for s in pattern.split() if int(s) > 0]
+    self.dim = dimension
+    # The clue half of this line's key in line_cache
+    self.clue_key = (tuple(self.pieces), dimension)
+    self.filled = mask_of(known_state, 'X')
+    self.blank = mask_of(known_state, '_')
+    self.solved = None
+    self.count = None
+
+  def solve(self):
+    if self.solved is None:
+      if self.filled & self.blank:
+        self.solved = (0, 0)
+      else:
+        key = (self.clue_key, self.filled, self.blank)
+        self.solved = line_cache.get(key)
+        if self.solved is None:
+          self.solved = solve_line(self.dim, self.pieces, self.filled, self.blank) or (0, 0)
+          line_cache.put(key, self.solved)
+    return self.solved
+
+  def numOptions(self):
+    if self.count is None:
+      if self.filled & self.blank:
+        self.count = 0
+      else:
+        self.count = count_options(self.dim, self.pieces, self.filled, self.blank)
+    return self.count
+
+  # The fraction of the options that fill cell i, for guessing
+  def fill_odds(self, i):
+    total = self.numOptions()
+    if total == 0:
+      return 0.5
+    return count_options(self.dim, self.pieces, self.filled | (1 << i), self.blank) / total
+
+  # How many cells the line has to spare, beyond the pieces and one gap between each
+  def slack(self):
+    return self.dim - sum(self.pieces) - max(len(self.pieces) - 1, 0)
+
+  # Returns (must_fill, must_blank) bitmasks, or None if no option fits
+  def forced(self):
+    (can_fill, can_blank) = self.solve()
+    if self.dim > 0 and (can_fill | can_blank) == 0:
+      return None
+    return (can_fill & ~can_blank, can_blank & ~can_fill)
+
+  def consensus(self):
+    (can_fill, can_blank) = self.solve()
+    if (can_fill | can_blank) == 0:
+      return "No Options in this OptionSet"
+    forced_x = can_fill & ~can_blank
+    forced_b = can_blank & ~can_fill
+    answer = ""
+    for i in range(self.dim):
+      if (forced_x >> i) & 1:
+        answer += 'X'
+      elif (forced_b >> i) & 1:
+        answer += '_'
+      else:
+        answer += '?'
+    return answer
+
+  # Call this to inform the OptionSet that the value at
+  # position #i is a '_' or 'X'.  It will remove options
+  # accordingly.  'i' is zero-based
+  def constrain(self, i, v):
+    bit = 1 << i
+    if v == 'X':
+      if self.filled & bit:
+        return
+      self.filled |= bit
+    else:
+      if self.blank & bit:
+        return
+      self.blank |= bit
+    self.solved = None
+    self.count = None
+
+  # The whole state is four values, so the search can save and restore
+  # an OptionSet without copying it.
+  def save(self):
+    return (self.filled, self.blank, self.solved, self.count)
+
+  def restore(self, saved):
+    (self.filled, self.blank, self.solved, self.count) = saved
+
+  def print(self):
+    known = ''.join(['X' if (self.filled >> i) & 1 else '_' if (self.blank >> i) & 1 else '?'
+                     for i in range(self.dim)])
+    print("%s in %d cells, known %s" % (self.pieces, self.dim, known))
+
+############### End of  OptionSet Class #############
+
+
+# Turns a line of '_' and 'X' cells into its clue, eg "__XX_X" -> "2 1"
+def line_clue(cells):
+  runs = [len(run) for run in ''.join(cells).split('_') if run]
+  return ' '.join([str(r) for r in runs]) if runs else '0'
+
+# How many cells the search probes before each guess
+PROBE_LIMIT = 16
+
+# heapq's C heap where there is one.  The Brython build here has no
+# heapq, so it gets this small binary heap instead.
+try:
+  from heapq import heappush as heap_push, heappop as heap_pop
+except ImportError:
+  def heap_push(heap, item):
+    heap.append(item)
+    i = len(heap) - 1
+    while i > 0:
+      parent = (i - 1) >> 1
+      if heap[parent] <= heap[i]:
+        break
+      (heap[parent], heap[i]) = (heap[i], heap[parent])
+      i = parent
+
+  def heap_pop(heap):
+    last = heap.pop()
+    if not heap:
+      return last
+    top = heap[0]
+    heap[0] = last
+    i = 0
+    n = len(heap)
+    while True:
+      child = 2 * i + 1
+      if child >= n:
+        break
+      if child + 1 < n and heap[child + 1] < heap[child]:
+        child += 1
+      if heap[i] <= heap[child]:
+        break
+      (heap[i], heap[child]) = (heap[child], heap[i])
+      i = child
+    return top
+
+############### The Puzzle Class #############
+# The grid model plus the line-by-line propagation.  A_Board in
+# main.html extends this with drawing and clue entry.
+#
+# Lines are numbered: rows are 0...num_rows-1, and column c is num_rows+c.
+class Puzzle:
+
+  def __init__(self, num_rows, num_cols):
+    self.num_cols = num_cols
+    self.num_rows = num_rows
+    self.row_options = [None] * self.num_rows
+    self.col_options = [None] * self.num_cols
+    self.row_clues = [None] * self.num_rows
+    self.col_clues = [None] * self.num_cols
+
+    # a list of lists of chars, representing the state of the grid
+    self.model = [None] * self.num_rows
+    for i in range(self.num_rows):
+        self.model[i] = list('?' * self.num_cols)
+
+    # Lines waiting to be evaluated, as a heap of (priority, line) pairs.
+    # A line can be in here more than once; only the entry matching its
+    # current priority counts.
+    self.queue = []
+    num_lines = self.num_rows + self.num_cols
+    # Cells of each line that became known since the line was last evaluated
+    self.line_changes = [0] * num_lines
+    # When each line's first pending change happened, counted in changes
+    self.line_since = [0] * num_lines
+    self.num_changes = 0
+    # Free cells in each line beyond what its clue needs.  The less room
+    # a clue has, the fewer options it has and the more cells it fixes.
+    self.line_slack = [0] * num_lines
+
+    # How many times a row or column has been run through its OptionSet
+    self.num_line_evals = 0
+
+    # Every cell set since the start, in order, so the search can undo them
+    self.trail = []
+    # Set when some row or column has no options left
+    self.contradiction = False
+    # While searching, contradictions are expected and not worth printing
+    self.searching = False
+    self.num_guesses = 0
+    self.num_probes = 0
+
+  # Setting a clue again with different text starts the grid over, since
+  # cells worked out from the old clue may no longer hold, and a
+  # contradiction it caused may be gone.
+  def set_row_clue(self, row, text):
+    old_text = self.row_clues[row]
+    self.row_clues[row] = text
+    if old_text != None and old_text != text:
+      self.start_over()
+      return
+    known_state = self.model[row]
+    self.row_options[row] = OptionSet(self.num_cols, text, known_state)
+    self.line_slack[row] = self.row_options[row].slack()
+    self.line_changed(row)
+
+  def set_col_clue(self, col, text):
+    old_text = self.col_clues[col]
+    self.col_clues[col] = text
+    if old_text != None and old_text != text:
+      self.start_over()
+      return
+    known_state = [self.model[i][col] for i in range(self.num_rows)]
+    self.col_options[col] = OptionSet(self.num_rows, text, known_state)
+    self.line_slack[self.num_rows + col] = self.col_options[col].slack()
+    self.line_changed(self.num_rows + col)
+
+  # Forgets every cell, rebuilds each line from its clue, and queues them all.
+  def start_over(self):
+    while len(self.trail) > 0:
+      (r, c) = self.trail.pop()
+      self.model[r][c] = '?'
+      self.cell_changed(r, c, '?')
+    self.clear_queue()
+    self.contradiction = False
+    unknown = ['?'] * max(self.num_rows, self.num_cols)
+    for row in range(self.num_rows):
+      text = self.row_clues[row]
+      if text != None:
+        self.row_options[row] = OptionSet(self.num_cols, text, unknown[:self.num_cols])
+        self.line_slack[row] = self.row_options[row].slack()
+        self.line_changed(row)
+    for col in range(self.num_cols):
+      text = self.col_clues[col]
+      if text != None:
+        self.col_options[col] = OptionSet(self.num_rows, text, unknown[:self.num_rows])
+        self.line_slack[self.num_rows + col] = self.col_options[col].slack()
+        self.line_changed(self.num_rows + col)
+
+  def line_options(self, line):
+    if line < self.num_rows:
+      return self.row_options[line]
+    return self.col_options[line - self.num_rows]
+
+  # Notes a new fact about a line and (re)queues it.
+  def line_changed(self, line):
+    self.num_changes += 1
+    if self.line_changes[line] == 0:
+      self.line_since[line] = self.num_changes
+    self.line_changes[line] += 1
+    heap_push(self.queue, (self.line_priority(line), line))
+
+  # Lower goes first.  Lines are taken roughly in the order they changed,
+  # so each one gathers a few new cells before it runs, but lines with
+  # many new cells or little slack jump ahead: they pay off the most.
+  def line_priority(self, line):
+    return self.line_since[line] + 4 * self.line_slack[line] - 20 * self.line_changes[line]
+
+  # Evaluates the queued lines, best first, until none are left.
+  # A line only runs again once one of its cells changes.
+  # Returns False (and stops early) if it runs into a contradiction.
+  # Given max_evals, it stops after that many lines and returns None if
+  # any are still queued, so a caller can spread the work out over time.
+  def eval_puzzle(self, max_evals=None):
+    evals = 0
+    while len(self.queue) > 0:
+      if self.contradiction:
+        self.clear_queue()
+        return False
+      if max_evals != None and evals >= max_evals:
+        return None
+      (priority, line) = heap_pop(self.queue)
+      if self.line_changes[line] == 0 or priority != self.line_priority(line):
+        continue  # Already evaluated, or queued again with a newer priority
+      self.line_changes[line] = 0
+      self.eval_line(line)
+      evals += 1
+    return not self.contradiction
+
+  def clear_queue(self):
+    self.queue = []
+    for line in range(len(self.line_changes)):
+      self.line_changes[line] = 0
+
+  # Sets every cell of the line that all of its options agree on.
+  def eval_line(self, line):
+    options = self.line_options(line)
+    if options == None:
+      return
+    self.num_line_evals += 1
+    forced = options.forced()
+    if forced is None:
+      if not self.searching:
+        if line < self.num_rows:
+          print("ERROR: no options fit row %d" % line)
+        else:
+          print("ERROR: no options fit col %d" % (line - self.num_rows))
+      self.contradiction = True
+      return
+    # Only the cells that aren't known yet
+    new_x = forced[0] & ~options.filled
+    new_blank = forced[1] & ~options.blank
+    if (new_x | new_blank) == 0:
+      return
+    for i in range(options.dim):
+      if (new_x >> i) & 1:
+        val = 'X'
+      elif (new_blank >> i) & 1:
+        val = '_'
+      else:
+        continue
+      if line < self.num_rows:
+        self.update_cell(line, i, val, line)
+      else:
+        self.update_cell(i, line - self.num_rows, val, line)
+
+  # 'source' is the line whose evaluation decided this cell, if any.
+  # There's no need to evaluate that line again just for this cell.
+  def update_cell(self, row, col, val, source=None):
+    if (val != '_') and (val != 'X'):
+      print("ERROR: update_cell(%d, %d, %s)" % (row, col, val))
+      return
+    old_val = self.model[row][col]
+    if old_val == '?':
+      self.model[row][col] = val
+      self.trail.append((row, col))
+      col_line = self.num_rows + col
+      if self.row_options[row] != None:
+        self.row_options[row].constrain(col, val)
+      if self.col_options[col] != None:
+        self.col_options[col].constrain(row, val)
+      if source != row:
+        self.line_changed(row)
+      if source != col_line:
+        self.line_changed(col_line)
+      self.cell_changed(row, col, val)
+    elif old_val != val:
+      if not self.searching:
+        print("ERROR: can't set (%d, %d) to %s because it was %s" % (row, col, val, old_val))
+      self.contradiction = True
+
+  # Called whenever a '?' cell becomes '_' or 'X'.  Subclasses override it to draw.
+  def cell_changed(self, row, col, val):
+    pass
+
+  def num_unknown(self):
+    return self.num_rows * self.num_cols - len(self.trail)
+
+  ### Search, for puzzles that line logic alone can't finish ###
+
+  # Snapshots are a trail position plus the (tiny) state of each OptionSet.
+  def snapshot(self):
+    return (len(self.trail),
+            [o.save() for o in self.row_options],
+            [o.save() for o in self.col_options])
+
+  # Cells set since the snapshot go back to '?'.  Subclasses that draw
+  # get a cell_changed(row, col, '?') call for each.
+  def restore(self, snap):
+    (mark, rows, cols) = snap
+    while len(self.trail) > mark:
+      (r, c) = self.trail.pop()
+      self.model[r][c] = '?'
+      self.cell_changed(r, c, '?')
+    for i in range(self.num_rows):
+      self.row_options[i].restore(rows[i])
+    for i in range(self.num_cols):
+      self.col_options[i].restore(cols[i])
+    self.clear_queue()
+    self.contradiction = False
+
+  # Picks the unsolved line with the fewest options left, and returns
+  # its unknown cells as (row, col), most constrained crossing line first.
+  def candidate_cells(self):
+    best = None
+    for r in range(self.num_rows):
+      if '?' in self.model[r]:
+        n = self.row_options[r].numOptions()
+        if best is None or n < best[0]:
+          best = (n, r, None)
+    for c in range(self.num_cols):
+      if '?' in [self.model[r][c] for r in range(self.num_rows)]:
+        n = self.col_options[c].numOptions()
+        if best is None or n < best[0]:
+          best = (n, None, c)
+    (_, row, col) = best
+    if row is not None:
+      cells = [(row, c) for c in range(self.num_cols) if self.model[row][c] == '?']
+      cells.sort(key=lambda rc: self.col_options[rc[1]].numOptions())
+    else:
+      cells = [(r, col) for r in range(self.num_rows) if self.model[r][col] == '?']
+      cells.sort(key=lambda rc: self.row_options[rc[0]].numOptions())
+    return cells
+
+  # The unknown cells on every row and column that changed since trail
+  # position 'mark', i.e. where the last guess or probe had an effect.
+  # A bad guess usually shows up there first.  Returns the 'limit' cells
+  # whose row and column have the fewest options between them.
+  def frontier_cells(self, mark, limit):
+    rows = set()
+    cols = set()
+    for (r, c) in self.trail[mark:]:
+      rows.add(r)
+      cols.add(c)
+    cells = set()
+    for r in rows:
+      line = self.model[r]
+      for i in range(self.num_cols):
+        if line[i] == '?':
+          cells.add((r, i))
+    for c in cols:
+      for i in range(self.num_rows):
+        if self.model[i][c] == '?':
+          cells.add((i, c))
+    cells = list(cells)
+    cells.sort(key=lambda rc: self.row_options[rc[0]].numOptions() * self.col_options[rc[1]].numOptions())
+    return cells[:limit]
+
+  # Tries both values in each cell and propagates.  If one value leads to
+  # a contradiction, the cell must have the other one.  If neither does,
+  # any cell that came out the same both ways must have that value too.
+  # Returns (False, None) if some cell can't take either value, else
+  # (True, the probed cell whose two tries told us the most).
+  def probe(self, cells):
+    best = None
+    for (r, c) in cells:
+      if self.model[r][c] != '?':
+        continue
+      outcomes = []
+      for val in ('X', '_'):
+        snap = self.snapshot()
+        self.update_cell(r, c, val)
+        if self.eval_puzzle():
+          outcomes.append(dict([(rc, self.model[rc[0]][rc[1]]) for rc in self.trail[snap[0]:]]))
+        else:
+          outcomes.append(None)
+        self.restore(snap)
+        self.num_probes += 1
+      (if_x, if_blank) = outcomes
+      if if_x is None and if_blank is None:
+        return (False, None)
+      if if_x is None or if_blank is None:
+        forced = (if_x or if_blank).items()
+      else:
+        forced = [(rc, v) for (rc, v) in if_x.items() if if_blank.get(rc) == v]
+        gain = min(len(if_x), len(if_blank))
+        if best is None or gain > best[0]:
+          best = (gain, (r, c))
+      if forced:
+        for ((fr, fc), v) in forced:
+          self.update_cell(fr, fc, v)
+        if not self.eval_puzzle():
+          return (False, None)
+    return (True, best[1] if best else None)
+
+  # The value a guess at the cell should try first: the one more of its
+  # row's and column's options agree on.  Puzzles that need guessing
+  # often have room for more than one picture, and a guess that goes with
+  # the clues usually leads to one of them without backtracking.
+  def likely_value(self, row, col):
+    p_row = self.row_options[row].fill_odds(col)
+    p_col = self.col_options[col].fill_odds(row)
+    if p_row * p_col >= (1 - p_row) * (1 - p_col):
+      return 'X'
+    return '_'
+
+  # Line logic, then probing, then guessing with backtracking, until the
+  # grid is full.  Returns True if solved, or False if the clues have no
+  # solution (the model is then put back as it was before the search).
+  # Every clue must be set before calling this.
+  def search(self):
+    self.searching = True
+    start = self.snapshot()
+    # Each entry is a snapshot taken before a guess, plus the other value
+    # to try for that cell if the guess fails.
+    guesses = []
+    last_mark = len(self.trail)
+    ok = self.eval_puzzle()
+    while True:
+      if ok:
+        if self.num_unknown() == 0:
+          self.searching = False
+          return True
+        cells = self.frontier_cells(last_mark, PROBE_LIMIT) or self.candidate_cells()
+        last_mark = len(self.trail)
+        num_unknown = self.num_unknown()
+        (ok, best) = self.probe(cells)
+        if not ok or self.num_unknown() < num_unknown:
+          continue
+        (r, c) = best
+        val = self.likely_value(r, c)
+        guesses.append((self.snapshot(), r, c, '_' if val == 'X' else 'X'))
+        self.num_guesses += 1
+        self.update_cell(r, c, val)
+        ok = self.eval_puzzle()
+      elif guesses:
+        (snap, r, c, val) = guesses.pop()
+        self.restore(snap)
+        last_mark = len(self.trail)
+        self.update_cell(r, c, val)
+        ok = self.eval_puzzle()
+      else:
+        self.restore(start)
+        self.searching = False
+        return False
+
+  def grid_text(self):
+    return '\n'.join([''.join(row) for row in self.model])
+
+  # True if every row and column of the model matches its clue
+  def check_solution(self, row_clues, col_clues):
+    for r in range(self.num_rows):
+      if line_clue(self.model[r]) != line_clue_text(row_clues[r]):
+        return False
+    for c in range(self.num_cols):
+      if line_clue([self.model[r][c] for r in range(self.num_rows)]) != line_clue_text(col_clues[c]):
+        return False
+    return True
+
+############### End of Puzzle Class #############
+
+# Normalizes a clue as typed, eg " 3  1" -> "3 1", "" -> "0"
+def line_clue_text(text):
+  pieces = [s for s in text.split() if int(s) > 0]
+  return ' '.join(pieces) if pieces else '0'
+
+# Reads puzzles from text like this, with any number of puzzles per file:
+#
+#   puzzle tiny
+#   rows
+#   1 1
+#   3
+#   cols
+#   1
+#   2
+#   1 1
+#
+# '#' starts a comment.  Returns a list of (name, row_clues, col_clues).
+def parse_puzzles(text):
+  puzzles = []
+  section = None
+  for line in text.split('\n'):
+    line = line.split('#')[0].strip()
+    if not line:
+      continue
+    if line.startswith('puzzle'):
+      puzzles.append((line[6:].strip(), [], []))
+      section = None
+    elif line in ('rows', 'cols'):
+      if not puzzles:
+        raise ValueError("'%s' before any 'puzzle' line" % line)
+      section = puzzles[-1][1] if line == 'rows' else puzzles[-1][2]
+    elif section is None:
+      raise ValueError("clue '%s' outside of a rows/cols section" % line)
+    else:
+      section.append(line)
+  return puzzles
+
+# Builds a Puzzle from its clues and runs the propagation to a standstill.
+# With search=True, keeps guessing until the grid is full.
+def solve_puzzle(row_clues, col_clues, search=False):
+  puzzle = Puzzle(len(row_clues), len(col_clues))
+  for r in range(len(row_clues)):
+    puzzle.set_row_clue(r, row_clues[r])
+  for c in range(len(col_clues)):
+    puzzle.set_col_clue(c, col_clues[c])
+  if search:
+    puzzle.search()
+  else:
+    puzzle.eval_puzzle()
+  return puzzle
@@ -0,0 +1,34 @@
+from solver import Puzzle, solve_puzzle
+
+# A clue that can't fit makes a contradiction...
+p = Puzzle(3, 3)
+p.set_row_clue(0, '5')
+assert p.eval_puzzle() is False, "Expected a 5 in a 3 wide row to contradict"
+assert p.contradiction
+
+# ...and correcting it clears the contradiction, even with nothing solved yet
+p.set_row_clue(0, '3')
+assert not p.contradiction, "Expected the corrected clue to clear the contradiction"
+assert p.eval_puzzle() is True
+assert p.model[0] == ['X', 'X', 'X'], f"Expected row 0 filled, got {p.model[0]}"
+
+# The same for a column, after some cells have been solved
+p = Puzzle(3, 3)
+p.set_row_clue(0, '3')
+p.set_col_clue(1, '4')
+assert p.eval_puzzle() is False
+p.set_col_clue(1, '1')
+assert p.eval_puzzle() is True
+assert [p.model[r][1] for r in range(3)] == ['X', '_', '_']
+
+# Clues with no solution at all leave the model as it was
+p = solve_puzzle(['1', '0'], ['0', '0'], search=True)
+assert p.num_unknown() == 4
+
+# Line logic alone can't finish this one; the search does
+row_clues = ['1', '1']
+col_clues = ['1', '1']
+p = solve_puzzle(row_clues, col_clues, search=True)
+assert p.num_unknown() == 0 and p.check_solution(row_clues, col_clues), p.grid_text()
+
+print("All tests passed")
@@ -0,0 +1,58 @@
+import binascii
+import os
+from adafruit_httpserver import Response, Status
+
+# The pages the rover serves, held in RAM as ready-to-send bytes.
+#
+# Each page is read from flash, has its placeholders filled in and gets
+# its ETag once, when it's loaded at startup.  Serving it is then just a
+# send, so a page load doesn't hold up the driving loop while a file is
+# read and copied.  Browsers are told to check back every time
+# (no-cache), and a check of an unchanged page is answered with a bodiless
+# 304.
+#
+# If gzip_pages.py has left a 'name.gz' next to a page, that's sent
+# instead, to browsers that take gzip.  It's sent as it is: a gzipped page
+# can't have placeholders filled in, so has to manage without them.
+
+NOT_MODIFIED_304 = Status(304, "Not Modified")
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def _etag(body):
+    return f'"{binascii.crc32(body) & 0xffffffff:08x}"'
+
+class StaticPage:
+    def __init__(self, path, content_type="text/html", replacements=None):
+        self.path = path
+        self.content_type = content_type
+        with open(path, "r") as file:
+            text = file.read()
+        for (placeholder, value) in (replacements or {}).items():
+            text = text.replace(placeholder, value)
+        self.body = text.encode()
+        self.etag = _etag(self.body)
+        self.gzipped = None
+        if _exists(path + ".gz"):
+            with open(path + ".gz", "rb") as file:
+                self.gzipped = file.read()
+            self.gzipped_etag = _etag(self.gzipped)
+
+    def __len__(self):
+        return len(self.body) + (len(self.gzipped) if self.gzipped else 0)
+
+    def response(self, request):
+        headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        (body, etag) = (self.body, self.etag)
+        if self.gzipped and "gzip" in (request.headers.get("Accept-Encoding") or ""):
+            (body, etag) = (self.gzipped, self.gzipped_etag)
+            headers["Content-Encoding"] = "gzip"
+        headers["ETag"] = etag
+        if request.headers.get("If-None-Match") == etag:
+            return Response(request, "", status=NOT_MODIFIED_304, headers=headers)
+        return Response(request, body, content_type=self.content_type, headers=headers)
@@ -0,0 +1,135 @@
+# Simulates LIDAR sweeps of an arena with boxes on it, and times the map
+# updates and obstacle-aware plans at different grid resolutions.  Runs
+# on a desktop, not the rover:
+#
+#   python3 bench_map.py                  # 10, 20 and 40mm cells
+#   python3 bench_map.py --cells 20 --show
+
+import argparse
+import math
+import random
+import time
+from occupancy import OccupancyGrid, SWEEP_ANGLES, lidar_mount_bearing
+from planning import hybrid_astar_steps, path_poses, shortest_path
+
+# As in driving.py
+ARENA_WIDTH = 1160
+ARENA_HEIGHT = 1060
+ARENA_MARGIN = 50
+MIN_TURN_RADIUS = 80
+ROVER_CLEARANCE = 90
+
+# Boxes left on the board: (min_x, min_y, max_x, max_y)
+BOXES = [(450, 300, 600, 750), (800, 100, 900, 250)]
+# Where the rover stops to sweep: (x, y, heading)
+SWEEP_POSES = [(200, 500, 0), (700, 900, 90), (1000, 500, 200)]
+NOISE_MM = 10  # Standard deviation of the simulated readings
+
+def _ray_to_box(x, y, dx, dy, box):
+    """Distance along the ray (x, y) + t(dx, dy) to the box, or None"""
+    (t_near, t_far) = (0, math.inf)
+    for (p, d, lo, hi) in [(x, dx, box[0], box[2]), (y, dy, box[1], box[3])]:
+        if abs(d) < 1e-9:
+            if p < lo or p > hi:
+                return None
+            continue
+        (t1, t2) = sorted([(lo - p) / d, (hi - p) / d])
+        t_near = max(t_near, t1)
+        t_far = min(t_far, t2)
+    return t_near if t_near <= t_far else None
+
+def simulated_reading(x, y, bearing):
+    dx = math.sin(math.radians(bearing))
+    dy = math.cos(math.radians(bearing))
+    hits = [_ray_to_box(x, y, dx, dy, box) for box in BOXES + [(-1e6, -1e6, 0, 1e6), (ARENA_WIDTH, -1e6, 1e6, 1e6),
+                                                            (-1e6, -1e6, 1e6, 0), (-1e6, ARENA_HEIGHT, 1e6, 1e6)]]
+    return min(h for h in hits if h is not None) + random.gauss(0, NOISE_MM)
+
+def sweep(grid, x, y, hdg):
+    """Both LIDARs at every servo angle, like servos.sweep_lidar()"""
+    for angle in SWEEP_ANGLES:
+        up = hdg + lidar_mount_bearing(angle)
+        for bearing in [up, up + 90]:
+            grid.add_ray(x, y, bearing, simulated_reading(x, y, bearing))
+
+def hits_box(poses, clearance):
+    for (px, py, _) in poses:
+        for (x0, y0, x1, y1) in BOXES:
+            if x0 - clearance < px < x1 + clearance and y0 - clearance < py < y1 + clearance:
+                return True
+    return False
+
+def show(grid):
+    blocked = grid.inflated(ROVER_CLEARANCE)
+    for iy in range(grid.ny - 1, -1, -1):
+        print("".join(["#" if grid.is_occupied(ix, iy) else "+" if blocked[iy * grid.nx + ix] else "."
+                       for ix in range(grid.nx)]))
+
+def bench(cell_mm, plans, draw):
+    random.seed(1)
+    grid = OccupancyGrid(ARENA_WIDTH, ARENA_HEIGHT, cell_mm)
+    start = time.perf_counter()
+    for (x, y, hdg) in SWEEP_POSES:
+        sweep(grid, x, y, hdg)
+    update_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    grid.inflated(ROVER_CLEARANCE)
+    inflate_ms = (time.perf_counter() - start) * 1000
+    print(f"{grid}, {len(grid.cells)} bytes")
+    print(f"  map update: {update_ms / grid.num_rays * 1000:.0f}us per ray, inflate {inflate_ms:.1f}ms")
+    if draw:
+        show(grid)
+
+    # Plans from the left of the big box to the right of it, which the
+    # plain Dubins path drives straight through.  The rover runs each a
+    # slice at a time, so the longest slice is what holds it up.
+    times = []
+    slice_times = []
+    lengths = []
+    turned = 0
+    failed = 0
+    collided = 0
+    for _ in range(plans):
+        q = (random.uniform(150, 350), random.uniform(300, 800), random.uniform(0, 360),
+             random.uniform(700, 1000), random.uniform(350, 750), random.uniform(0, 360))
+        search = hybrid_astar_steps(grid, *q, MIN_TURN_RADIUS, ROVER_CLEARANCE, ARENA_MARGIN)
+        total = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                next(search)
+                slice_times.append(time.perf_counter() - start)
+                total += slice_times[-1]
+        except StopIteration as done:
+            best = done.value
+            total += time.perf_counter() - start
+        times.append(total)
+        if best is None:
+            failed += 1
+            continue
+        (length, segments, start_hdg) = best
+        if start_hdg != q[2]:
+            turned += 1
+        lengths.append(length / shortest_path(ARENA_WIDTH, ARENA_HEIGHT, *q, MIN_TURN_RADIUS, ARENA_MARGIN)[0])
+        if hits_box(path_poses(q[0], q[1], start_hdg, segments, MIN_TURN_RADIUS, 5), ROVER_CLEARANCE / 2):
+            collided += 1
+    times.sort()
+    slice_times.sort()
+    print(f"  {plans} plans round the box: {turned} turned in place first, {failed} not found, {collided} too close to a box")
+    print(f"  plan time: median {times[len(times) // 2] * 1000:.1f}ms, max {times[-1] * 1000:.1f}ms")
+    print(f"  {len(slice_times)} slices: median {slice_times[len(slice_times) // 2] * 1000:.2f}ms, "
+          f"max {slice_times[-1] * 1000:.2f}ms")
+    if lengths:
+        print(f"  length vs the Dubins path through the box: mean {sum(lengths) / len(lengths):.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the occupancy grid and hybrid A*")
+    parser.add_argument("--cells", type=int, nargs="+", default=[10, 20, 40], help="cell sizes, mm")
+    parser.add_argument("--plans", type=int, default=50, help="random plans per cell size")
+    parser.add_argument("--show", action="store_true", help="draw each map")
+    args = parser.parse_args()
+    for cell_mm in args.cells:
+        bench(cell_mm, args.plans, args.show)
+
+if __name__ == "__main__":
+    main()
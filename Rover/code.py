@@ -4,17 +4,23 @@
 
 import os
 import ssl
-from driving import driving_stop, handle_driving_cmd, loop_driving, loop_replan, upover_to_xy
-from imu import current_heading, is_parked_flat
-from lidar import loop_read_lidar, get_distances
+from driving import driving_stop, is_idle, handle_driving_cmd, driving_step, DRIVING_CMDS, replan_step, search_step, queue_length, throttles, CONTROL_HZ, REPLAN_INTERVAL, SEARCH_HZ
+from imu import current_heading, is_parked_flat, read_imu_step, READ_INTERVAL
+from lidar import read_lidar_step, get_distances, POLL_INTERVAL
+from pose import estimate_pose_step, get_pose, UPDATE_INTERVAL
 import wifi
 import socketpool
 import adafruit_requests
-from asyncio import create_task, gather, run
-from asyncio import sleep as async_sleep
-from adafruit_httpserver import GET, Request, Response, Server, Websocket
+from asyncio import run
+from adafruit_httpserver import GET, NO_REQUEST, ChunkedResponse, Request, Response, Server, Status, Websocket
 from display import display_cmd, display_battery, display_distances, display_heading, display_xy
-from servos import loop_point_lidar, handle_servo_cmd
+from servos import point_lidar_step, handle_servo_cmd, POINT_INTERVAL, SERVO_CMDS
+from mission import handle_mission_cmd, take_events, MISSION_CMDS
+import recorder
+from scheduler import Scheduler, AdaptiveRate, PRIORITY_SENSORS, PRIORITY_CONTROL, PRIORITY_PLANNING, PRIORITY_BACKGROUND
+from assets import StaticPage
+from telemetry import pack_frame, MAX_HZ as MAX_TELEMETRY_HZ
+from adafruit_ticks import ticks_ms
 import board
 import alarm
 import adafruit_max1704x
@@ -26,21 +32,47 @@ print(f"My IP address: {wifi.radio.ipv4_address}")
 
 pool = socketpool.SocketPool(wifi.radio)
 requests = adafruit_requests.Session(pool, ssl.create_default_context())
-server = Server(pool, debug=True)
+# The server's debug logging prints a few lines for every request
+server = Server(pool, debug=False)
 
 websocket: Websocket = None
 
-@server.route("/", GET)
-def client(request: Request):
-    file_path = "client_ui.html"
+# Pages are loaded once, here, so serving one doesn't read flash; see assets.py
+def _load_page(file_path):
     try:
-        with open(file_path, "r") as file:
-            file_content = file.read()
-        print(f"{file_path} content loaded successfully:")
-        return Response(request, file_content.replace("IPADDR", str(wifi.radio.ipv4_address)), content_type="text/html")
+        page = StaticPage(file_path, replacements={"IPADDR": str(wifi.radio.ipv4_address)})
+        print(f"{file_path} loaded, {len(page)} bytes")
+        return page
     except OSError as e:
         print(f"Error opening or reading file {file_path}: {e}")
-        return Response(request, f"Error opening or reading file {file_path}: {e}", content_type="text")
+        return f"Error opening or reading file {file_path}: {e}"
+
+pages = {
+    "/": _load_page("client_ui.html"),
+    "/plan": _load_page("plan_ui.html"),
+}
+
+def _serve_page(request: Request):
+    page = pages[request.path]
+    if isinstance(page, str):
+        return Response(request, page, content_type="text")
+    return page.response(request)
+
+for path in pages:
+    server.route(path, GET)(_serve_page)
+
+# The flight recorder's log, for replay_log.py.  Sent in pieces, but all
+# in one go, so the rover's other tasks wait for it, driving_step()
+# included.  So it's only sent while the rover isn't driving.
+CONFLICT_409 = Status(409, "Conflict")
+
+@server.route("/log", GET)
+def download_log(request: Request):
+    if not is_idle():
+        return Response(request, "The rover is driving; stop it before downloading the log",
+                        content_type="text/plain", status=CONFLICT_409)
+    return ChunkedResponse(request, recorder.log_chunks, content_type="application/octet-stream",
+                           headers={"Content-Disposition": 'attachment; filename="flight.log"'})
 
 
 @server.route("/connect-websocket", GET)
@@ -51,6 +83,8 @@ def connect_client(request: Request):
         websocket.close()  # Close any existing connection
 
     websocket = Websocket(request)
+    scheduler.task("websocket").enabled = True
+    websocket_rate.busy()
 
     return websocket
 
@@ -59,8 +93,10 @@ server.start(str(wifi.radio.ipv4_address))
 
 # Battery monitor
 bm = adafruit_max1704x.MAX17048(board.I2C())
+battery_percent = bm.cell_percent # Read with the display, not for every telemetry frame
 
 def execute_cmd(cmd):
+    recorder.record_text(cmd)
     if cmd == 'sleep':
         driving_stop()
         alarm.exit_and_deep_sleep_until_alarms(alarm.pin.PinAlarm(pin=board.D0, value=False))
@@ -68,10 +104,37 @@ def execute_cmd(cmd):
         websocket.send_message("Pong", fail_silently=True)
     elif cmd == 'status':
         websocket.send_message(f"Battery: {bm.cell_percent:.1f}%", fail_silently=True)
+    elif cmd == 'stats':
+        websocket.send_message(str(scheduler), fail_silently=True)
+    elif cmd == 'stats reset':
+        scheduler.reset_stats()
+    elif cmd == 'log':
+        websocket.send_message(recorder.status(), fail_silently=True)
+    elif cmd == 'log clear':
+        recorder.clear()
+    elif cmd == 'telemetry off':
+        scheduler.task("telemetry").enabled = False
+    elif cmd.startswith('telemetry on'):
+        words = cmd.split()
+        try:
+            hz = float(words[2]) if len(words) > 2 else 10
+        except ValueError:
+            websocket.send_message(f"Bad telemetry rate: {words[2]}", fail_silently=True)
+            return
+        if not 0 < hz <= MAX_TELEMETRY_HZ:
+            websocket.send_message(f"Telemetry rate must be above 0 and at most {MAX_TELEMETRY_HZ}Hz", fail_silently=True)
+            return
+        task = scheduler.task("telemetry")
+        task.set_rate(hz)
+        task.reset_stats()
+        task.enabled = True
     elif cmd == 'pos':
         resp = "Parked flat. " if is_parked_flat() else f"Hdg: {current_heading():.1f}. "
         [d1, d2] = get_distances()
-        resp += f" {d1}mm up, {d2}mm over"
+        resp += f" {d1}mm up, {d2}mm over."
+        (x, y, hdg, _, confidence) = get_pose()
+        if x is not None and y is not None:
+            resp += f" Pose: ({x:.0f}, {y:.0f}) hdg {hdg:.1f}, confidence {confidence:.2f}"
         websocket.send_message(resp, fail_silently=True)
     elif cmd == 'collect_lidar':
         pass
@@ -81,7 +144,8 @@ def execute_cmd(cmd):
         #websocket.send_message(f"Over: Collected {len(dvals2)} distance readings", fail_silently=True)
         #websocket.send_message(",".join([str(d) for d in dvals2]), fail_silently=True)
     else:
-        for cmd_handler in [handle_driving_cmd, handle_servo_cmd]:
+        cmd_handler = cmd_handlers.get(cmd.split(None, 1)[0]) if cmd.strip() else None
+        if cmd_handler is not None:
             (is_for_me, msg) = cmd_handler(cmd)
             if is_for_me:
                 if msg:
@@ -89,44 +153,86 @@ def execute_cmd(cmd):
                 return
         websocket.send_message("Unknown command: " + cmd, fail_silently=True)
 
-async def handle_http_requests():
-    while True:
-        server.poll()
-
-        await async_sleep(0)
-
+# Which module's handler takes each command, by its first word
+cmd_handlers = {}
+for (words, cmd_handler) in [(DRIVING_CMDS, handle_driving_cmd), (SERVO_CMDS, handle_servo_cmd),
+                             (MISSION_CMDS, handle_mission_cmd)]:
+    for word in words:
+        cmd_handlers[word] = cmd_handler
+
+# The network tasks. CircuitPython can't wait on its sockets (there's no
+# select() for socketpool), so they're polled, without blocking; each
+# poll is an accept() or recv() that usually finds nothing, and they
+# aren't cheap. So they're polled slowly until something turns up, then
+# quickly while a client is busy; see AdaptiveRate.
+HTTP_IDLE_HZ = 5       # A page starts loading within 200ms
+WEBSOCKET_IDLE_HZ = 10 # A command gets going within 100ms
+NET_BUSY_HZ = 50
+MAX_MESSAGES = 4       # Websocket messages handled per run
+
+def handle_http_requests():
+    if server.poll() == NO_REQUEST:
+        http_rate.idle()
+    else:
+        http_rate.busy()
+
+def handle_websocket_requests():
+    if websocket is None:
+        scheduler.task("websocket").enabled = False # Until connect_client()
+        return
+    handled = 0
+    while handled < MAX_MESSAGES and (data := websocket.receive(fail_silently=True)) is not None:
+        handled += 1
+        print("Received: "+data)
+        # websocket.send_message("Thanks for: " + data, fail_silently=True)
+        display_cmd(data)
+        execute_cmd(data)
+    for event in take_events():
+        websocket.send_message(event, fail_silently=True)
+        handled += 1
+    if handled:
+        websocket_rate.busy()
+    else:
+        websocket_rate.idle()
 
-async def handle_websocket_requests():
-    while True:
-        if websocket is not None:
-            if (data := websocket.receive(fail_silently=True)) is not None:
-                print("Received: "+data)
-                # websocket.send_message("Thanks for: " + data, fail_silently=True)
-                display_cmd(data)
-                execute_cmd(data)
+def send_telemetry():
+    if websocket is not None:
+        frame = pack_frame(ticks_ms(), get_distances(), get_pose(), throttles, queue_length(), battery_percent)
+        websocket.send_message(frame, fail_silently=True)
+
+def update_display():
+    global battery_percent
+    battery_percent = bm.cell_percent
+    display_battery(f"{battery_percent:.1f}")
+    (x, y, hdg, _, _) = get_pose()
+    display_heading(f"{hdg:.1f}")
+    display_distances(get_distances())
+    if x is None or y is None:
+        display_xy(None)
+    else:
+        display_xy((int(x), int(y)))
+
+# Everything periodic runs from one scheduler; 'stats' shows how each is keeping up.
+scheduler = Scheduler()
+scheduler.add("lidar", read_lidar_step, 1 / POLL_INTERVAL, PRIORITY_SENSORS) # Edges from data-ready interrupts, 10x per sensor
+scheduler.add("imu", read_imu_step, 1 / READ_INTERVAL, PRIORITY_SENSORS) # Draining the 104 Hz FIFO
+scheduler.add("pose", estimate_pose_step, 1 / UPDATE_INTERVAL, PRIORITY_CONTROL)
+scheduler.add("driving", driving_step, CONTROL_HZ, PRIORITY_CONTROL)
+scheduler.add("replan", replan_step, 1 / REPLAN_INTERVAL, PRIORITY_PLANNING) # Only replans when off the route
+scheduler.add("search", search_step, SEARCH_HZ, PRIORITY_PLANNING) # A slice of the search round obstacles, if one is going
+scheduler.add("point_lidar", point_lidar_step, 1 / POINT_INTERVAL, PRIORITY_PLANNING)
+http_rate = AdaptiveRate(scheduler.add("http", handle_http_requests, HTTP_IDLE_HZ, PRIORITY_BACKGROUND),
+                         HTTP_IDLE_HZ, NET_BUSY_HZ)
+websocket_rate = AdaptiveRate(scheduler.add("websocket", handle_websocket_requests, WEBSOCKET_IDLE_HZ, PRIORITY_BACKGROUND),
+                              WEBSOCKET_IDLE_HZ, NET_BUSY_HZ)
+scheduler.add("telemetry", send_telemetry, 10, PRIORITY_BACKGROUND).enabled = False # Until 'telemetry on'
+scheduler.add("recorder", recorder.flush_step, 1 / recorder.FLUSH_INTERVAL, PRIORITY_BACKGROUND)
+scheduler.add("display", update_display, 1, PRIORITY_BACKGROUND)
 
-        await async_sleep(0)
+async def main():
+    await scheduler.run()
 
-async def loop_update_display():
-    while True:
-        await async_sleep(1)
-        display_battery(f"{bm.cell_percent:.1f}")
-        display_heading(f"{current_heading():.1f}")
-        d = get_distances()
-        display_distances(d)
-        xy = upover_to_xy(d[0], d[1])
-        display_xy(xy)
 
-async def main():
-    await gather(
-        create_task(handle_http_requests()),
-        create_task(handle_websocket_requests()),
-        create_task(loop_update_display()), # 1x
-        create_task(loop_driving()), # 100x
-        create_task(loop_point_lidar()), # 10x
-        create_task(loop_read_lidar()), # 50x, but new data 10x
-        create_task(loop_replan()) # 1x
-    )
-
-
-run(main())
+# CircuitPython runs code.py as __main__; sim/ imports it to drive main() itself
+if __name__ == "__main__":
+    run(main())
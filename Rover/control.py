@@ -0,0 +1,152 @@
+import math
+from nav_utils import HeadingStopper, XStopper, YStopper, heading_diff
+
+# Closed-loop control of the driving actions.
+#
+# Straight segments (equal throttles, ending at an X or Y) get a distance
+# PID, which slows the rover down as the target gets near, plus a
+# heading-hold PID that steers back to the heading the segment started on.
+# Turns in place (opposite throttles, ending at a heading) follow a turn
+# rate that ramps down near the target, with a PID on the gyro's rate.
+# Anything else (arcs, plain 'drive') runs open loop as before.
+#
+# The gains are starting points, to be tuned on the rover.
+
+# Straight segments
+DIST_KP = 0.008   # throttle per mm to go; full speed from 125mm out
+DIST_KI = 0.0
+DIST_KD = 0.0005
+HOLD_KP = 0.03    # throttle difference per degree off heading
+HOLD_KI = 0.01
+HOLD_KD = 0.002
+MAX_STEER = 0.3
+MIN_THROTTLE = 0.25  # Below this the motors stall
+ARRIVE_MM = 5
+
+# Turns in place
+MAX_TURN_RATE = 180  # deg/s
+MIN_TURN_RATE = 20   # deg/s
+TURN_DECEL = 360     # deg/s^2; rate = sqrt(2 * TURN_DECEL * degrees to go)
+RATE_KP = 0.004      # throttle per deg/s too slow
+RATE_KI = 0.002
+RATE_KD = 0.0
+MIN_TURN_THROTTLE = 0.3
+ARRIVE_DEG = 1.5
+
+# Giving up, for when the pose freezes or runs away and the target never
+# comes: a segment gets DEADLINE_SLACK times as long as it would take at
+# EXPECT_MM_S (or EXPECT_DEG_S), and PROGRESS_S at a time to get
+# PROGRESS_MM (or PROGRESS_DEG) nearer its target.
+EXPECT_MM_S = 150    # Full throttle is about 300
+EXPECT_DEG_S = 45
+DEADLINE_SLACK = 2
+MIN_DEADLINE = 2     # s
+PROGRESS_S = 1.5
+PROGRESS_MM = 10
+PROGRESS_DEG = 5
+
+def clamp(val, min_val, max_val):
+    return max(min_val, min(max_val, val))
+
+class PID:
+    def __init__(self, kp, ki, kd, out_limit):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.out_limit = out_limit
+        self.reset()
+
+    def reset(self):
+        self.integral = 0
+        self.last_error = None
+
+    def update(self, error, dt):
+        if dt <= 0:
+            dt = 0.001
+        self.integral += error * dt
+        if self.ki > 0:
+            # Anti-windup: the integral alone can't ask for more than the limit
+            limit = self.out_limit / self.ki
+            self.integral = clamp(self.integral, -limit, limit)
+        deriv = 0 if self.last_error is None else (error - self.last_error) / dt
+        self.last_error = error
+        out = self.kp * error + self.ki * self.integral + self.kd * deriv
+        return clamp(out, -self.out_limit, self.out_limit)
+
+# Steers one (left_throttle, right_throttle, stop_condition) action.
+# gave_up is None, or why the action was given up on: then update() has
+# stopped the motors, and it's for the caller to drop the action.
+class SegmentController:
+    def __init__(self, action, curr_hdg):
+        self.action = action
+        (left_thr, right_thr, stop_condition) = action
+        self.stop_condition = stop_condition
+        self.gave_up = None
+        self.elapsed = 0        # s
+        self.deadline = None    # s, set from the first remaining()
+        self.best_to_go = None  # Nearest it has got to the target...
+        self.best_elapsed = 0   # ...and when
+        if left_thr == right_thr and isinstance(stop_condition, (XStopper, YStopper)):
+            self.kind = 'straight'
+            self.hold_hdg = curr_hdg
+            self.dist_pid = PID(DIST_KP, DIST_KI, DIST_KD, abs(left_thr))
+            self.hold_pid = PID(HOLD_KP, HOLD_KI, HOLD_KD, MAX_STEER)
+        elif left_thr == -right_thr and isinstance(stop_condition, HeadingStopper):
+            self.kind = 'turn'
+            self.rate_pid = PID(RATE_KP, RATE_KI, RATE_KD, 1)
+        else:
+            self.kind = 'open'
+
+    # Checks the action is getting to its target in time.  Only those with
+    # a stopper that says how far they have to go are checked; plain
+    # 'drive' and waits run until they're stopped.
+    def _check_progress(self, curr_x, curr_y, curr_hdg, dt):
+        if not hasattr(self.stop_condition, 'remaining'):
+            return None
+        self.elapsed += dt
+        to_go = self.stop_condition.remaining(curr_x, curr_y, curr_hdg)
+        stopper = getattr(self.stop_condition, 'stopper', self.stop_condition)
+        turning = isinstance(stopper, HeadingStopper)
+        if self.deadline is None:
+            self.deadline = max(MIN_DEADLINE, DEADLINE_SLACK * to_go / (EXPECT_DEG_S if turning else EXPECT_MM_S))
+            self.best_to_go = to_go
+        if to_go <= self.best_to_go - (PROGRESS_DEG if turning else PROGRESS_MM):
+            self.best_to_go = to_go
+            self.best_elapsed = self.elapsed
+        if self.elapsed > self.deadline:
+            return f"not there after {self.elapsed:.1f}s"
+        if self.elapsed - self.best_elapsed > PROGRESS_S:
+            return f"no nearer in {PROGRESS_S}s, {to_go:.0f} to go"
+        return None
+
+    # Returns (left_throttle, right_throttle, arrived)
+    def update(self, curr_x, curr_y, curr_hdg, hdg_rate, dt):
+        (left_thr, right_thr, _) = self.action
+        if self.gave_up is None:
+            self.gave_up = self._check_progress(curr_x, curr_y, curr_hdg, dt)
+        if self.gave_up is not None:
+            return (0, 0, False)
+        if self.kind == 'straight':
+            to_go = self.stop_condition.remaining(curr_x, curr_y, curr_hdg)
+            if to_go <= ARRIVE_MM:
+                return (0, 0, True)
+            speed = max(MIN_THROTTLE, self.dist_pid.update(to_go, dt))
+            sign = 1 if left_thr > 0 else -1
+            (dir, off) = heading_diff(curr_hdg, self.hold_hdg)
+            # Turning right (clockwise) takes the left wheel faster,
+            # whichever way the rover is going.
+            steer = self.hold_pid.update(off if dir == 'right' else -off, dt)
+            return (clamp(sign * speed + steer, -1, 1), clamp(sign * speed - steer, -1, 1), False)
+        if self.kind == 'turn':
+            to_go = self.stop_condition.remaining(curr_x, curr_y, curr_hdg)
+            if to_go <= ARRIVE_DEG:
+                return (0, 0, True)
+            want_rate = clamp(math.sqrt(2 * TURN_DECEL * to_go), MIN_TURN_RATE, MAX_TURN_RATE)
+            # How fast we're turning towards the target
+            rate = hdg_rate if self.stop_condition.dir == 'right' else -hdg_rate
+            thr = want_rate / MAX_TURN_RATE + self.rate_pid.update(want_rate - rate, dt)
+            thr = clamp(thr, MIN_TURN_THROTTLE, 1)
+            if self.stop_condition.dir == 'right':
+                return (thr, -thr, False)
+            return (-thr, thr, False)
+        return (left_thr, right_thr, False)
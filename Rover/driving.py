@@ -1,58 +1,223 @@
 from asyncio import sleep as async_sleep
+from asyncio import create_task
 import math
 from adafruit_motorkit import MotorKit
-from imu import current_heading
-from lidar import get_distances
-from nav_utils import HeadingStopper, XStopper, YStopper, heading_diff
+from adafruit_ticks import ticks_ms, ticks_diff
+from pose import current_xy, current_pose_heading, get_heading_rate, get_pose, BOARD_X_MM, BOARD_Y_MM
+from planning import clamp_heading, hybrid_astar_steps, path_clear, path_extent, shortest_path, track_error
+from occupancy import OccupancyGrid
+from servos import sweep_lidar
+from control import SegmentController
+from recorder import record
+from flight_log import REC_CONTROL, REC_GOAL, REC_SEGMENT, REC_ACTION, REC_STOP, deci_degrees
+from nav_utils import HeadingStopper, TimeStopper, XStopper, YStopper, PredictiveStopper, StopModel, analyze_stop_trace, heading_diff
 
 # Motor Stuff
 motorkit = MotorKit() # Implicit args: address=0x60, i2c=board.I2C()
+throttles = [0, 0] # As last set, left and right; reading them back from the board means I2C traffic
 
 
 def _set_throttles(thr1, thr2):
+    throttles[0] = thr1
+    throttles[1] = thr2
     motorkit.motor1.throttle = thr1
     motorkit.motor2.throttle = thr2
     return (True, None) # Success; returning this tuple is helpful for next layer up
 
 WHEEL_SEP = 98 # mm
 
+# For navto's Dubins paths: the arena is the area the LIDARs measure,
+# and the rover keeps its middle this far from the edges.
+MIN_TURN_RADIUS = 80 # mm
+ARENA_MARGIN = 50 # mm
+# The LIDAR servo can only follow headings up to 90 degrees either side of
+# up (see servos.point_lidar_to_calibrated_heading()), so the arcs and
+# straights stay within them, as (centre, half width).  Getting to or from
+# a heading outside is a turn in place, standing still.
+LIDAR_HEADINGS = (0, 90)
+# What 'map sweep' has seen on the board; navto plans round it.  See
+# bench_map.py for how the cell size trades memory against plan time.
+MAP_CELL_MM = 20
+ROVER_CLEARANCE = 90 # mm from the rover's middle to anything on the board
+arena_map = OccupancyGrid(BOARD_X_MM, BOARD_Y_MM, MAP_CELL_MM)
+# The search for a way round takes far longer than a control period, so
+# search_step() runs it a slice at a time while the rover stands still.
+# While it's going, this is (search, x, y, hdg) with the pose it's from.
+SEARCH_HZ = 50 # How often the scheduler runs search_step()
+route_search = None
+
 # Driving state
 # Can be simply a list of (left_throttle, right_throttle, stop_condition) tuples,
 # or that plus a nav_goal.
-# If there is a nav_goal, periodically clear the action_queue and recompute it.
+# If there is a nav_goal, replan_step() watches how far the rover strays
+# from the route, and replaces the rest of the action_queue when it's off.
 action_queue = [] # List of (left_throttle, right_throttle, stop_condition) tuples
+# What each action in action_queue should trace out, as (x0, y0, hdg0, kind)
+# for planning.track_error(), or None for actions that aren't part of a route
+action_tracks = []
 nav_goal = None # If not None, a (x_mm, y_mm, heading_deg) tuple
+# What to do when the route (or last action) is finished, instead of
+# stopping: a function that starts something else and returns True, or
+# returns False to let the rover stop.  mission.py uses it to go straight
+# from one leg to the next.  driving_stop() clears it.
+on_route_done = None
 _set_throttles(0, 0)
 
+# How the rover stops at each throttle; see calibrate_stops()
+STOP_CAL_FILE = "/stop_calibration.json"
+STOP_CAL_THROTTLES = [0.4, 0.7, 1.0]
+# Each run drives straight ahead for a second at up to full throttle
+# (then back), so calibrating needs this much clear board in front
+STOP_CAL_CLEARANCE = 400 # mm
+stop_model = StopModel.load(STOP_CAL_FILE)
+calibrating = False
+
+# Replanning: how far off its current action the rover can get before the
+# route is worked out again.  It has to be off for OFF_TRACK_CHECKS checks,
+# and a check only counts as back on track within half of these, so noise
+# near the limits doesn't replan over and over.
+MAX_CROSS_TRACK = 30 # mm
+MAX_HEADING_ERROR = 15 # deg
+OFF_TRACK_CHECKS = 3
+MIN_CONFIDENCE = 0.5 # Don't replan from a pose this doubtful
+REPLAN_INTERVAL = 0.1 # s, how often the scheduler runs replan_step()
+# Within this of the goal, a Dubins path could only loop round it: the
+# rover turns to face the goal, creeps there, and turns to the goal's
+# heading, and doesn't replan on the way.
+NEAR_GOAL = MIN_TURN_RADIUS # mm
+CREEP_THROTTLE = 0.5
+replan_stats = {
+    'checks': 0,
+    'replans': 0,
+    'avoided': 0,  # Checks that left the route running
+    'doubtful': 0, # Checks skipped for a low-confidence pose
+    'near goal': 0, # Checks skipped for finishing off near the goal
+}
+off_track_checks = 0 # In a row
+# How many actions a navto can give up on (see
+# SegmentController.gave_up) and still replan, before it stops for good
+MAX_GIVE_UPS = 2
+give_ups = 0
+navto_aborted = False  # Whether the last navto stopped by giving up
+
 def driving_stop():
-    global action_queue, nav_goal
+    global action_queue, nav_goal, calibrating, on_route_done, route_search
     _set_throttles(0, 0)
     action_queue.clear()
+    action_tracks.clear()
+    nav_goal = None
+    route_search = None
+    calibrating = False
+    on_route_done = None
+
+def _route_done():
+    global nav_goal
     nav_goal = None
+    if on_route_done is None or not on_route_done():
+        driving_stop()
+
+def is_idle():
+    return nav_goal is None and len(action_queue) == 0 and not calibrating
+
+def queue_length():
+    return len(action_queue)
 
 def _start_first_action():
     global action_queue
     if len(action_queue) > 0:
         (left_thr, right_thr, _) = action_queue[0]
-        motorkit.motor1.throttle = left_thr
-        motorkit.motor2.throttle = right_thr
+        _set_throttles(left_thr, right_thr)
+        _record_action(action_queue[0])
+
+# For the flight recorder; see flight_log.py for what goes in the records
+def _record_action(action):
+    (left_thr, right_thr, stopper) = action
+    predictive = isinstance(stopper, PredictiveStopper)
+    if predictive:
+        stopper = stopper.stopper
+    if isinstance(stopper, XStopper):
+        (kind, target, start, dir) = ('X', stopper.target_x, _current_xy()[0], 1 if stopper.dir == 'right' else -1)
+    elif isinstance(stopper, YStopper):
+        (kind, target, start, dir) = ('Y', stopper.target_y, _current_xy()[1], 1 if stopper.dir == 'Up' else -1)
+    elif isinstance(stopper, HeadingStopper):
+        (kind, target, start, dir) = ('H', deci_degrees(stopper.target_hdg), deci_degrees(current_pose_heading()),
+                                      1 if stopper.dir == 'right' else -1)
+    elif isinstance(stopper, TimeStopper):
+        (kind, target, start, dir) = ('T', stopper.seconds * 100, 0, 1)
+    else:
+        (kind, target, start, dir) = ('-', 0, 0, 1)
+    record(REC_ACTION, ord(kind.lower() if predictive else kind), left_thr * 1000, right_thr * 1000,
+           target, start or 0, dir)
+
+def _record_stop(why, stopper, x, y, hdg):
+    remaining = 0
+    if hasattr(stopper, 'remaining'):
+        remaining = stopper.remaining(x, y, hdg)
+        if isinstance(stopper, HeadingStopper) or isinstance(getattr(stopper, 'stopper', None), HeadingStopper):
+            remaining *= 10
+    record(REC_STOP, ord(why), x, y, deci_degrees(hdg), remaining)
 
 def _enqueue_action(left_thr, right_thr, stop_condition):
     global action_queue
     action_queue.append( (left_thr, right_thr, stop_condition) )
+    action_tracks.append(None)
     if len(action_queue) == 1:
         # If this is the FIRST action, start it right away
         _start_first_action()
     return (True, None) # Success
 
+# Starting the moves that finish by themselves; for handle_driving_cmd()
+# and missions
+def start_arc(arc_dir, radius, stop_hdg):
+    return _enqueue_action(*_arc_action(arc_dir, radius, current_pose_heading(), stop_hdg))
+
+def start_navto(goal):
+    global nav_goal, give_ups, navto_aborted
+    nav_goal = goal
+    give_ups = 0
+    navto_aborted = False
+    record(REC_GOAL, 0, goal[0], goal[1], deci_degrees(goal[2]))
+    _plan_and_start_route()
+    return (True, None)
+
+def start_wait(seconds):
+    return _enqueue_action(0, 0, TimeStopper(seconds))
+
+DRIVING_CMDS = ['drive', 'stop', 'rotate', 'arc', 'navto', 'calibrate', 'replans', 'map']
+
 def handle_driving_cmd(cmd):
-    global nav_goal
     cmd_words = cmd.split()
-    if cmd_words[0] not in ['drive', 'stop', 'rotate', 'arc', 'navto']:
+    if cmd_words[0] not in DRIVING_CMDS:
         return (False, 'Not for me')
     if cmd == 'stop':
         driving_stop()
         return (True, None)
+    if cmd == 'replans':
+        return (True, ", ".join([f"{k}: {v}" for (k, v) in replan_stats.items()]))
+    if cmd == 'calibrate':
+        if not is_idle():
+            return (True, 'Busy, stop first')
+        if None in _current_xy():
+            return (True, 'No position yet, wait for the LIDARs')
+        if not _clear_ahead(STOP_CAL_CLEARANCE):
+            return (True, f'Not enough clear board ahead, calibrating needs {STOP_CAL_CLEARANCE // 10}cm')
+        create_task(calibrate_stops())
+        return (True, 'Calibrating stops')
+    if cmd == 'calibrate show':
+        return (True, str(stop_model))
+    if cmd == 'map':
+        return (True, str(arena_map))
+    if cmd == 'map clear':
+        arena_map.clear()
+        return (True, None)
+    if cmd == 'map sweep':
+        if not is_idle():
+            return (True, 'Busy, stop first')
+        create_task(sweep_lidar(arena_map))
+        return (True, 'Sweeping the LIDARs, keep the rover still')
+    if (calibrating or route_search is not None) and cmd_words[0] in ['drive', 'rotate', 'arc', 'navto']:
+        # calibrate_stops() drives the motors itself, and a route search holds them still
+        return (True, 'Busy, stop first')
     if cmd == 'drive':
         return _enqueue_action(1, 1, None)
     if cmd == 'rotate left':
@@ -64,15 +229,9 @@ def handle_driving_cmd(cmd):
             arc_dir = cmd_words[1]
             arc_radius = int(cmd_words[2])
             arc_stop_at_hdg = int(cmd_words[3])
-            inner_wheel_speed = (arc_radius - (WHEEL_SEP / 2)) / (arc_radius + (WHEEL_SEP / 2))
-            stop_condition = HeadingStopper(current_heading(), arc_dir, arc_stop_at_hdg)
-            if arc_dir == 'left':
-                _enqueue_action(inner_wheel_speed, 1, stop_condition)
-            elif arc_dir == 'right':
-                _enqueue_action(1, inner_wheel_speed, stop_condition)
-            else:
+            if arc_dir not in ['left', 'right']:
                 return (True, 'Invalid arc direction')
-            return (True, None)
+            return start_arc(arc_dir, arc_radius, arc_stop_at_hdg)
         except ValueError:
             return (True, 'Malformed arc cmd')
     if cmd_words[0] == 'navto':
@@ -82,121 +241,359 @@ def handle_driving_cmd(cmd):
             x_mm = int(cmd_words[1])
             y_mm = int(cmd_words[2])
             heading_deg = int(cmd_words[3])
-            nav_goal = (x_mm, y_mm, heading_deg)
-            _plan_and_start_route()
-            return (True, None)
         except ValueError:
             return (True, 'Malformed navto command')
+        if None in _current_xy():
+            # The LIDARs only reach the walls with the rover facing up the board
+            return (True, 'No position yet, turn the rover to face up the board')
+        return start_navto((x_mm, y_mm, heading_deg))
     else:
         return (True, 'Malformed driving command')
 
-def upover_to_xy(up_mm, over_mm):
-    x = 1160 - over_mm  # mm
-    y = 1060 - up_mm    # mm
-    return (x, y)
+# An action driving round a circle of the given radius until the heading
+# reaches stop_hdg
+def _arc_action(arc_dir, radius, curr_hdg, stop_hdg):
+    inner_wheel_speed = (radius - (WHEEL_SEP / 2)) / (radius + (WHEEL_SEP / 2))
+    stop_condition = PredictiveStopper(HeadingStopper(curr_hdg, arc_dir, stop_hdg), 1, stop_model)
+    if arc_dir == 'left':
+        return (inner_wheel_speed, 1, stop_condition)
+    return (1, inner_wheel_speed, stop_condition)
 
+# Position and heading come from the pose estimator, which keeps
+# predicting between LIDAR readings
 def _current_xy():
-    [dst_up, dist_over] = get_distances()
-    x = 1160 - dist_over  # mm
-    y = 1060 - dst_up     # mm
-    return (x, y)
+    return current_xy()
+
+# Plans are lists of (action, track) pairs; see action_tracks
 
-def _add_rotation_to_plan_if_needed(plan, hdg1, hdg2):
+def _add_rotation_to_plan_if_needed(plan, x, y, hdg1, hdg2):
     (dir, n_deg) = heading_diff(hdg1, hdg2)
     if n_deg > 5:
-        plan.append((
+        plan.append(((
             -1 if dir == 'left' else 1,
             1 if dir == 'left' else -1,
             HeadingStopper(hdg1, dir, hdg2)
-        ))
+        ), (x, y, hdg1, 'P')))
 
+# Turns the shortest Dubins path to the goal into arc and straight
+# actions, keeping to LIDAR_HEADINGS: if the rover or the goal is facing
+# outside them, it turns in place at the start or the end.  Returns None
+# if the path runs into something on the map (or out of the arena), for
+# _start_search() to look for a way round.
+def _dubins_plan(curr_x, curr_y, curr_hdg, goal):
+    (goal_x, goal_y, final_hdg) = goal
+    start_hdg = clamp_heading(curr_hdg, LIDAR_HEADINGS)
+    end_hdg = clamp_heading(final_hdg, LIDAR_HEADINGS)
+    best = shortest_path(BOARD_X_MM, BOARD_Y_MM, curr_x, curr_y, start_hdg, goal_x, goal_y, end_hdg,
+                         MIN_TURN_RADIUS, ARENA_MARGIN, LIDAR_HEADINGS)
+    if best is None or not path_clear(arena_map, curr_x, curr_y, start_hdg, best[1],
+                                      MIN_TURN_RADIUS, ROVER_CLEARANCE, ARENA_MARGIN):
+        return None
+    return _segments_plan(curr_x, curr_y, curr_hdg, start_hdg, best[1], goal)
+
+# The actions for a path of segments from (curr_x, curr_y), turning in
+# place from curr_hdg to start_hdg first and from the path's end to the
+# goal's heading last
+def _segments_plan(curr_x, curr_y, curr_hdg, start_hdg, segments, goal):
+    (goal_x, goal_y, final_hdg) = goal
+    end_hdg = clamp_heading(final_hdg, LIDAR_HEADINGS)
+    plan = []
+    _add_rotation_to_plan_if_needed(plan, curr_x, curr_y, curr_hdg, start_hdg)
+    (x, y, hdg) = (curr_x, curr_y, start_hdg)
+    for (kind, length) in segments:
+        ((next_x, next_y, next_hdg), _) = path_extent(x, y, hdg, [(kind, length)], MIN_TURN_RADIUS)
+        if kind == 'S':
+            if length >= 5:
+                if abs(next_x - x) > abs(next_y - y):
+                    plan.append(((1, 1, XStopper(x, next_x)), (x, y, hdg, 'S')))
+                else:
+                    plan.append(((1, 1, YStopper(y, next_y)), (x, y, hdg, 'S')))
+        elif math.degrees(length / MIN_TURN_RADIUS) >= 2:
+            plan.append((_arc_action('left' if kind == 'L' else 'right', MIN_TURN_RADIUS, hdg, next_hdg), (x, y, hdg, kind)))
+        (x, y, hdg) = (next_x, next_y, next_hdg)
+    _add_rotation_to_plan_if_needed(plan, goal_x, goal_y, end_hdg, final_hdg)
+    return plan
+
+# Turns to face the goal and drives straight there, backwards if that
+# keeps the rover facing within LIDAR_HEADINGS
+def _straight_plan(plan, curr_x, curr_y, curr_hdg, goal_x, goal_y, throttle):
+    dx = goal_x - curr_x
+    dy = goal_y - curr_y
+    hdg_to_goal = math.degrees(math.atan2(dx, dy)) % 360 # (dx,dy) because 0 deg is Up.
+    #print(f"  bearing to goal: {hdg_to_goal}")
+    go_backwards = False
+    if hdg_to_goal > 90 and hdg_to_goal < 270:
+        hdg_to_goal = (hdg_to_goal + 180) % 360
+        go_backwards = True
+        #print(f"   but go backwards, point to {hdg_to_goal}")
+    _add_rotation_to_plan_if_needed(plan, curr_x, curr_y, curr_hdg, hdg_to_goal)
+    # Now drive straight to the goal position
+    thr = -throttle if go_backwards else throttle
+    track = (curr_x, curr_y, hdg_to_goal, 'S')
+    if (abs(dx) > abs(dy)):
+        # More X movement than Y movement
+        plan.append( ((thr, thr, XStopper(curr_x, goal_x)), track) )
+    else:
+        plan.append( ((thr, thr, YStopper(curr_y, goal_y)), track) )
+    return hdg_to_goal
+
+# Returns the plan, or None if it needs a search round something on the
+# map first
 def _plan_route_to(goal):
     plan = []
     (goal_x, goal_y, final_hdg) = goal
     (curr_x, curr_y) = _current_xy()
-    curr_hdg = current_heading()
+    curr_hdg = current_pose_heading()
     #print(f"plan ({curr_x}, {curr_y}, {curr_hdg}) to ({goal_x}, {goal_y}, {final_hdg})")
-    dx = goal_x - curr_x
-    dy = goal_y - curr_y
-    #print(f"  delta: ({dx}, {dy})")
-    if (dx**2 + dy**2) > 400: # More than 20mm away
-        hdg_to_goal = math.degrees(math.atan2(dx, dy)) % 360 # (dx,dy) because 0 deg is Up.
-        #print(f"  bearing to goal: {hdg_to_goal}")
-        go_backwards = False
-        if hdg_to_goal > 90 and hdg_to_goal < 270:
-            hdg_to_goal = (hdg_to_goal + 180) % 360
-            go_backwards = True
-            #print(f"   but go backwards, point to {hdg_to_goal}")
-        _add_rotation_to_plan_if_needed(plan, curr_hdg, hdg_to_goal)
-        # Now drive straight to the goal position
-        thr = -1 if go_backwards else 1
-        if (abs(dx) > abs(dy)):
-            # More X movement than Y movement
-            plan.append( (thr, thr, XStopper(curr_x, goal_x)) )
-        else:
-            plan.append( (thr, thr, YStopper(curr_y, goal_y)) )
+    dist = math.hypot(goal_x - curr_x, goal_y - curr_y)
+    if dist > NEAR_GOAL:
+        # Drive there in one smooth path if we can
+        dubins = _dubins_plan(curr_x, curr_y, curr_hdg, goal)
+        if dubins is not None or arena_map.num_occupied() > 0:
+            return dubins # None has _plan_and_start_route() search round what's on the map
+        # If not (say, too near the edge to turn), turn to face it and drive straight
+        _straight_plan(plan, curr_x, curr_y, curr_hdg, goal_x, goal_y, 1)
+    elif dist > 20:
+        # Nearly there: creep the rest of the way, then turn to the final heading
+        hdg = _straight_plan(plan, curr_x, curr_y, curr_hdg, goal_x, goal_y, CREEP_THROTTLE)
+        _add_rotation_to_plan_if_needed(plan, goal_x, goal_y, hdg, final_hdg)
     else:
         # If we're within 2cm of the goal position, just turn in place to final heading
-        _add_rotation_to_plan_if_needed(plan, curr_hdg, final_hdg)
+        _add_rotation_to_plan_if_needed(plan, curr_x, curr_y, curr_hdg, final_hdg)
     #print("Planned route:")
     #if plan is not None:
-    #    for t in plan:
+    #    for (t, _) in plan:
     #        print("  ", t[0], t[1], t[2])
     #print("------------")
     return plan
 
 def _plan_and_start_route():
-    global action_queue, nav_goal
     new_plan = _plan_route_to(nav_goal)
-    if len(new_plan) == 0:
-        driving_stop()
-        action_queue.clear()
-        nav_goal = None
+    if new_plan is None:
+        _start_search()
+    elif len(new_plan) == 0:
         #print("---Navto is complete")
+        _route_done()
     else:
-        action_queue = new_plan
-        # Start the first action right away
-        _start_first_action()
+        _start_plan(new_plan)
 
-# Returns a distance in mm, or None
-def _distance_to_goal_if_any():
-    global nav_goal
-    if nav_goal is None:
-        return None
+def _start_plan(plan):
+    global action_queue, action_tracks
+    action_queue = [action for (action, _) in plan]
+    action_tracks = [track for (_, track) in plan]
+    for (i, (x0, y0, hdg0, kind)) in enumerate(action_tracks):
+        record(REC_SEGMENT, ord(kind), x0, y0, deci_degrees(hdg0), i)
+    # Start the first action right away
+    _start_first_action()
+
+# Stops the rover and empties the queue, so driving_step() and
+# replan_step() have nothing to do, and starts search_step() looking for a
+# way round whatever is in the way
+def _start_search():
+    global route_search
+    _set_throttles(0, 0)
+    action_queue.clear()
+    action_tracks.clear()
     (curr_x, curr_y) = _current_xy()
-    (goal_x, goal_y, goal_hdg) = nav_goal
-    return math.sqrt(math.pow(goal_x-curr_x, 2) + math.pow(goal_y-curr_y, 2))
+    curr_hdg = current_pose_heading()
+    (goal_x, goal_y, final_hdg) = nav_goal
+    search = hybrid_astar_steps(arena_map, curr_x, curr_y, curr_hdg, goal_x, goal_y,
+                                clamp_heading(final_hdg, LIDAR_HEADINGS), MIN_TURN_RADIUS, ROVER_CLEARANCE,
+                                ARENA_MARGIN, heading_window=LIDAR_HEADINGS)
+    route_search = (search, curr_x, curr_y, curr_hdg)
 
-async def loop_driving():
-    global action_queue
-    while True:
-        await async_sleep(0.01)
-        if len(action_queue) == 0:
-            continue
-        (curr_x, curr_y) = _current_xy()
-        (thr_left, thr_right, stop_condition) = action_queue[0]
-        dst_to_goal = _distance_to_goal_if_any()
-        if dst_to_goal is not None and dst_to_goal < 100: # Slow down within 10cm of goal
-            _set_throttles(thr_left * .75, thr_right * .75)
+# Runs the next slice of the search _start_search() started, and when it's
+# done starts the route it found.  If there's no way round (say, too near
+# the edge to turn), turns to face the goal and drives straight.
+def search_step():
+    global route_search
+    if route_search is None:
+        return
+    (search, x, y, hdg) = route_search
+    try:
+        next(search)
+        return
+    except StopIteration as done:
+        best = done.value
+    route_search = None
+    if best is None:
+        plan = []
+        _straight_plan(plan, x, y, hdg, nav_goal[0], nav_goal[1], 1)
+    else:
+        plan = _segments_plan(x, y, hdg, best[2], best[1], nav_goal)
+    _start_plan(plan)
+
+CONTROL_HZ = 50 # How often the scheduler runs driving_step()
+controller = None # SegmentController for action_queue[0]
+controller_ticks = None # When it started, for the stoppers' times
+last_control_ticks = None
+
+def driving_step():
+    global controller, controller_ticks, last_control_ticks
+    now = ticks_ms()
+    dt = 1 / CONTROL_HZ if last_control_ticks is None else ticks_diff(now, last_control_ticks) / 1000
+    last_control_ticks = now
+    if len(action_queue) == 0:
+        controller = None
+        return
+    (curr_x, curr_y) = _current_xy()
+    if curr_x is None or curr_y is None:
+        return # No LIDAR readings yet
+    curr_hdg = current_pose_heading()
+    (_, _, stop_condition) = action_queue[0]
+    if controller is None or controller.action is not action_queue[0]:
+        controller = SegmentController(action_queue[0], curr_hdg)
+        controller_ticks = now
+    (thr_left, thr_right, arrived) = controller.update(curr_x, curr_y, curr_hdg, get_heading_rate(), dt)
+    if controller.gave_up is not None:
+        _give_up_action(controller.gave_up, stop_condition, curr_x, curr_y, curr_hdg)
+        return
+    why = 'C'
+    if not arrived and stop_condition is not None:
+        # Open-loop actions stop here; closed-loop ones only if they overshoot
+        arrived = stop_condition.should_stop(curr_x, curr_y, curr_hdg, ticks_diff(now, controller_ticks) / 1000)
+        why = 'S'
+    if not arrived:
+        _set_throttles(thr_left, thr_right)
+        record(REC_CONTROL, int(get_pose()[4] * 100), curr_x, curr_y, deci_degrees(curr_hdg),
+               thr_left * 1000, thr_right * 1000)
+    else:
+        _record_stop(why, stop_condition, curr_x, curr_y, curr_hdg)
+        action_queue.pop(0)
+        action_tracks.pop(0)
+        if len(action_queue) > 0:
+            # Start the next action
+            _start_first_action()
         else:
-            _set_throttles(thr_left, thr_right)
-        if stop_condition is not None:
-            if stop_condition.should_stop(curr_x, curr_y, current_heading()):
-                action_queue.pop(0)
-                if len(action_queue) > 0:
-                    # Start the next action
-                    _start_first_action()
-                else:
-                    if nav_goal is None:
-                        driving_stop()
-                    else:
-                        # Give the planner one more chance to put us on track
-                        _plan_and_start_route()
+            if nav_goal is None:
+                _route_done()
+            else:
+                # Give the planner one more chance to put us on track
+                _plan_and_start_route()
 
-async def loop_replan():
-    global nav_goal
-    while True:
-        await async_sleep(1)
-        #continue # HACK: Disable replanning for now
-        if nav_goal is not None:
-            _plan_and_start_route()
+# The current action isn't getting to its target: the pose has frozen or
+# run away, or something is in the way.  Stops the motors, and replans if
+# the pose can be trusted, otherwise stops altogether.
+def _give_up_action(why, stop_condition, x, y, hdg):
+    global give_ups, navto_aborted
+    _set_throttles(0, 0)
+    _record_stop('G', stop_condition, x, y, hdg)
+    print(f"Gave up on {stop_condition}: {why}")
+    give_ups += 1
+    if nav_goal is not None and give_ups <= MAX_GIVE_UPS and get_pose()[4] >= MIN_CONFIDENCE:
+        _plan_and_start_route()
+    else:
+        navto_aborted = nav_goal is not None
+        driving_stop()
+
+# Runs the motors for a second, stops them, and records position() until
+# the rover has settled.  Returns (speed, latency, coast).
+async def _stop_trace(left_thr, right_thr, position):
+    trace = []
+    start = ticks_ms()
+    stop_t = None
+    _set_throttles(left_thr, right_thr)
+    while calibrating:
+        t = ticks_diff(ticks_ms(), start) / 1000
+        trace.append((t, position()))
+        if stop_t is None and t >= 1.0:
+            _set_throttles(0, 0)
+            stop_t = t
+        if stop_t is not None and t >= stop_t + 1.0:
+            return analyze_stop_trace(trace, stop_t)
+        await async_sleep(0.02)
+    return None
+
+# Whether the rover can drive 'distance' mm straight ahead, keeping clear
+# of the arena's edges and of what's on the map
+def _clear_ahead(distance):
+    (x, y) = _current_xy()
+    return path_clear(arena_map, x, y, current_pose_heading(), [('S', distance)],
+                      MIN_TURN_RADIUS, ROVER_CLEARANCE, ARENA_MARGIN)
+
+def _distance_along(x0, y0, hdg):
+    dx = math.sin(math.radians(hdg))
+    dy = math.cos(math.radians(hdg))
+    def position():
+        (x, y) = _current_xy()
+        return (x - x0) * dx + (y - y0) * dy
+    return position
+
+def _degrees_turned():
+    turned = [0, current_pose_heading()]
+    def position():
+        (dir, n_deg) = heading_diff(turned[1], current_pose_heading())
+        turned[0] += n_deg if dir == 'right' else -n_deg
+        turned[1] = current_pose_heading()
+        return turned[0]
+    return position
+
+# Measures how far the rover goes after being told to stop, at each
+# throttle in STOP_CAL_THROTTLES: forward and back, then turning right and
+# left (so it ends up about where it started).  Saves the result to
+# STOP_CAL_FILE, for the PredictiveStoppers.  Gives up if the rover has
+# drifted to where there's no longer STOP_CAL_CLEARANCE in front of it.
+async def calibrate_stops():
+    global calibrating, stop_model
+    if None in _current_xy():
+        print("Can't calibrate stops without a position")
+        return
+    calibrating = True
+    latencies = []
+    coast_mm = {}
+    coast_deg = {}
+    for thr in STOP_CAL_THROTTLES:
+        if not _clear_ahead(STOP_CAL_CLEARANCE):
+            print("Stop calibration cancelled, not enough clear board ahead")
+            calibrating = False
+            return
+        runs = []
+        for sign in [1, -1]:
+            (x0, y0) = _current_xy()
+            runs.append(await _stop_trace(sign * thr, sign * thr, _distance_along(x0, y0, current_pose_heading())))
+        for sign in [1, -1]:
+            runs.append(await _stop_trace(sign * thr, -sign * thr, _degrees_turned()))
+        if None in runs:
+            print("Stop calibration cancelled")
+            return
+        latencies += [latency for (_, latency, _) in runs]
+        coast_mm[thr] = (runs[0][2] + runs[1][2]) / 2
+        coast_deg[thr] = (runs[2][2] + runs[3][2]) / 2
+    calibrating = False
+    stop_model = StopModel(sum(latencies) / len(latencies), coast_mm, coast_deg)
+    print(f"Calibrated: {stop_model}")
+    try:
+        stop_model.save(STOP_CAL_FILE)
+    except OSError as e:
+        # CIRCUITPY is read-only to code unless boot.py remounts it
+        print(f"Couldn't save {STOP_CAL_FILE}: {e}")
+
+# Compares the pose with where the current action should have the rover,
+# and only when it has strayed too far replans the rest of the way to the
+# goal.  Otherwise the route keeps running as it is.
+def replan_step():
+    global off_track_checks
+    if nav_goal is None or len(action_queue) == 0 or action_tracks[0] is None:
+        return
+    (curr_x, curr_y, curr_hdg, _, confidence) = get_pose()
+    if curr_x is None or curr_y is None:
+        return
+    replan_stats['checks'] += 1
+    if confidence < MIN_CONFIDENCE:
+        replan_stats['doubtful'] += 1
+        return
+    if math.hypot(nav_goal[0] - curr_x, nav_goal[1] - curr_y) <= NEAR_GOAL:
+        replan_stats['near goal'] += 1
+        return
+    (x0, y0, hdg0, kind) = action_tracks[0]
+    (cross_track, hdg_error) = track_error(x0, y0, hdg0, kind, MIN_TURN_RADIUS, curr_x, curr_y, curr_hdg)
+    if cross_track > MAX_CROSS_TRACK or hdg_error > MAX_HEADING_ERROR:
+        off_track_checks += 1
+    elif cross_track <= MAX_CROSS_TRACK / 2 and hdg_error <= MAX_HEADING_ERROR / 2:
+        off_track_checks = 0
+    if off_track_checks >= OFF_TRACK_CHECKS:
+        off_track_checks = 0
+        replan_stats['replans'] += 1
+        _plan_and_start_route()
+    else:
+        replan_stats['avoided'] += 1
@@ -0,0 +1,85 @@
+import struct
+
+# The flight recorder's log format, shared by recorder.py (which writes it
+# on the rover) and replay_log.py (which reads it on a desktop).
+#
+# A log is a run of fixed-size records, RECORD_SIZE bytes each, with no
+# header: the first record of every boot is a START.  Every record is
+#   B  kind, one of the REC_ values
+#   B  sub, whose meaning depends on the kind
+#   I  ticks_ms() when it was recorded
+#   5h a, b, c, d, e: the kind's values, below
+# except TEXT records, whose 10 value bytes are text.
+#
+# Units: positions are mm, headings are tenths of a degree (0-3599) and
+# throttles are thousandths (-1000 to 1000).
+#
+#   START    a: FORMAT_VERSION
+#   TEXT     sub: how many more TEXT records this text goes on for; the
+#            text is UTF-8, padded with zero bytes.  Commands as received,
+#            cut to recorder.MAX_TEXT_RECORDS records.
+#   LIDAR    sub: sensor (0 'up', 1 'over'); a: distance
+#   CONTROL  one driving_step() tick.  sub: pose confidence, percent;
+#            a, b: x, y; c: heading; d, e: left and right throttle set
+#   GOAL     a navto goal.  a, b: x, y; c: heading
+#   SEGMENT  one step of a new plan.  sub: its kind ('S', 'L', 'R' or
+#            'P'); a, b: x, y it starts from; c: heading it starts on;
+#            d: its place in the plan, from 0
+#   ACTION   an action starting.  sub: its stopper ('X', 'Y', 'H', 'T',
+#            or '-' for none), lower case if wrapped in a
+#            PredictiveStopper; a, b: left and right throttle; c: the
+#            stopper's target (x, y, heading, or for 'T' hundredths of a
+#            second); d: where it started from (x, y or heading); e: its
+#            direction, 1 (right/up) or -1 (left/down)
+#   STOP     an action finishing.  sub: 'C' if the controller said it had
+#            arrived, 'S' if the stopper did, 'G' if the controller gave
+#            up on it; a, b: x, y; c: heading;
+#            d: the stopper's remaining() then (mm, or tenths of a degree)
+
+RECORD_FORMAT = "<BBIhhhhh"
+TEXT_FORMAT = "<BBI10s"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)  # 16 bytes
+TEXT_BYTES = 10
+FORMAT_VERSION = 1
+
+REC_START = 1
+REC_TEXT = 2
+REC_LIDAR = 3
+REC_CONTROL = 4
+REC_GOAL = 5
+REC_SEGMENT = 6
+REC_ACTION = 7
+REC_STOP = 8
+
+KIND_NAMES = {REC_START: 'START', REC_TEXT: 'TEXT', REC_LIDAR: 'LIDAR', REC_CONTROL: 'CONTROL',
+              REC_GOAL: 'GOAL', REC_SEGMENT: 'SEGMENT', REC_ACTION: 'ACTION', REC_STOP: 'STOP'}
+
+def clamp16(value):
+    return max(-32768, min(32767, int(value)))
+
+def deci_degrees(hdg):
+    return int(hdg * 10) % 3600
+
+def pack_record(buf, offset, kind, sub, ticks, a=0, b=0, c=0, d=0, e=0):
+    struct.pack_into(RECORD_FORMAT, buf, offset, kind, sub, ticks,
+                     clamp16(a), clamp16(b), clamp16(c), clamp16(d), clamp16(e))
+
+def pack_text(buf, offset, ticks, more, chunk):
+    struct.pack_into(TEXT_FORMAT, buf, offset, REC_TEXT, more, ticks, chunk)
+
+def read_records(data):
+    """The records in a log, as (kind, sub, ticks, values), where values is
+    (a, b, c, d, e), or for TEXT the text.  A TEXT record comes back once,
+    with all of its text; a partial record at the end is left out."""
+    records = []
+    text = b""
+    for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        (kind, sub, ticks) = struct.unpack_from("<BBI", data, offset)
+        if kind == REC_TEXT:
+            text += struct.unpack_from(TEXT_FORMAT, data, offset)[3]
+            if sub == 0:
+                records.append((kind, 0, ticks, text.rstrip(b"\0").decode("utf-8", "replace")))
+                text = b""
+            continue
+        records.append((kind, sub, ticks, struct.unpack_from(RECORD_FORMAT, data, offset)[3:]))
+    return records
@@ -0,0 +1,31 @@
+# Gzips the pages code.py serves, for copying to the rover alongside them.
+# assets.py sends 'name.gz' in place of 'name' to browsers that take
+# gzip, which is most of the bytes off every page load.  Runs on a desktop
+# (CircuitPython can't compress):
+#
+#   python3 gzip_pages.py                 # client_ui.html and plan_ui.html
+#   python3 gzip_pages.py client_ui.html
+#
+# A gzipped page is sent as it is, without its placeholders (IPADDR)
+# filled in.  Delete the .gz from the rover to go back to the plain page.
+
+import argparse
+import gzip
+
+PAGES = ["client_ui.html", "plan_ui.html"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Gzip the rover's web pages")
+    parser.add_argument("pages", nargs="*", default=PAGES)
+    args = parser.parse_args()
+    for path in args.pages:
+        with open(path, "rb") as file:
+            body = file.read()
+        # mtime=0 keeps the output, and so its ETag, the same for the same page
+        packed = gzip.compress(body, 9, mtime=0)
+        with open(path + ".gz", "wb") as file:
+            file.write(packed)
+        print(f"{path}: {len(body)} bytes, {len(packed)} gzipped")
+
+if __name__ == "__main__":
+    main()
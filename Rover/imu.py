@@ -1,5 +1,9 @@
 import math
+import struct
 import board
+from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+from ring_buffer import SampleRing
+from adafruit_lsm6ds import Rate, AccelRange, GyroRange
 from adafruit_lsm6ds.lsm6dsox import LSM6DSOX as LSM6DS
 from adafruit_lis3mdl import LIS3MDL
 
@@ -15,13 +19,149 @@ def print_all_imu():
     print("Gyro          X:{0:7.2f}, Y:{1:7.2f}, Z:{2:7.2f} rad/s".format(*gyro))
     print("Magnetic      X:{0:7.2f}, Y:{1:7.2f}, Z:{2:7.2f} uT".format(*magnetic))
 
-def current_heading():
-    x, y, _ = accel_gyro.acceleration
+# The LSM6DSOX samples on its own at ODR, and batches every accel and
+# gyro sample into its hardware FIFO.  read_imu_step() empties the FIFO
+# every READ_INTERVAL in one burst read, instead of a pair of register
+# reads per sample (or per caller).
+ODR = Rate.RATE_104_HZ
+ODR_HZ = 104
+SAMPLE_MS = 1000 / ODR_HZ  # About 9.6, not a whole number of ms
+READ_INTERVAL = 0.02  # s; about two samples of each per read
+MAX_BURST = 32  # FIFO words per I2C read
+
+# Fixed ranges, so raw FIFO values can be scaled without asking the library
+accel_gyro.accelerometer_range = AccelRange.RANGE_4G
+accel_gyro.gyro_range = GyroRange.RANGE_500_DPS
+ACCEL_SCALE = 0.122 / 1000 * 9.80665      # raw -> m/s^2 (0.122 mg/LSB)
+GYRO_SCALE = 17.5 / 1000 * math.pi / 180  # raw -> rad/s (17.5 mdps/LSB)
+
+# LSM6DSOX FIFO registers (the library doesn't cover the FIFO)
+_FIFO_CTRL3 = 0x09   # Batch rates: gyro in bits 7:4, accel in bits 3:0
+_FIFO_CTRL4 = 0x0A   # FIFO mode in bits 2:0
+_FIFO_STATUS1 = 0x3A # Unread words, and overrun flags in STATUS2
+_FIFO_DATA_OUT_TAG = 0x78
+_FIFO_MODE_BYPASS = 0x00
+_FIFO_MODE_CONTINUOUS = 0x06
+_TAG_GYRO = 0x01
+_TAG_ACCEL = 0x02
+
+_buf = bytearray(7 * MAX_BURST)  # Each FIFO word is a tag byte plus x, y, z
+_status = bytearray(2)
+fifo_overruns = 0
+
+def _write_reg(reg, val):
+    with accel_gyro.i2c_device as dev:
+        dev.write(bytes([reg, val]))
+
+def _read_regs(reg, buf, n):
+    with accel_gyro.i2c_device as dev:
+        dev.write_then_readinto(bytes([reg]), buf, in_end=n)
+
+accel_gyro.accelerometer_data_rate = ODR
+accel_gyro.gyro_data_rate = ODR
+_write_reg(_FIFO_CTRL4, _FIFO_MODE_BYPASS)  # Empties the FIFO
+_write_reg(_FIFO_CTRL3, (ODR << 4) | ODR)   # Batch rate codes match ODR codes
+_write_reg(_FIFO_CTRL4, _FIFO_MODE_CONTINUOUS)
+
+# The last second or so of accelerometer (x, y, z in m/s^2) and gyro
+# (x, y, z in rad/s) samples, stamped with ticks_ms().  Only
+# read_imu_step() talks to the sensor; everything else reads these.
+HISTORY_SIZE = 128
+accel_history = SampleRing(HISTORY_SIZE, 3)
+gyro_history = SampleRing(HISTORY_SIZE, 3)
+
+# Each history's newest sample time, as (ticks_ms, fraction of a ms),
+# for _stamp_samples(); None before the first read
+_last_stamps = [None, None]
+
+# Heading and tilt from the newest accel sample, worked out once per read:
+# (ticks_ms, heading_deg, tilt_deg, parked_flat)
+latest_attitude = None
+
+def _drain_fifo():
+    global fifo_overruns
+    _read_regs(_FIFO_STATUS1, _status, 2)
+    words = _status[0] | ((_status[1] & 0x03) << 8)
+    if _status[1] & 0x40:
+        fifo_overruns += 1
+    accel = []
+    gyro = []
+    while words > 0:
+        n = min(words, MAX_BURST)
+        # The address wraps from the last data register back to the tag,
+        # so one read returns n whole words.
+        _read_regs(_FIFO_DATA_OUT_TAG, _buf, 7 * n)
+        for w in range(n):
+            tag = _buf[7 * w] >> 3
+            if tag == _TAG_ACCEL:
+                accel.append(struct.unpack_from("<hhh", _buf, 7 * w + 1))
+            elif tag == _TAG_GYRO:
+                gyro.append(struct.unpack_from("<hhh", _buf, 7 * w + 1))
+        words -= n
+    now = ticks_ms()
+    for (i, history, samples, scale) in [(0, accel_history, accel, ACCEL_SCALE), (1, gyro_history, gyro, GYRO_SCALE)]:
+        (stamps, _last_stamps[i]) = _stamp_samples(_last_stamps[i], len(samples), now)
+        for ((x, y, z), when) in zip(samples, stamps):
+            history.append(when, (x * scale, y * scale, z * scale))
+
+# The ticks_ms() times of n new samples, and the new last stamp.  They
+# follow on from the last sample SAMPLE_MS apart, as the sensor took them,
+# so times never go backwards from one read to the next.  Only when that
+# puts them well behind now (the first read, or lost samples) are they
+# counted back from now instead; and if the sensor's clock runs slow enough
+# to put them past now, they're spread out up to it.
+def _stamp_samples(last, n, now):
+    if n == 0:
+        return ([], last)
+    if last is not None:
+        (ticks, frac) = last
+        lag = ticks_diff(now, ticks) - (frac + n * SAMPLE_MS)
+        if 0 <= lag <= 2 * SAMPLE_MS:
+            stamps = [ticks_add(ticks, int(frac + (k + 1) * SAMPLE_MS)) for k in range(n)]
+            end = frac + n * SAMPLE_MS
+            return (stamps, (stamps[-1], end - int(end)))
+        if lag < 0:
+            span = ticks_diff(now, ticks)
+            stamps = [ticks_add(ticks, max(1, (k + 1) * span // n)) for k in range(n)]
+            return (stamps, (stamps[-1], 0))
+    stamps = [ticks_add(now, -round((n - 1 - k) * SAMPLE_MS)) for k in range(n)]
+    return (stamps, (stamps[-1], 0))
+
+def _update_attitude():
+    global latest_attitude
+    (when, (x, y, z)) = accel_history.latest()
+    tilt = math.degrees(math.atan2(math.sqrt(x * x + y * y), z))
+    parked_flat = abs(z) > abs(x) and abs(z) > abs(y)
+    latest_attitude = (when, heading_from_accel(x, y), tilt, parked_flat)
+
+# Run every READ_INTERVAL by the scheduler
+def read_imu_step():
+    _drain_fifo()
+    if len(accel_history) > 0:
+        _update_attitude()
+
+def heading_from_accel(x, y):
     hdg = math.degrees(math.atan2(-x,-y))
     if hdg < 0:
         hdg += 360
     return hdg
 
+def current_heading():
+    return latest_attitude[1]
+
+# Degrees between the IMU's z axis and straight up: 0 lying flat, 90 on the board
+def current_tilt():
+    return latest_attitude[2]
+
+# The heading at time 'when' (a ticks_ms() value), from the readings either side
+def heading_at(when):
+    (x, y, _) = accel_history.value_at(when)
+    return heading_from_accel(x, y)
+
 def is_parked_flat():
-    x, y, z = accel_gyro.acceleration
-    return abs(z) > abs(x) and abs(z) > abs(y)
+    return latest_attitude[3]
+
+# One direct read, so there's an attitude before the loop starts
+accel_history.append(ticks_ms(), accel_gyro.acceleration)
+gyro_history.append(ticks_ms(), accel_gyro.gyro)
+_update_attitude()
@@ -1,8 +1,13 @@
 import time
+import struct
 import board
 import adafruit_vl53l1x
 import digitalio
-from asyncio import sleep as async_sleep
+import keypad
+from adafruit_ticks import ticks_ms, ticks_diff
+from ring_buffer import SampleRing
+from recorder import record
+from flight_log import REC_LIDAR
 
 #i2c = board.I2C()  # uses board.SCL and board.SDA
 i2c_stemma = board.STEMMA_I2C()  # For using the built-in STEMMA QT connector on a microcontroller
@@ -37,14 +42,58 @@ for pin_number, shutdown_pin in enumerate(xshut):
 #    print("Sensor I2C addresses:", [hex(x) for x in i2c_stemma.scan()])
 #    i2c_stemma.unlock()
 
-for s in sensors:
+# Per-sensor schedule, in ms.  Each sensor takes a reading every 'period',
+# spending 'timing_budget' of it measuring.  The second one starts half a
+# period after the first, so their readings (and I2C reads) alternate,
+# and a fresh distance arrives every 50 ms instead of two every 100 ms.
+# 'int_pin' is the pin wired to the sensor's GPIO1 (data ready) line, or
+# None to poll data_ready over I2C instead.  Neither line is wired on the
+# rover yet; once they are (say to D9 and D10), set the pins here.
+SENSOR_CONFIG = [
+    {'name': 'up',   'timing_budget': 100, 'period': 100, 'start_delay': 0,  'int_pin': None},
+    {'name': 'over', 'timing_budget': 100, 'period': 100, 'start_delay': 50, 'int_pin': None},
+]
+
+# If a sensor's interrupt hasn't fired for this many periods, poll it anyway
+# (a missed edge, or a pin that isn't wired).
+MISSED_PERIODS = 3
+
+def _set_inter_measurement(sensor, period_ms):
+    # The library only sets the timing budget.  This is ST's
+    # VL53L1X_SetInterMeasurementInMs(): the period register counts
+    # in units of the sensor's calibrated oscillator.
+    clock_pll = struct.unpack(">H", sensor._read_register(0x00DE, 2))[0] & 0x3FF
+    sensor._write_register(0x006C, struct.pack(">I", int(clock_pll * period_ms * 1.075)))
+
+for s, cfg in zip(sensors, SENSOR_CONFIG):
     s.distance_mode = 2 # 1: SHORT, 2: LONG
-    s.timing_budget = 100 # in ms
-    s.start_ranging()
+    s.timing_budget = cfg['timing_budget'] # in ms
+    _set_inter_measurement(s, max(cfg['period'], cfg['timing_budget']))
     # Optional: Retrieve the sensor's model ID, module type, and mask revision
     #model_id, module_type, mask_rev = s.model_info
 
-last_dist = [None] * len(sensors)
+start_delay = 0
+for s, cfg in zip(sensors, SENSOR_CONFIG):
+    time.sleep((cfg['start_delay'] - start_delay) / 1000)
+    start_delay = cfg['start_delay']
+    s.start_ranging()
+
+# Data-ready edges, captured (and timestamped) in the background by keypad,
+# so waiting for them costs no I2C traffic.
+int_sensor_ids = [i for i, cfg in enumerate(SENSOR_CONFIG) if cfg['int_pin'] is not None]
+int_keys = None
+if int_sensor_ids:
+    int_keys = keypad.Keys([SENSOR_CONFIG[i]['int_pin'] for i in int_sensor_ids],
+                           value_when_pressed=bool(sensors[0]._interrupt_polarity),
+                           pull=True, interval=0.002)
+
+# The last few seconds of distances (mm) from each sensor, stamped with the
+# ticks_ms() they were measured at.  Only read_lidar_step() writes these;
+# everything else reads them, and never the sensors themselves.
+HISTORY_SIZE = 32
+histories = [SampleRing(HISTORY_SIZE, 1, 'l') for _ in sensors]
+# When each sensor was last read (or the loop started), for polling
+last_ticks = [ticks_ms()] * len(sensors)
 
 """def collect_timings():
     global sensors
@@ -64,18 +113,60 @@ last_dist = [None] * len(sensors)
 
     return (dvals1, dvals2)"""
 
-async def loop_read_lidar():
-    global sensors, last_dist
-    while True:
-        for i, s in enumerate(sensors): 
-            if s.data_ready :
-                reading = s.distance
-                d = reading if reading is not None else 555.5 # If the distance is too great, sensor returns None
-                last_dist[i] = int(d * 10)  # convert to mm
-                s.clear_interrupt()
-        await async_sleep(0.02) # 20 ms between readings
+def _take_reading(i, when):
+    reading = sensors[i].distance
+    d = reading if reading is not None else 555.5 # If the distance is too great, sensor returns None
+    sensors[i].clear_interrupt()
+    histories[i].append(when, (int(d * 10),))  # convert to mm
+    record(REC_LIDAR, i, int(d * 10))
+    last_ticks[i] = when
+
+# Run every POLL_INTERVAL by the scheduler
+POLL_INTERVAL = 0.01 # s
 
+def read_lidar_step():
+    if int_keys is not None:
+        event = int_keys.events.get()
+        while event is not None:
+            if event.pressed:
+                _take_reading(int_sensor_ids[event.key_number], event.timestamp)
+            event = int_keys.events.get()
+    # Sensors without an interrupt line, or whose interrupt went quiet,
+    # only get asked over I2C once a reading is about due.
+    now = ticks_ms()
+    for i, s in enumerate(sensors):
+        cfg = SENSOR_CONFIG[i]
+        if cfg['int_pin'] is None:
+            due = cfg['period'] - 10
+        else:
+            due = cfg['period'] * MISSED_PERIODS
+        if ticks_diff(now, last_ticks[i]) >= due and s.data_ready:
+            _take_reading(i, now)
 
+
+# The newest distance (mm) from each sensor, None for one not read yet.
+# Built in one go from the histories, so it's never a half-updated pair.
 def get_distances():
-    global last_dist
-    return last_dist
+    return tuple(_latest_value(h) for h in histories)
+
+def _latest_value(history):
+    sample = history.latest()
+    return None if sample is None else sample[1][0]
+
+# Like get_distances(), but each entry is (distance_mm, ticks_ms when measured),
+# or None
+def get_readings():
+    readings = []
+    for h in histories:
+        sample = h.latest()
+        readings.append(None if sample is None else (sample[1][0], sample[0]))
+    return tuple(readings)
+
+# Each sensor's distance at time 'when' (a ticks_ms() value), interpolated
+# between its readings either side
+def get_distances_at(when):
+    return tuple(_value_at(h, when) for h in histories)
+
+def _value_at(history, when):
+    values = history.value_at(when)
+    return None if values is None else values[0]
@@ -0,0 +1,195 @@
+import json
+import driving
+from pose import BOARD_X_MM, BOARD_Y_MM
+from servos import enable_tracking, set_servo
+
+# Missions: a list of commands sent in one message, which the rover runs
+# one after another with no round trip to the client in between.
+#
+#   mission navto 800 700 90; wait 1; arc left 150 270; navto 300 300 0
+#   mission ["navto 800 700 90", "wait 1", "servo 0 track"]
+#
+# Steps go on new lines, or between ';'s, or as a JSON list of strings.
+# The whole mission is checked before anything moves, and each step is
+# compiled to a function and its arguments, so running it doesn't parse
+# anything.  When one driving step finishes, driving.on_route_done starts
+# the next straight away, inside the same control tick, so the rover
+# doesn't stop in between.
+#
+# The client hears about each step as it starts ('mission 2/4: wait 1'),
+# and 'mission done' or 'mission stopped at 2/4' at the end.  'mission'
+# on its own says how far a running mission has got.
+
+MAX_STEPS = 32
+MAX_WAIT = 60 # s
+
+def _number(word, lo, hi, what):
+    try:
+        value = int(word)
+    except ValueError:
+        raise ValueError(f"{what} must be a whole number, not '{word}'")
+    if not lo <= value <= hi:
+        raise ValueError(f"{what} must be from {lo} to {hi}")
+    return value
+
+def _direction(word):
+    if word not in ['left', 'right']:
+        raise ValueError(f"direction must be left or right, not '{word}'")
+    return word
+
+# Each compiler takes the step's words after the first and returns
+# (start function, arguments).  Starting a driving step returns what
+# handle_driving_cmd() does; a step that's over as soon as it's started
+# (like 'servo') returns None.
+def _compile_navto(args):
+    if len(args) != 3:
+        raise ValueError("navto needs x, y and heading")
+    return (driving.start_navto, ((_number(args[0], 0, BOARD_X_MM, "x"), _number(args[1], 0, BOARD_Y_MM, "y"),
+                                   _number(args[2], -360, 360, "heading")),))
+
+def _compile_arc(args):
+    if len(args) != 3:
+        raise ValueError("arc needs a direction, radius and heading")
+    return (driving.start_arc, (_direction(args[0]), _number(args[1], 1, 10000, "radius"),
+                                _number(args[2], -360, 360, "heading")))
+
+def _compile_wait(args):
+    if len(args) != 1:
+        raise ValueError("wait needs a number of seconds")
+    try:
+        seconds = float(args[0])
+    except ValueError:
+        raise ValueError(f"wait needs a number of seconds, not '{args[0]}'")
+    if not 0 < seconds <= MAX_WAIT:
+        raise ValueError(f"wait must be more than 0 and at most {MAX_WAIT}s")
+    return (driving.start_wait, (seconds,))
+
+def _compile_servo(args):
+    if len(args) != 2:
+        raise ValueError("servo needs a servo number and an angle or 'track'")
+    snum = _number(args[0], 0, 7, "servo number")
+    if args[1] == 'track':
+        return (_instant(enable_tracking), ())
+    return (_instant(set_servo), (snum, _number(args[1], 0, 180, "servo angle")))
+
+def _instant(fn):
+    def start(*args):
+        fn(*args)
+        return None
+    return start
+
+# What each step can start with.  'drive' and 'rotate' never finish, and
+# 'map sweep' and 'calibrate' aren't driving actions, so none of those
+# can be steps.
+STEP_COMPILERS = {
+    'navto': _compile_navto,
+    'arc': _compile_arc,
+    'wait': _compile_wait,
+    'servo': _compile_servo,
+}
+
+def _split_steps(text):
+    text = text.strip()
+    if text.startswith('['):
+        try:
+            steps = json.loads(text)
+        except ValueError:
+            raise ValueError("mission isn't a valid JSON list")
+        if not all([isinstance(step, str) for step in steps]):
+            raise ValueError("mission's JSON list has to be of strings")
+    else:
+        steps = text.replace(';', '\n').split('\n')
+    return [step.strip() for step in steps if step.strip()]
+
+def compile_mission(text):
+    """Returns the mission's steps as (command, start function, arguments),
+    or raises ValueError saying what's wrong with the first bad step"""
+    steps = _split_steps(text)
+    if len(steps) == 0:
+        raise ValueError("mission has no steps")
+    if len(steps) > MAX_STEPS:
+        raise ValueError(f"mission has {len(steps)} steps, more than {MAX_STEPS}")
+    compiled = []
+    for (i, step) in enumerate(steps):
+        words = step.split()
+        compiler = STEP_COMPILERS.get(words[0])
+        if compiler is None:
+            raise ValueError(f"step {i + 1} ({step}): can't use '{words[0]}' in a mission")
+        try:
+            (start, args) = compiler(words[1:])
+        except ValueError as e:
+            raise ValueError(f"step {i + 1} ({step}): {e}")
+        compiled.append((step, start, args))
+    return compiled
+
+# The running mission
+steps = []
+next_step = 0 # Index in steps of the one to start next
+running = False
+events = [] # Progress messages for the client, oldest first
+
+def _progress():
+    return f"{next_step}/{len(steps)}"
+
+def _start_next():
+    """Starts the next step that moves the rover, returning True, or
+    returns False if the mission is over.  driving.on_route_done while a
+    mission runs."""
+    global next_step, running
+    while next_step < len(steps):
+        (step, start, args) = steps[next_step]
+        next_step += 1
+        events.append(f"mission {_progress()}: {step}")
+        # Set first: a navto that's already there finishes inside start()
+        driving.on_route_done = _start_next
+        result = start(*args)
+        if result is not None:
+            (_, msg) = result
+            if msg:
+                events.append(f"mission {_progress()}: {msg}")
+            return True
+    running = False
+    events.append("mission done")
+    return False
+
+def start_mission(compiled):
+    global steps, next_step, running
+    steps = compiled
+    next_step = 0
+    running = True
+    if not _start_next():
+        driving.driving_stop()
+
+def _check_stopped():
+    global running
+    if running and driving.on_route_done is not _start_next:
+        # Something called driving_stop()
+        running = False
+        events.append(f"mission stopped at {_progress()}")
+
+def take_events():
+    """The progress messages since last time, to send to the client"""
+    _check_stopped()
+    taken = events[:]
+    events.clear()
+    return taken
+
+MISSION_CMDS = ['mission']
+
+def handle_mission_cmd(cmd):
+    cmd_words = cmd.split(None, 1)
+    if cmd_words[0] not in MISSION_CMDS:
+        return (False, 'Not for me')
+    _check_stopped()
+    if len(cmd_words) == 1:
+        if not running:
+            return (True, 'No mission running')
+        return (True, f"mission {_progress()}: {steps[next_step - 1][0]}")
+    if running or not driving.is_idle():
+        return (True, 'Busy, stop first')
+    try:
+        compiled = compile_mission(cmd_words[1])
+    except ValueError as e:
+        return (True, f"Bad mission: {e}")
+    start_mission(compiled)
+    return (True, f"Mission of {len(compiled)} steps started")
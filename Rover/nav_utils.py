@@ -1,4 +1,6 @@
 
+import json
+
 def heading_diff(h1, h2):
     """Returns the # degrees left or right to turn from h1 to h2"""
     d = (h2 - h1 + 180) % 360 - 180
@@ -24,29 +26,58 @@ class HeadingStopper:
     def _normalize(self, h):
         return h-360 if h > self.breakpoint else h
     
-    def should_stop(self, curr_x, curr_y, curr_hdg):
+    def should_stop(self, curr_x, curr_y, curr_hdg, t=None):
         if (self.dir == 'left'):
             return self._normalize(curr_hdg) <= self.target_hdg
         else:
             return self._normalize(curr_hdg) >= self.target_hdg
+
+    # Degrees still to turn; negative once past the target
+    def remaining(self, curr_x, curr_y, curr_hdg):
+        if (self.dir == 'left'):
+            return self._normalize(curr_hdg) - self.target_hdg
+        else:
+            return self.target_hdg - self._normalize(curr_hdg)
         
     def __str__(self):
         return f"HeadingStopper({self.dir} to hdg {self.target_hdg})"
         
+# Stops once 'seconds' have gone by, counted from the first time it's
+# asked (when its action starts), not from when it was made.  Like
+# PredictiveStopper, it needs t: the time of the sample in seconds, from
+# any fixed start.  driving.py counts it from when the action started,
+# with ticks_ms(), which keeps its milliseconds however long the board
+# has been up (a float time.monotonic() doesn't).
+class TimeStopper:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.start = None
+
+    def should_stop(self, curr_x, curr_y, curr_hdg, t=None):
+        if self.start is None:
+            self.start = t
+        return t - self.start >= self.seconds
+
+    def __str__(self):
+        return f"TimeStopper({self.seconds}s)"
+
 class XStopper:
     def __init__(self, curr_x, target_x):
         self.dir = "right" if target_x > curr_x else "left"
         self.target_x = target_x
 
-    def should_stop(self, curr_x, curr_y, curr_hdg):
+    def should_stop(self, curr_x, curr_y, curr_hdg, t=None):
         if (self.dir == 'right'):
-            if curr_x >= self.target_x:
-                print(f"XStop! curr_x {curr_x} >= targ {self.target_x}")
             return curr_x >= self.target_x
         else:
-            if curr_x <= self.target_x:
-                print(f"XStop! curr_x {curr_x} <= targ {self.target_x}")
             return curr_x <= self.target_x
+
+    # mm still to go; negative once past the target
+    def remaining(self, curr_x, curr_y, curr_hdg):
+        if (self.dir == 'right'):
+            return self.target_x - curr_x
+        else:
+            return curr_x - self.target_x
         
     def __str__(self):
         return f"XStopper({self.dir} to x {self.target_x})"
@@ -56,15 +87,133 @@ class YStopper:
         self.dir = "Up" if target_y > curr_y else "Down"
         self.target_y = target_y
 
-    def should_stop(self, curr_x, curr_y, curr_hdg):
+    def should_stop(self, curr_x, curr_y, curr_hdg, t=None):
         if (self.dir == 'Up'):
-            if curr_y >= self.target_y:
-                print(f"YStop! curr_y {curr_y} >= targ {self.target_y}")
             return curr_y >= self.target_y
         else:
-            if curr_y <= self.target_y:
-                print(f"YStop! curr_y {curr_y} <= targ {self.target_y}")
             return curr_y <= self.target_y
+
+    # mm still to go; negative once past the target
+    def remaining(self, curr_x, curr_y, curr_hdg):
+        if (self.dir == 'Up'):
+            return self.target_y - curr_y
+        else:
+            return curr_y - self.target_y
         
     def __str__(self):
         return f"YStopper({self.dir} to y {self.target_y})"
+
+
+# How the rover comes to a stop, measured by calibrate_stops() in driving.py.
+# After the motors are told to stop, it keeps going at full speed for
+# 'latency' seconds (the motor driver, plus the age of the sensor sample
+# the decision was made on), then coasts a further distance that depends
+# on the throttle.  coast_mm and coast_deg map throttle level to the coast
+# when driving straight and turning in place.
+class StopModel:
+    def __init__(self, latency=0.1, coast_mm=None, coast_deg=None):
+        self.latency = latency
+        self.coast_mm = coast_mm or {}
+        self.coast_deg = coast_deg or {}
+
+    # The coast at this throttle, interpolated between calibrated levels
+    def coast(self, throttle, turning=False):
+        table = self.coast_deg if turning else self.coast_mm
+        if not table:
+            return 0
+        throttle = abs(throttle)
+        levels = sorted(table)
+        if throttle <= levels[0]:
+            return table[levels[0]] * throttle / levels[0]
+        for lo, hi in zip(levels, levels[1:]):
+            if throttle <= hi:
+                frac = (throttle - lo) / (hi - lo)
+                return table[lo] + (table[hi] - table[lo]) * frac
+        return table[levels[-1]]
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({'latency': self.latency,
+                       'coast_mm': [[k, v] for k, v in self.coast_mm.items()],
+                       'coast_deg': [[k, v] for k, v in self.coast_deg.items()]}, f)
+
+    @staticmethod
+    def load(path):
+        """Returns the saved StopModel, or a default one if there isn't one"""
+        try:
+            with open(path, "r") as f:
+                d = json.load(f)
+        except (OSError, ValueError):
+            return StopModel()
+        return StopModel(d['latency'], dict(d['coast_mm']), dict(d['coast_deg']))
+
+    def __str__(self):
+        return f"StopModel(latency {self.latency:.3f}s, coast_mm {self.coast_mm}, coast_deg {self.coast_deg})"
+
+def analyze_stop_trace(trace, stop_t):
+    """Works out (speed, latency, coast) from one calibration run.
+    trace is a list of (t, position) samples, in seconds and mm (or degrees),
+    moving steadily until the motors were stopped at stop_t, then coming to rest."""
+    before = [(t, p) for (t, p) in trace if t <= stop_t]
+    after = [(t, p) for (t, p) in trace if t > stop_t]
+    # Steady speed, from the half second before the stop
+    steady = [(t, p) for (t, p) in before if t >= stop_t - 0.5]
+    speed = (steady[-1][1] - steady[0][1]) / (steady[-1][0] - steady[0][0])
+    p_stop = before[-1][1] + speed * (stop_t - before[-1][0])
+    # Latency: until the speed between samples drops below 90% of steady
+    latency = after[-1][0] - stop_t
+    prev = (stop_t, p_stop)
+    for (t, p) in after:
+        if t > prev[0] and abs((p - prev[1]) / (t - prev[0])) < 0.9 * abs(speed):
+            latency = prev[0] - stop_t
+            break
+        prev = (t, p)
+    total = after[-1][1] - p_stop
+    coast = total - speed * latency
+    return (abs(speed), latency, abs(coast))
+
+# Wraps one of the stoppers above, and fires early: as soon as the rover,
+# if told to stop at the next sample, would come to rest past the target.
+# The rate of approach comes from the last few samples it was called with.
+class PredictiveStopper:
+    WINDOW = 0.3  # seconds of samples to estimate the rate from
+
+    def __init__(self, stopper, throttle, stop_model):
+        self.stopper = stopper
+        self.turning = isinstance(stopper, HeadingStopper)
+        self.coast = stop_model.coast(throttle, self.turning)
+        self.latency = stop_model.latency
+        self.samples = []  # (t, remaining)
+
+    # How fast the remaining distance is shrinking, per second
+    def closing_rate(self):
+        if len(self.samples) < 2:
+            return 0
+        n = len(self.samples)
+        mean_t = sum(t for (t, _) in self.samples) / n
+        mean_r = sum(r for (_, r) in self.samples) / n
+        var = sum((t - mean_t) ** 2 for (t, _) in self.samples)
+        if var == 0:
+            return 0
+        slope = sum((t - mean_t) * (r - mean_r) for (t, r) in self.samples) / var
+        return max(0, -slope)
+
+    def remaining(self, curr_x, curr_y, curr_hdg):
+        return self.stopper.remaining(curr_x, curr_y, curr_hdg)
+
+    # t is the time of the sample, in seconds, as for TimeStopper.  (The
+    # other stoppers take t too, but don't need it.)
+    def should_stop(self, curr_x, curr_y, curr_hdg, t=None):
+        to_go = self.remaining(curr_x, curr_y, curr_hdg)
+        self.samples.append((t, to_go))
+        while self.samples[0][0] < t - self.WINDOW:
+            self.samples.pop(0)
+        rate = self.closing_rate()
+        if rate == 0:
+            return to_go <= 0
+        # Stop now if waiting for the next sample would be too late
+        interval = (self.samples[-1][0] - self.samples[0][0]) / (len(self.samples) - 1)
+        return to_go <= rate * (self.latency + interval) + self.coast
+
+    def __str__(self):
+        return f"Predictive{self.stopper}"
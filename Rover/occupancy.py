@@ -0,0 +1,121 @@
+import math
+
+# An occupancy grid of the arena: what the LIDAR sweeps have seen.
+#
+# Each cell is one byte of evidence, starting at UNKNOWN.  A LIDAR ray
+# lowers the cells it passes through (free space) and raises the one it
+# ends in (something there), both saturating, so a stray reading is
+# outvoted by the next few sweeps.  The whole map is a single bytearray
+# of (width / cell_mm) x (height / cell_mm) bytes: about 3KB at 20mm.
+#
+# Cells are indexed from (0, 0) at the bottom left, x across, y up, in
+# the same mm as the pose.
+
+UNKNOWN = 128
+HIT = 64        # Added to the cell a ray ends in
+MISS = 16       # Taken off each cell a ray passes through
+OCCUPIED = 192  # Cells at or above this are obstacles
+MAX_RANGE = 2000  # mm; readings this long or longer hit nothing we can place
+EDGE_MM = 40      # Hits this close to the edge of the grid are the arena's own edge
+
+# The two LIDARs sit at right angles on the servo.  At servo angle 83 they
+# point straight ahead ('up') and right ('over'); 166 is half a turn.
+SWEEP_ANGLES = range(0, 181, 5)  # Servo angles a map sweep reads at
+
+def lidar_mount_bearing(angle):
+    """Which way the 'up' LIDAR points at this servo angle, in degrees
+    clockwise from the rover's heading; 'over' points 90 more"""
+    return 90 - angle * 180 / 166
+
+class OccupancyGrid:
+    def __init__(self, width_mm, height_mm, cell_mm):
+        self.width_mm = width_mm
+        self.height_mm = height_mm
+        self.cell_mm = cell_mm
+        self.nx = int(math.ceil(width_mm / cell_mm))
+        self.ny = int(math.ceil(height_mm / cell_mm))
+        self.cells = bytearray([UNKNOWN] * (self.nx * self.ny))
+        self.version = 0  # Goes up with every change, for caching what's derived from the map
+        self.num_rays = 0
+        self._inflated = None  # (version, clearance_mm, blocked cells)
+
+    def clear(self):
+        for i in range(len(self.cells)):
+            self.cells[i] = UNKNOWN
+        self.version += 1
+        self.num_rays = 0
+
+    def cell_of(self, x, y):
+        """The (ix, iy) cell holding point (x, y), or None if it's off the grid"""
+        ix = int(x // self.cell_mm)
+        iy = int(y // self.cell_mm)
+        if ix < 0 or iy < 0 or ix >= self.nx or iy >= self.ny:
+            return None
+        return (ix, iy)
+
+    def is_occupied(self, ix, iy):
+        return self.cells[iy * self.nx + ix] >= OCCUPIED
+
+    def num_occupied(self):
+        return sum(1 for v in self.cells if v >= OCCUPIED)
+
+    def add_ray(self, x, y, bearing, dist):
+        """
+        Adds one LIDAR reading: from (x, y), looking along 'bearing' (degrees
+        clockwise from up), something 'dist' mm away.  Walks the ray a
+        cell at a time, clearing the cells on the way and marking the
+        end.  The part of a ray beyond the grid is ignored, and so are hits
+        on the arena's edge, so the edges don't fill up the map.
+        """
+        dx = math.sin(math.radians(bearing))
+        dy = math.cos(math.radians(bearing))
+        dist = min(dist, MAX_RANGE)
+        (hx, hy) = (x + dx * dist, y + dy * dist)
+        hit = dist < MAX_RANGE and EDGE_MM <= hx <= self.width_mm - EDGE_MM and EDGE_MM <= hy <= self.height_mm - EDGE_MM
+        step = self.cell_mm / 2
+        n = int(dist / step)
+        cells = self.cells
+        last = -1
+        for s in range(n):
+            c = self.cell_of(x + dx * s * step, y + dy * s * step)
+            if c is None:
+                break
+            i = c[1] * self.nx + c[0]
+            if i != last:
+                cells[i] = max(0, cells[i] - MISS)
+                last = i
+        else:
+            c = self.cell_of(hx, hy)
+            if hit and c is not None:
+                i = c[1] * self.nx + c[0]
+                # Undo the miss if the last step was already in the hit cell
+                cells[i] = min(255, cells[i] + HIT + (MISS if i == last else 0))
+        self.num_rays += 1
+        self.version += 1
+
+    def inflated(self, clearance_mm):
+        """
+        A bytearray, one byte per cell, that's 1 wherever the middle of the
+        rover can't go: within clearance_mm of an occupied cell.  Cached
+        until the map changes.
+        """
+        if self._inflated is not None and self._inflated[0] == self.version and self._inflated[1] == clearance_mm:
+            return self._inflated[2]
+        blocked = bytearray(len(self.cells))
+        reach = int(math.ceil(clearance_mm / self.cell_mm))
+        # The cell offsets within reach, as a disc
+        disc = [(ox, oy) for ox in range(-reach, reach + 1) for oy in range(-reach, reach + 1)
+                if (ox * ox + oy * oy) * self.cell_mm * self.cell_mm <= clearance_mm * clearance_mm]
+        for iy in range(self.ny):
+            for ix in range(self.nx):
+                if self.cells[iy * self.nx + ix] < OCCUPIED:
+                    continue
+                for (ox, oy) in disc:
+                    (bx, by) = (ix + ox, iy + oy)
+                    if 0 <= bx < self.nx and 0 <= by < self.ny:
+                        blocked[by * self.nx + bx] = 1
+        self._inflated = (self.version, clearance_mm, blocked)
+        return blocked
+
+    def __str__(self):
+        return f"{self.nx}x{self.ny} cells of {self.cell_mm}mm, {self.num_rays} rays, {self.num_occupied()} occupied"
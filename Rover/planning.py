@@ -78,7 +78,8 @@ def plan_route(arena_width, area_height, x1, y1, hdg1, x2, y2, hdg2, min_radius)
     """
     Plans a route from a starting point (x1, y1) with heading hdg1
     to an ending point (x2, y2) with heading hdg2 and returns the plan
-    as a JSON string.
+    as a JSON string, for plan_ui.html.  Along with the turn circles and
+    tangents, it has the shortest path that stays in the arena, if any.
 
     Parameters:
     arena_width (float): Width of the arena.
@@ -126,7 +127,454 @@ def plan_route(arena_width, area_height, x1, y1, hdg1, x2, y2, hdg2, min_radius)
         ]
     }
 
+    # The path the rover would actually take, drawn as a run of short lines
+    best = shortest_path(arena_width, area_height, x1, y1, hdg1, x2, y2, hdg2, r)
+    if best is not None:
+        (length, segments) = best
+        plan["path"] = {"word": "".join([kind for (kind, _) in segments]), "length": round(length, 1),
+                        "segments": [[kind, round(n, 1)] for (kind, n) in segments]}
+        poses = path_poses(x1, y1, hdg1, segments, r)
+        for (a, b) in zip(poses, poses[1:]):
+            plan["geometry"].append({"type": "line", "x1": round(a[0], 1), "y1": round(a[1], 1),
+                                     "x2": round(b[0], 1), "y2": round(b[1], 1), "stroke": "#d02020", "strokeWidth": 2})
+
     return json.dumps(plan)
 
-# Example
-print(plan_route(700, 500, 100, 120, 22, 490, 290, 135, 80))
+############### Dubins paths #############
+# The shortest way for a rover that can't turn tighter than radius r to
+# get from one pose to another is one of six "words": turn, straight,
+# turn (LSL, RSR, LSR, RSL) or three turns (RLR, LRL).  See Shkel and
+# Lumelsky, "Classification of the Dubins set" (2001).
+#
+# Headings here are the rover's: degrees clockwise from up (+y).  The
+# formulas use the usual maths angles (counterclockwise from +x, in
+# radians), where L is counterclockwise, just as it is for the rover.
+
+TWO_PI = 2 * math.pi
+
+def _mod2pi(a):
+    return a % TWO_PI
+
+def _to_theta(hdg):
+    return _mod2pi(math.radians(90 - hdg))
+
+# Each takes the normalized problem (start angle a, end angle b, distance d
+# in turning radii, along +x) and returns the three segment lengths (as
+# angles for turns, radii for straights), or None.
+def _lsl(a, b, d):
+    p_sq = 2 + d * d - 2 * math.cos(a - b) + 2 * d * (math.sin(a) - math.sin(b))
+    if p_sq < 0:
+        return None
+    tmp = math.atan2(math.cos(b) - math.cos(a), d + math.sin(a) - math.sin(b))
+    return (_mod2pi(tmp - a), math.sqrt(p_sq), _mod2pi(b - tmp))
+
+def _rsr(a, b, d):
+    p_sq = 2 + d * d - 2 * math.cos(a - b) + 2 * d * (math.sin(b) - math.sin(a))
+    if p_sq < 0:
+        return None
+    tmp = math.atan2(math.cos(a) - math.cos(b), d - math.sin(a) + math.sin(b))
+    return (_mod2pi(a - tmp), math.sqrt(p_sq), _mod2pi(tmp - b))
+
+def _lsr(a, b, d):
+    p_sq = -2 + d * d + 2 * math.cos(a - b) + 2 * d * (math.sin(a) + math.sin(b))
+    if p_sq < 0:
+        return None
+    p = math.sqrt(p_sq)
+    tmp = math.atan2(-math.cos(a) - math.cos(b), d + math.sin(a) + math.sin(b)) - math.atan2(-2, p)
+    return (_mod2pi(tmp - a), p, _mod2pi(tmp - b))
+
+def _rsl(a, b, d):
+    p_sq = -2 + d * d + 2 * math.cos(a - b) - 2 * d * (math.sin(a) + math.sin(b))
+    if p_sq < 0:
+        return None
+    p = math.sqrt(p_sq)
+    tmp = math.atan2(math.cos(a) + math.cos(b), d - math.sin(a) - math.sin(b)) - math.atan2(2, p)
+    return (_mod2pi(a - tmp), p, _mod2pi(b - tmp))
+
+def _rlr(a, b, d):
+    tmp = (6 - d * d + 2 * math.cos(a - b) + 2 * d * (math.sin(a) - math.sin(b))) / 8
+    if abs(tmp) > 1:
+        return None
+    p = _mod2pi(TWO_PI - math.acos(tmp))
+    t = _mod2pi(a - math.atan2(math.cos(a) - math.cos(b), d - math.sin(a) + math.sin(b)) + p / 2)
+    return (t, p, _mod2pi(a - b - t + p))
+
+def _lrl(a, b, d):
+    tmp = (6 - d * d + 2 * math.cos(a - b) + 2 * d * (math.sin(b) - math.sin(a))) / 8
+    if abs(tmp) > 1:
+        return None
+    p = _mod2pi(TWO_PI - math.acos(tmp))
+    t = _mod2pi(-a - math.atan2(math.cos(a) - math.cos(b), d + math.sin(a) - math.sin(b)) + p / 2)
+    return (t, p, _mod2pi(b - a - t + p))
+
+DUBINS_WORDS = {"LSL": _lsl, "RSR": _rsr, "LSR": _lsr, "RSL": _rsl, "RLR": _rlr, "LRL": _lrl}
+
+def dubins_paths(x1, y1, hdg1, x2, y2, hdg2, r):
+    """
+    Returns every Dubins path from (x1, y1, hdg1) to (x2, y2, hdg2) with
+    turning radius r, as a list of (total length, segments), where each
+    segment is (kind, length in mm) and kind is 'L', 'R' or 'S'.
+    """
+    dx = x2 - x1
+    dy = y2 - y1
+    d = math.hypot(dx, dy) / r
+    phi = math.atan2(dy, dx)
+    a = _mod2pi(_to_theta(hdg1) - phi)
+    b = _mod2pi(_to_theta(hdg2) - phi)
+    paths = []
+    for word, solve in DUBINS_WORDS.items():
+        lengths = solve(a, b, d)
+        if lengths is None:
+            continue
+        segments = [(kind, n * r) for kind, n in zip(word, lengths)]
+        paths.append((sum(n for (_, n) in segments), segments))
+    return paths
+
+def path_poses(x, y, hdg, segments, r, step=10):
+    """
+    Follows the segments from (x, y, hdg), returning a pose (x, y, hdg)
+    about every 'step' mm, including the start and the end of each segment.
+    """
+    poses = [(x, y, hdg)]
+    for (kind, length) in segments:
+        n = max(1, int(math.ceil(length / step)))
+        ds = length / n
+        for _ in range(n):
+            if kind == 'S':
+                x += ds * math.sin(math.radians(hdg))
+                y += ds * math.cos(math.radians(hdg))
+            else:
+                # Move along the chord, at the heading halfway round
+                turn = math.degrees(ds / r) * (1 if kind == 'R' else -1)
+                chord = 2 * r * math.sin(ds / (2 * r))
+                mid = hdg + turn / 2
+                x += chord * math.sin(math.radians(mid))
+                y += chord * math.cos(math.radians(mid))
+                hdg = (hdg + turn) % 360
+            poses.append((x, y, hdg))
+    return poses
+
+def path_extent(x, y, hdg, segments, r):
+    """
+    Follows the segments from (x, y, hdg) without stepping along them.
+    Returns the end pose (x, y, hdg), and the bounding box of the whole
+    path, (min_x, min_y, max_x, max_y).
+    """
+    (min_x, min_y, max_x, max_y) = (x, y, x, y)
+    for (kind, length) in segments:
+        if kind == 'S':
+            x += length * math.sin(math.radians(hdg))
+            y += length * math.cos(math.radians(hdg))
+        else:
+            turn = math.degrees(length / r)
+            side = 90 if kind == 'R' else -90
+            cx = x + r * math.sin(math.radians(hdg + side))
+            cy = y + r * math.cos(math.radians(hdg + side))
+            # Where the rover is, seen from the centre, as a heading.  It
+            # goes round clockwise on a right turn.
+            start = hdg - side
+            for (bearing, px, py) in [(0, cx, cy + r), (90, cx + r, cy), (180, cx, cy - r), (270, cx - r, cy)]:
+                swept = (bearing - start) % 360 if kind == 'R' else (start - bearing) % 360
+                if swept <= turn:
+                    (min_x, min_y, max_x, max_y) = (min(min_x, px), min(min_y, py), max(max_x, px), max(max_y, py))
+            hdg = (hdg + (turn if kind == 'R' else -turn)) % 360
+            x = cx + r * math.sin(math.radians(hdg - side))
+            y = cy + r * math.cos(math.radians(hdg - side))
+        (min_x, min_y, max_x, max_y) = (min(min_x, x), min(min_y, y), max(max_x, x), max(max_y, y))
+    return ((x, y, hdg), (min_x, min_y, max_x, max_y))
+
+def path_in_arena(bounds, arena_width, arena_height, margin):
+    (min_x, min_y, max_x, max_y) = bounds
+    return min_x >= margin and min_y >= margin and max_x <= arena_width - margin and max_y <= arena_height - margin
+
+def track_error(x0, y0, hdg0, kind, r, x, y, hdg):
+    """
+    How far the pose (x, y, hdg) is off a segment that starts at
+    (x0, y0, hdg0): returns (cross-track mm, heading error deg).  kind is
+    'S', 'L' or 'R' as in the Dubins segments, or 'P' for a turn in place,
+    where only the distance from the pivot counts.
+    """
+    if kind == 'P':
+        return (math.hypot(x - x0, y - y0), 0)
+    if kind == 'S':
+        ux = math.sin(math.radians(hdg0))
+        uy = math.cos(math.radians(hdg0))
+        # Going backwards along the line is still on it
+        return (abs((x - x0) * uy - (y - y0) * ux), abs((hdg - hdg0 + 180) % 360 - 180))
+    side = 90 if kind == 'R' else -90
+    cx = x0 + r * math.sin(math.radians(hdg0 + side))
+    cy = y0 + r * math.cos(math.radians(hdg0 + side))
+    # The heading the circle has at the point nearest the rover
+    bearing = math.degrees(math.atan2(x - cx, y - cy))
+    return (abs(math.hypot(x - cx, y - cy) - r), abs((hdg - (bearing + side) + 180) % 360 - 180))
+
+def clamp_heading(hdg, window):
+    """
+    The heading nearest hdg in 'window', a (centre, half width) pair in
+    degrees
+    """
+    (centre, half_width) = window
+    off = (hdg - centre + 180) % 360 - 180
+    return (centre + max(-half_width, min(half_width, off))) % 360
+
+def headings_within(hdg, segments, r, window):
+    """
+    True if every heading the rover has following the segments from hdg
+    stays in 'window', as for clamp_heading()
+    """
+    (centre, half_width) = window
+    limit = half_width + 0.5  # Room for rounding, on paths that end on the edge
+    off = (hdg - centre + 180) % 360 - 180
+    if abs(off) > limit:
+        return False
+    for (kind, length) in segments:
+        if kind != 'S':
+            # Arcs only turn one way, so checking their ends is enough
+            turn = math.degrees(length / r)
+            off += turn if kind == 'R' else -turn
+            if abs(off) > limit:
+                return False
+    return True
+
+def shortest_path(arena_width, arena_height, x1, y1, hdg1, x2, y2, hdg2, min_radius, margin=0, heading_window=None):
+    """
+    Returns the shortest Dubins path that stays 'margin' mm inside the
+    arena, as (total length, segments) like dubins_paths(), or None if
+    every one of them leaves it.  With a heading_window (see
+    clamp_heading()), the rover's heading has to stay in it too.
+    """
+    paths = sorted(dubins_paths(x1, y1, hdg1, x2, y2, hdg2, min_radius), key=lambda p: p[0])
+    for (length, segments) in paths:
+        if heading_window is not None and not headings_within(hdg1, segments, min_radius, heading_window):
+            continue
+        (_, bounds) = path_extent(x1, y1, hdg1, segments, min_radius)
+        if path_in_arena(bounds, arena_width, arena_height, margin):
+            return (length, segments)
+    return None
+
+############### Planning round obstacles #############
+# With an occupancy grid (occupancy.py) of what's on the board, the
+# Dubins path can run into things.  hybrid_astar() searches over short
+# moves the rover can actually make -- an arc left or right at the
+# minimum radius, or straight on -- keeping the exact pose at each node
+# but merging nodes that land in the same cell and heading bin.  From
+# time to time, and from every node near the goal, it tries a Dubins
+# path straight to the goal, and stops at the first one that's clear.
+# It can also turn in place before it sets off, at a cost, which gets
+# it out of starts like nose up against a box.
+#
+# On the rover a search takes far longer than a control period, so
+# hybrid_astar_steps() does it a slice at a time, yielding in between,
+# and the scheduler runs the slices as a low-priority task.
+
+ASTAR_HDG_BINS = 16    # Each turn move turns one bin, 22.5 degrees
+ASTAR_SHOT_EVERY = 10  # Expansions between tries of a Dubins path to the goal...
+ASTAR_SHOT_RANGE = 4   # ...but try from every node within this many turn radii of it
+TURN_COST = 1.1        # Arcs cost a little more than going straight, to keep paths simple
+PIVOT_COST = 1.0       # mm of path that turning a degree in place is worth
+ASTAR_SLICE = 5        # Expansions per slice in hybrid_astar_steps()...
+FIELD_SLICE = 200      # ...and cells of the distance field, which take about as long
+
+def path_clear(grid, x, y, hdg, segments, r, clearance, margin=0):
+    """
+    True if the path keeps the rover's middle 'clearance' mm from anything
+    in the grid, and 'margin' mm inside the arena
+    """
+    blocked = grid.inflated(clearance)
+    for (px, py, _) in path_poses(x, y, hdg, segments, r, grid.cell_mm / 2):
+        if px < margin or py < margin or px > grid.width_mm - margin or py > grid.height_mm - margin:
+            return False
+        cell = grid.cell_of(px, py)
+        if cell is None or blocked[cell[1] * grid.nx + cell[0]]:
+            return False
+    return True
+
+# heapq where the build has it.  It isn't in every CircuitPython build,
+# so there's a binary heap on a list to fall back on.
+try:
+    from heapq import heappush as _heap_push, heappop as _heap_pop
+except ImportError:
+    def _heap_push(heap, item):
+        heap.append(item)
+        i = len(heap) - 1
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= item:
+                break
+            heap[i] = heap[parent]
+            i = parent
+        heap[i] = item
+
+    def _heap_pop(heap):
+        top = heap[0]
+        last = heap.pop()
+        if len(heap) > 0:
+            i = 0
+            n = len(heap)
+            while True:
+                child = 2 * i + 1
+                if child >= n:
+                    break
+                if child + 1 < n and heap[child + 1] < heap[child]:
+                    child += 1
+                if last <= heap[child]:
+                    break
+                heap[i] = heap[child]
+                i = child
+            heap[i] = last
+        return top
+
+def _distance_field(grid, blocked, x, y, margin, slice_cells):
+    """
+    How far each cell is from (x, y) going round the blocked cells, eight
+    ways between cell centres.  A list, one entry per cell; unreachable
+    cells are None.  A generator, yielding every slice_cells cells and
+    returning the list.
+    """
+    n_margin = int(margin // grid.cell_mm)
+    dist = [None] * len(blocked)
+    goal = grid.cell_of(x, y)
+    if goal is None:
+        return dist
+    diag = grid.cell_mm * math.sqrt(2)
+    steps = [(1, 0, grid.cell_mm), (-1, 0, grid.cell_mm), (0, 1, grid.cell_mm), (0, -1, grid.cell_mm),
+             (1, 1, diag), (1, -1, diag), (-1, 1, diag), (-1, -1, diag)]
+    start = goal[1] * grid.nx + goal[0]
+    dist[start] = 0
+    heap = [(0, start)]
+    done = 0
+    while len(heap) > 0:
+        (d, i) = _heap_pop(heap)
+        if d > dist[i]:
+            continue
+        done += 1
+        if done % slice_cells == 0:
+            yield
+        (ix, iy) = (i % grid.nx, i // grid.nx)
+        for (ox, oy, cost) in steps:
+            (jx, jy) = (ix + ox, iy + oy)
+            if jx < n_margin or jy < n_margin or jx >= grid.nx - n_margin or jy >= grid.ny - n_margin:
+                continue
+            j = jy * grid.nx + jx
+            if blocked[j] or (dist[j] is not None and dist[j] <= d + cost):
+                continue
+            dist[j] = d + cost
+            _heap_push(heap, (d + cost, j))
+    return dist
+
+def _merge_segments(segments):
+    merged = []
+    for (kind, length) in segments:
+        if len(merged) > 0 and merged[-1][0] == kind:
+            merged[-1] = (kind, merged[-1][1] + length)
+        else:
+            merged.append((kind, length))
+    return merged
+
+def hybrid_astar(grid, x1, y1, hdg1, x2, y2, hdg2, r, clearance, margin=0, max_expansions=3000, pivot=True,
+                 heading_window=None):
+    """
+    Returns a path round the obstacles in 'grid' as (total length, segments,
+    start heading), or None if there's none within max_expansions.  The
+    segments are like shortest_path()'s, from (x1, y1) at the start
+    heading, which is hdg1 unless 'pivot' let it turn in place first.
+    With a heading_window, the path's headings stay in it, as for
+    shortest_path(); only the turn in place can start outside it.
+    """
+    search = hybrid_astar_steps(grid, x1, y1, hdg1, x2, y2, hdg2, r, clearance, margin, max_expansions, pivot,
+                                heading_window)
+    try:
+        while True:
+            next(search)
+    except StopIteration as done:
+        return done.value
+
+def hybrid_astar_steps(grid, x1, y1, hdg1, x2, y2, hdg2, r, clearance, margin=0, max_expansions=3000, pivot=True,
+                       heading_window=None):
+    """
+    hybrid_astar() a slice at a time: a generator that yields after every
+    ASTAR_SLICE expansions (or FIELD_SLICE cells of its distance field),
+    and returns hybrid_astar()'s result, which comes back as the
+    StopIteration's value.
+    """
+    bin_deg = 360 / ASTAR_HDG_BINS
+    step = math.radians(bin_deg) * r  # The arc length that turns one bin
+    cell = grid.cell_mm
+    # The cost still to go is at least the straight line to the goal, and
+    # at least the way round the obstacles (less a cell or so, since that's
+    # measured between cell centres)
+    field = yield from _distance_field(grid, grid.inflated(clearance), x2, y2, margin, FIELD_SLICE)
+
+    def key(x, y, hdg):
+        return (int(x // cell), int(y // cell), int(round(hdg / bin_deg)) % ASTAR_HDG_BINS)
+
+    def to_go(x, y):
+        c = grid.cell_of(x, y)
+        d = None if c is None else field[c[1] * grid.nx + c[0]]
+        return max(math.hypot(x2 - x, y2 - y), 0 if d is None else d - 2 * cell)
+
+    def in_window(hdg, segments):
+        return heading_window is None or headings_within(hdg, segments, r, heading_window)
+
+    def shot(x, y, hdg):
+        for (length, segments) in sorted(dubins_paths(x, y, hdg, x2, y2, hdg2, r), key=lambda p: p[0]):
+            if in_window(hdg, segments) and path_clear(grid, x, y, hdg, segments, r, clearance, margin):
+                return (length, segments)
+        return None
+
+    # Each node is (x, y, hdg, cost so far, parent key, move that got here).
+    # It starts from hdg1, and if it can pivot, from each other heading bin
+    # too, costing the turn.
+    nodes = {}
+    heap = []
+    counter = 0  # Breaks ties in the heap, oldest first
+    for i in range(ASTAR_HDG_BINS if pivot else 1):
+        turn = i * bin_deg if i <= ASTAR_HDG_BINS // 2 else (i - ASTAR_HDG_BINS) * bin_deg
+        hdg = (hdg1 + turn) % 360
+        if not in_window(hdg, []):
+            continue
+        g = abs(turn) * PIVOT_COST
+        nodes[key(x1, y1, hdg)] = (x1, y1, hdg, g, None, None)
+        counter += 1
+        _heap_push(heap, (g + to_go(x1, y1), counter, key(x1, y1, hdg)))
+    closed = set()
+    expansions = 0
+    while len(heap) > 0 and expansions < max_expansions:
+        (_, _, k) = _heap_pop(heap)
+        if k in closed:
+            continue
+        closed.add(k)
+        (x, y, hdg, g, _, _) = nodes[k]
+        if expansions % ASTAR_SHOT_EVERY == 0 or math.hypot(x2 - x, y2 - y) < ASTAR_SHOT_RANGE * r:
+            found = shot(x, y, hdg)
+            if found is not None:
+                # Walk back up to the start for the moves that got here
+                moves = []
+                while nodes[k][5] is not None:
+                    moves.append(nodes[k][5])
+                    k = nodes[k][4]
+                moves.reverse()
+                segments = _merge_segments(moves + found[1])
+                return (sum(n for (_, n) in segments), segments, nodes[k][2])
+        expansions += 1
+        if expansions % ASTAR_SLICE == 0:
+            yield
+        for kind in 'LSR':
+            move = [(kind, step)]
+            ((nx, ny, nhdg), _) = path_extent(x, y, hdg, move, r)
+            nk = key(nx, ny, nhdg)
+            if nk in closed:
+                continue
+            ng = g + (step if kind == 'S' else step * TURN_COST)
+            if nk in nodes and nodes[nk][3] <= ng:
+                continue
+            if not in_window(hdg, move) or not path_clear(grid, x, y, hdg, move, r, clearance, margin):
+                continue
+            nodes[nk] = (nx, ny, nhdg, ng, k, move[0])
+            counter += 1
+            _heap_push(heap, (ng + to_go(nx, ny), counter, nk))
+    return None
+
+if __name__ == "__main__":
+    # Example
+    print(plan_route(700, 500, 100, 120, 22, 490, 290, 135, 80))
@@ -0,0 +1,178 @@
+import math
+from adafruit_ticks import ticks_ms, ticks_diff
+from imu import accel_history, gyro_history, heading_from_accel, is_parked_flat
+from lidar import histories as lidar_histories
+
+# Pose estimation: fuses the sensors into one (x, y, heading) that the
+# driving loop can use between LIDAR readings.
+#
+# Heading is a complementary filter: the gyro's turn rate is integrated at
+# the IMU's rate, and each step is pulled a little towards the heading
+# from gravity (the accelerometer), which doesn't drift but is noisy.
+#
+# x and y each get an alpha-beta filter (a fixed-gain Kalman filter)
+# on the LIDAR distances.  It keeps a position and velocity per axis,
+# so in between the 10 Hz readings the position is predicted forward.
+
+# Where the LIDARs measure from: x = BOARD_X_MM - over, y = BOARD_Y_MM - up
+BOARD_X_MM = 1160
+BOARD_Y_MM = 1060
+
+# Which way the gyro's z axis turns relative to heading (clockwise
+# from up), as mounted
+GYRO_SIGN = -1
+# How far each IMU sample pulls the gyro heading towards the accel heading.
+# At 100 Hz, 0.02 corrects most of an error in about half a second.
+ACCEL_GAIN = 0.02
+
+# Alpha-beta gains for the LIDAR axes
+POS_GAIN = 0.6
+VEL_GAIN = 0.3
+MAX_SPEED = 500   # mm/s; velocities beyond this are noise
+MAX_PREDICT = 300 # ms; don't predict further than this past a reading
+# A position this old (ms) has no confidence left
+STALE_MS = 500
+
+UPDATE_INTERVAL = 0.01  # s, how often the scheduler runs estimate_pose_step()
+
+def upover_to_xy(up_mm, over_mm):
+    x = BOARD_X_MM - over_mm  # mm
+    y = BOARD_Y_MM - up_mm    # mm
+    return (x, y)
+
+def _wrap180(d):
+    return (d + 180) % 360 - 180
+
+# Tracks one coordinate from a stream of timestamped measurements
+class AxisTracker:
+    def __init__(self):
+        self.pos = None  # mm, at self.ticks
+        self.vel = 0     # mm/s
+        self.ticks = 0
+
+    def update(self, measured, when):
+        if self.pos is None:
+            self.pos = measured
+            self.ticks = when
+            return
+        dt = ticks_diff(when, self.ticks) / 1000
+        if dt <= 0:
+            return
+        predicted = self.pos + self.vel * dt
+        residual = measured - predicted
+        self.pos = predicted + POS_GAIN * residual
+        self.vel += VEL_GAIN * residual / dt
+        self.vel = max(-MAX_SPEED, min(MAX_SPEED, self.vel))
+        self.ticks = when
+
+    # Position predicted for time 'when'
+    def at(self, when):
+        if self.pos is None:
+            return None
+        ahead = min(ticks_diff(when, self.ticks), MAX_PREDICT)
+        return self.pos + self.vel * ahead / 1000
+
+    def confidence(self, when):
+        if self.pos is None:
+            return 0
+        return max(0, 1 - ticks_diff(when, self.ticks) / STALE_MS)
+
+x_axis = AxisTracker()
+y_axis = AxisTracker()
+
+heading = heading_from_accel(*accel_history.latest()[1][:2])
+heading_error = 0  # Latest accel heading minus the filtered one
+heading_rate = 0   # deg/s, clockwise, from the latest gyro sample
+last_imu_ticks = gyro_history.latest()[0]
+last_lidar_ticks = [ticks_ms()] * len(lidar_histories)
+# While the LIDARs are turned away from the walls (a map sweep), their
+# readings don't say where the rover is
+lidar_paused = False
+
+# The servo can only follow headings from 270 through 0 to 90; past them
+# it stops short, and the LIDARs measure the walls at a slant (or other
+# walls altogether).  Readings taken while it's more than AIM_TOLERANCE
+# degrees short are left out, and so are those from AIM_SETTLE_MS after
+# it's back: the servo turning, then a whole reading.
+AIM_TOLERANCE = 5  # deg
+AIM_SETTLE_MS = 250
+lidar_aim_error = 0       # deg the servo was last commanded short of the walls
+lidar_aimed_ticks = None  # When it last came back onto them
+
+# (x_mm, y_mm, heading_deg, ticks_ms, confidence).  x and y are None until
+# the LIDARs have been read.  confidence runs from 0 (don't trust it) to 1.
+pose = (None, None, heading, ticks_ms(), 0)
+
+def _update_heading():
+    global heading, heading_error, heading_rate, last_imu_ticks
+    for (when, (_, _, rate_z)) in gyro_history.since(last_imu_ticks):
+        dt = ticks_diff(when, last_imu_ticks) / 1000
+        heading_rate = GYRO_SIGN * math.degrees(rate_z)
+        heading += heading_rate * dt
+        (ax, ay, _) = accel_history.value_at(when)
+        heading_error = _wrap180(heading_from_accel(ax, ay) - heading)
+        heading = (heading + ACCEL_GAIN * heading_error) % 360
+        last_imu_ticks = when
+
+def _update_position():
+    # lidar_histories[0] looks up, [1] looks over
+    for i, axis in enumerate([y_axis, x_axis]):
+        for (when, (dist,)) in lidar_histories[i].since(last_lidar_ticks[i]):
+            if not lidar_paused and _lidar_on_walls(when):
+                axis.update((BOARD_Y_MM if i == 0 else BOARD_X_MM) - dist, when)
+            last_lidar_ticks[i] = when
+
+# Stops (or restarts) using the LIDARs for position.  The rover is meant
+# to be standing still meanwhile, so the position holds where it was.
+def pause_lidar(paused):
+    global lidar_paused
+    lidar_paused = paused
+    if paused:
+        x_axis.vel = 0
+        y_axis.vel = 0
+
+# servos.py says how far short of the walls it has pointed the LIDARs.
+# The plans only take the rover off them to turn in place, so like
+# pause_lidar(), the position holds where it was meanwhile.
+def aim_lidar(error_deg):
+    global lidar_aim_error, lidar_aimed_ticks
+    if error_deg <= AIM_TOLERANCE and lidar_aim_error > AIM_TOLERANCE:
+        lidar_aimed_ticks = ticks_ms()
+    elif error_deg > AIM_TOLERANCE and lidar_aim_error <= AIM_TOLERANCE:
+        x_axis.vel = 0
+        y_axis.vel = 0
+    lidar_aim_error = error_deg
+
+# Whether a LIDAR reading taken at 'when' was of the walls
+def _lidar_on_walls(when):
+    if lidar_aim_error > AIM_TOLERANCE:
+        return False
+    return lidar_aimed_ticks is None or ticks_diff(when, lidar_aimed_ticks) >= AIM_SETTLE_MS
+
+def _publish(now):
+    global pose
+    if is_parked_flat():
+        hdg_confidence = 0
+    else:
+        hdg_confidence = max(0, 1 - abs(heading_error) / 45)
+    # While the LIDARs aren't on the walls, nothing is measuring the position
+    aim_confidence = 1 if _lidar_on_walls(now) else 0
+    confidence = min(hdg_confidence, aim_confidence, x_axis.confidence(now), y_axis.confidence(now))
+    pose = (x_axis.at(now), y_axis.at(now), heading, now, confidence)
+
+def estimate_pose_step():
+    _update_heading()
+    _update_position()
+    _publish(ticks_ms())
+
+def get_pose():
+    return pose
+
+def current_xy():
+    return (pose[0], pose[1])
+
+def current_pose_heading():
+    return pose[2]
+
+def get_heading_rate():
+    return heading_rate
@@ -0,0 +1,130 @@
+import os
+from adafruit_ticks import ticks_ms
+from flight_log import (RECORD_SIZE, TEXT_BYTES, FORMAT_VERSION, REC_START, pack_record, pack_text)
+
+# The flight recorder: what the rover saw and did, for replay_log.py to
+# pick over afterwards.  The record kinds and layout are in flight_log.py.
+#
+# record() packs one fixed-size record into a ring in RAM that's
+# allocated up front, so it's cheap enough to call from the control loop
+# and never allocates.  flush_step() (a background scheduler task) copies
+# whole blocks of the ring to LOG_FILE on flash, so the slow flash writes
+# happen in a few big pieces, away from the control loop.
+#
+# CIRCUITPY is read-only to code unless boot.py remounts it.  Until it
+# does, the recorder keeps just the last RING_RECORDS records, in RAM.  Either
+# way, /log downloads everything there is (see log_chunks()).
+
+LOG_FILE = "/flight.log"
+MAX_LOG_BYTES = 512 * 1024 # The log starts over when it gets to this
+RING_RECORDS = 512         # About 7s of driving
+BLOCK_RECORDS = 128        # Written to flash this many at a time
+FLUSH_INTERVAL = 0.5       # s, how often the scheduler runs flush_step()
+CHUNK_BYTES = 1024         # Read from flash this much at a time for /log
+MAX_TEXT_RECORDS = 64      # Longer texts are cut short; a TEXT record's sub can only count up to 255
+
+_ring = bytearray(RING_RECORDS * RECORD_SIZE)
+written = 0 # Records ever recorded; the next goes in slot written % RING_RECORDS
+flushed = 0 # Of those, how many are on flash (or lost)
+dropped = 0 # Records overwritten in the ring before they could be flushed
+log_file = LOG_FILE # None once writing to it has failed
+
+def record(kind, sub=0, a=0, b=0, c=0, d=0, e=0):
+    pack_record(_ring, (written % RING_RECORDS) * RECORD_SIZE, kind, sub, ticks_ms(), a, b, c, d, e)
+    _advance()
+
+def record_text(text):
+    data = text.encode()[:MAX_TEXT_RECORDS * TEXT_BYTES]
+    n = max(1, (len(data) + TEXT_BYTES - 1) // TEXT_BYTES)
+    now = ticks_ms()
+    for i in range(n):
+        pack_text(_ring, (written % RING_RECORDS) * RECORD_SIZE, now, n - 1 - i, data[i * TEXT_BYTES:(i + 1) * TEXT_BYTES])
+        _advance()
+
+def _advance():
+    global written, flushed, dropped
+    written += 1
+    if log_file is not None and written - flushed > RING_RECORDS:
+        # The oldest unflushed record has just been written over
+        dropped += 1
+        flushed += 1
+
+def _unflushed():
+    """The ring's records not on flash yet, oldest first, as one or two
+    memoryviews (two when they wrap round the end of the ring)"""
+    if written == flushed:
+        return []
+    start = (flushed % RING_RECORDS) * RECORD_SIZE
+    end = (written % RING_RECORDS) * RECORD_SIZE
+    ring = memoryview(_ring)
+    if start < end:
+        return [ring[start:end]]
+    return [ring[start:], ring[:end]]
+
+def _log_size():
+    try:
+        return os.stat(log_file)[6]
+    except OSError:
+        return 0
+
+def flush_step():
+    global flushed, log_file
+    if log_file is None:
+        flushed = written
+        return
+    if written - flushed < BLOCK_RECORDS:
+        return
+    parts = _unflushed()
+    try:
+        mode = "wb" if _log_size() > MAX_LOG_BYTES else "ab"
+        with open(log_file, mode) as file:
+            for part in parts:
+                file.write(part)
+        flushed = written
+    except OSError as e:
+        print(f"Flight recorder keeping to RAM, can't write {log_file}: {e}")
+        log_file = None
+        flushed = written
+
+def log_chunks():
+    """The whole log, in chunks for a ChunkedResponse: what's on flash,
+    then what's only in the ring so far"""
+    if log_file is not None:
+        try:
+            with open(log_file, "rb") as file:
+                while True:
+                    chunk = file.read(CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    yield chunk
+        except OSError:
+            pass
+        for part in _unflushed():
+            yield bytes(part)
+    else:
+        # Everything still in the ring
+        n = min(written, RING_RECORDS)
+        start = ((written - n) % RING_RECORDS) * RECORD_SIZE
+        end = (written % RING_RECORDS) * RECORD_SIZE
+        ring = memoryview(_ring)
+        if start < end:
+            yield bytes(ring[start:end])
+        elif n > 0:
+            yield bytes(ring[start:])
+            yield bytes(ring[:end])
+
+def clear():
+    global written, flushed, dropped
+    if log_file is not None:
+        try:
+            os.remove(log_file)
+        except OSError:
+            pass
+    (written, flushed, dropped) = (0, 0, 0)
+    record(REC_START, a=FORMAT_VERSION)
+
+def status():
+    where = f"{log_file}, {_log_size()} bytes" if log_file is not None else "RAM only"
+    return f"Flight recorder: {written} records, {written - flushed} not flushed, {dropped} dropped; {where}"
+
+record(REC_START, a=FORMAT_VERSION)
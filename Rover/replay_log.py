@@ -0,0 +1,217 @@
+# Reads a flight recorder log (from the rover's /log, or simulate.py
+# --log) and replays it through the stoppers and the planner, for tuning
+# them without the rover.  Runs on a desktop:
+#
+#   python3 replay_log.py flight.log                    # what happened, in brief
+#   python3 replay_log.py flight.log --dump             # every record
+#   python3 replay_log.py flight.log --stops            # re-run each action's stopper over its trace
+#   python3 replay_log.py flight.log --stops --latency 0.08 --coast-deg 0.7:6 1.0:9
+#   python3 replay_log.py flight.log --plans --turn-radius 100
+#
+# --stops rebuilds each action's stopper (X, Y or heading, predictive or
+# not) and feeds it the poses the control loop saw, to show when it would
+# have fired and how far from its target, next to what happened on the
+# rover.  The StopModel for predictive stoppers is the default one, or
+# --stop-model (a copy of the rover's stop_calibration.json), with any
+# of --latency, --coast-mm and --coast-deg on top.
+#
+# --plans works out each recorded plan again, from where it started, as
+# the shortest Dubins path in the empty arena with --turn-radius and
+# --margin, keeping to the headings the LIDAR servo can follow, next to
+# the segments the rover used.  (The rover's map isn't in the log, so
+# routes round obstacles will differ.)
+
+import argparse
+from flight_log import (KIND_NAMES, REC_ACTION, REC_CONTROL, REC_GOAL, REC_LIDAR, REC_SEGMENT, REC_START,
+                        REC_STOP, REC_TEXT, read_records)
+from nav_utils import HeadingStopper, PredictiveStopper, StopModel, XStopper, YStopper
+from planning import clamp_heading, shortest_path
+
+# As in driving.py
+ARENA_WIDTH = 1160
+ARENA_HEIGHT = 1060
+ARENA_MARGIN = 50
+MIN_TURN_RADIUS = 80
+LIDAR_HEADINGS = (0, 90)
+
+TICKS_PERIOD = 1 << 29  # adafruit_ticks wraps here
+
+# What a STOP record's sub says
+STOPPED_BY = {'C': 'stopped by controller', 'S': 'stopped by stopper', 'G': 'given up'}
+
+def with_times(records):
+    """The records with a time in seconds from the start of the log in
+    front, unwrapping ticks_ms() as it goes"""
+    timed = []
+    (last, t) = (None, 0)
+    for rec in records:
+        ticks = rec[2]
+        if last is not None:
+            t += ((ticks - last) % TICKS_PERIOD) / 1000
+        last = ticks
+        timed.append((t,) + rec)
+    return timed
+
+def describe(kind, sub, values):
+    if kind == REC_TEXT:
+        return f"'{values}'"
+    (a, b, c, d, e) = values
+    if kind == REC_START:
+        return f"format {a}"
+    if kind == REC_LIDAR:
+        return f"{['up', 'over'][sub] if sub < 2 else sub} {a}mm"
+    if kind == REC_CONTROL:
+        return f"({a}, {b}) hdg {c / 10:.1f} conf {sub / 100:.2f}, throttles {d / 1000:.2f} {e / 1000:.2f}"
+    if kind == REC_GOAL:
+        return f"goal ({a}, {b}) hdg {c / 10:.1f}"
+    if kind == REC_SEGMENT:
+        return f"#{d} {chr(sub)} from ({a}, {b}) hdg {c / 10:.1f}"
+    if kind == REC_ACTION:
+        target = f"{c / 100:.2f}s" if chr(sub) == 'T' else f"{c / 10:.1f}deg" if chr(sub) in 'Hh' else f"{c}mm"
+        return f"stopper {chr(sub)} to {target} from {d}, dir {e}, throttles {a / 1000:.2f} {b / 1000:.2f}"
+    if kind == REC_STOP:
+        return f"{STOPPED_BY.get(chr(sub), chr(sub))} at ({a}, {b}) hdg {c / 10:.1f}, remaining {d}"
+    return str(values)
+
+def summary(timed):
+    counts = {}
+    for (_, kind, _, _, _) in timed:
+        counts[KIND_NAMES.get(kind, kind)] = counts.get(KIND_NAMES.get(kind, kind), 0) + 1
+    print(f"{len(timed)} records over {timed[-1][0]:.1f}s: {', '.join([f'{n} {k}' for (k, n) in counts.items()])}")
+    for (t, kind, sub, _, values) in timed:
+        if kind in (REC_START, REC_TEXT, REC_GOAL, REC_STOP):
+            print(f"  {t:8.2f}s {KIND_NAMES[kind]:8} {describe(kind, sub, values)}")
+
+def dump(timed):
+    for (t, kind, sub, ticks, values) in timed:
+        print(f"{t:8.3f}s {ticks:10} {KIND_NAMES.get(kind, kind):8} {describe(kind, sub, values)}")
+
+def _stopper(sub, values, model):
+    """The stopper an ACTION record describes, or None for one that can't
+    be replayed"""
+    (left, right, target, start, dir) = values
+    kind = chr(sub)
+    if kind.upper() == 'X':
+        stopper = XStopper(start, target)
+    elif kind.upper() == 'Y':
+        stopper = YStopper(start, target)
+    elif kind.upper() == 'H':
+        stopper = HeadingStopper(start / 10, 'right' if dir > 0 else 'left', target / 10)
+    else:
+        return None
+    if kind.islower():
+        stopper = PredictiveStopper(stopper, max(abs(left), abs(right)) / 1000, model)
+    return stopper
+
+def _actions(timed):
+    """Each ACTION with the poses it was driven through, up to and
+    including the one it stopped at: (t, sub, action values, [(t, x, y, hdg)],
+    (sub, values) of its STOP record, or None if a new plan replaced it)"""
+    actions = []
+    current = None
+    for (t, kind, sub, _, values) in timed:
+        if kind == REC_ACTION:
+            current = (t, sub, values, [], [None])
+            actions.append(current)
+        elif current is None:
+            continue
+        elif kind == REC_CONTROL:
+            current[3].append((t, values[0], values[1], values[2] / 10))
+        elif kind == REC_STOP:
+            current[3].append((t, values[0], values[1], values[2] / 10))
+            current[4][0] = (sub, values)
+            current = None
+        elif kind == REC_START or (kind == REC_SEGMENT and values[3] == 0):
+            current = None
+    return [(t, sub, values, trace, stop[0]) for (t, sub, values, trace, stop) in actions]
+
+def replay_stops(timed, model):
+    print(f"Replaying stoppers with {model}")
+    for (t, sub, values, trace, stop) in _actions(timed):
+        stopper = _stopper(sub, values, model)
+        if stopper is None or len(trace) == 0:
+            continue
+        scale = 10 if chr(sub) in 'Hh' else 1
+        units = "deg" if scale == 10 else "mm"
+        fired = None
+        for (st, x, y, hdg) in trace:
+            if stopper.should_stop(x, y, hdg, st):
+                fired = (st, stopper.remaining(x, y, hdg))
+                break
+        line = f"  {t:8.2f}s {describe(REC_ACTION, sub, values)}: "
+        if stop is None:
+            line += f"replaced by a new plan after {trace[-1][0] - t:.2f}s"
+        else:
+            line += f"{STOPPED_BY.get(chr(stop[0]), chr(stop[0]))} after {trace[-1][0] - t:.2f}s, " \
+                    f"{stop[1][3] / scale:.1f}{units} to go"
+        if fired is None:
+            line += "; replayed, hasn't fired by then"
+        else:
+            line += f"; replayed, fires after {fired[0] - t:.2f}s, {fired[1]:.1f}{units} to go"
+        print(line)
+
+def replay_plans(timed, radius, margin):
+    print(f"Replanning with turn radius {radius}mm, margin {margin}mm")
+    goal = None
+    plans = []
+    for (t, kind, sub, _, values) in timed:
+        if kind == REC_GOAL:
+            goal = (values[0], values[1], values[2] / 10)
+        elif kind == REC_SEGMENT and goal is not None:
+            if values[3] == 0:
+                plans.append((t, goal, (values[0], values[1], values[2] / 10), []))
+            if plans:
+                plans[-1][3].append(chr(sub))
+    for (t, goal, start, kinds) in plans:
+        # Turning in place into LIDAR_HEADINGS first, and out of them at the end, if need be
+        best = shortest_path(ARENA_WIDTH, ARENA_HEIGHT, start[0], start[1], clamp_heading(start[2], LIDAR_HEADINGS),
+                             goal[0], goal[1], clamp_heading(goal[2], LIDAR_HEADINGS), radius, margin, LIDAR_HEADINGS)
+        again = "none in the arena" if best is None else \
+            f"{' '.join([f'{k}{length:.0f}' for (k, length) in best[1]])} ({best[0]:.0f}mm)"
+        print(f"  {t:8.2f}s ({start[0]}, {start[1]}) hdg {start[2]:.1f} to ({goal[0]}, {goal[1]}) hdg {goal[2]:.1f}: "
+              f"rover {' '.join(kinds)}; replanned {again}")
+
+def _levels(pairs):
+    table = {}
+    for pair in pairs:
+        (thr, coast) = pair.split(":")
+        table[float(thr)] = float(coast)
+    return table
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a flight recorder log")
+    parser.add_argument("log", help="the log, from the rover's /log or simulate.py --log")
+    parser.add_argument("--dump", action="store_true", help="print every record")
+    parser.add_argument("--stops", action="store_true", help="replay each action's stopper over its trace")
+    parser.add_argument("--stop-model", help="a stop_calibration.json to replay predictive stoppers with")
+    parser.add_argument("--latency", type=float, help="stop latency, s, replacing the model's")
+    parser.add_argument("--coast-mm", nargs="+", metavar="THR:MM", help="straight coasts, replacing the model's")
+    parser.add_argument("--coast-deg", nargs="+", metavar="THR:DEG", help="turning coasts, replacing the model's")
+    parser.add_argument("--plans", action="store_true", help="work each plan out again")
+    parser.add_argument("--turn-radius", type=float, default=MIN_TURN_RADIUS, help="mm, for --plans")
+    parser.add_argument("--margin", type=float, default=ARENA_MARGIN, help="mm, for --plans")
+    args = parser.parse_args()
+
+    with open(args.log, "rb") as file:
+        timed = with_times(read_records(file.read()))
+    if not timed:
+        print("No records")
+        return
+    if args.dump:
+        dump(timed)
+    elif not (args.stops or args.plans):
+        summary(timed)
+    if args.stops:
+        model = StopModel.load(args.stop_model) if args.stop_model else StopModel()
+        if args.latency is not None:
+            model.latency = args.latency
+        if args.coast_mm:
+            model.coast_mm = _levels(args.coast_mm)
+        if args.coast_deg:
+            model.coast_deg = _levels(args.coast_deg)
+        replay_stops(timed, model)
+    if args.plans:
+        replay_plans(timed, args.turn_radius, args.margin)
+
+if __name__ == "__main__":
+    main()
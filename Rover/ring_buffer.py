@@ -0,0 +1,75 @@
+from array import array
+from adafruit_ticks import ticks_diff
+
+# A fixed-size history of timestamped sensor samples.
+# Each sample is a ticks_ms() timestamp plus 'channels' values (eg the
+# x, y and z of one accelerometer reading).  Everything lives in arrays
+# allocated up front, so adding a sample never allocates.
+class SampleRing:
+    def __init__(self, size, channels=1, typecode='f'):
+        self.size = size
+        self.channels = channels
+        self.ticks = array('L', [0] * size)
+        self.values = array(typecode, [0] * (size * channels))
+        self.next = 0   # Slot the next sample goes in
+        self.count = 0  # How many slots hold a sample
+
+    def __len__(self):
+        return self.count
+
+    def append(self, when, values):
+        slot = self.next
+        self.ticks[slot] = when
+        base = slot * self.channels
+        for c in range(self.channels):
+            self.values[base + c] = values[c]
+        self.next = (slot + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def _slot(self, age):
+        # age 0 is the newest sample, 1 the one before it, ...
+        return (self.next - 1 - age) % self.size
+
+    def _sample(self, slot):
+        base = slot * self.channels
+        return (self.ticks[slot], tuple(self.values[base:base + self.channels]))
+
+    # Returns (ticks, values) for the newest sample, or None if there's none yet
+    def latest(self):
+        if self.count == 0:
+            return None
+        return self._sample(self._slot(0))
+
+    # Returns up to n of the newest samples as (ticks, values), oldest first
+    def last_n(self, n):
+        n = min(n, self.count)
+        return [self._sample(self._slot(age)) for age in range(n - 1, -1, -1)]
+
+    # Returns the samples newer than time 'when' as (ticks, values), oldest first
+    def since(self, when):
+        age = 0
+        while age < self.count and ticks_diff(self.ticks[self._slot(age)], when) > 0:
+            age += 1
+        return self.last_n(age)
+
+    # Returns the values at time 'when', interpolated between the samples
+    # either side of it.  Before the oldest sample or after the newest,
+    # returns that sample's values.  None if the ring is empty.
+    def value_at(self, when):
+        if self.count == 0:
+            return None
+        newer = self._slot(0)
+        if ticks_diff(when, self.ticks[newer]) >= 0:
+            return self._sample(newer)[1]
+        for age in range(1, self.count):
+            older = self._slot(age)
+            since_older = ticks_diff(when, self.ticks[older])
+            if since_older >= 0:
+                span = ticks_diff(self.ticks[newer], self.ticks[older])
+                frac = since_older / span if span > 0 else 1
+                (_, old_vals) = self._sample(older)
+                (_, new_vals) = self._sample(newer)
+                return tuple(o + (n - o) * frac for o, n in zip(old_vals, new_vals))
+            newer = older
+        return self._sample(newer)[1]
@@ -0,0 +1,160 @@
+import time
+from asyncio import sleep as async_sleep
+from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+
+# Runs the rover's periodic work on deadlines.
+#
+# Each task is a plain function, registered with a rate and a priority.
+# Its deadlines sit on a fixed grid (every 1/hz from the start), so it
+# doesn't drift the way a loop that sleeps a fixed amount after its work
+# does.  When several tasks are due at once the highest priority goes
+# first.  A task that falls a whole period or more behind skips the
+# periods it missed rather than running them back to back.
+#
+# Between tasks, and while nothing is due, the scheduler sleeps, so other
+# asyncio tasks (a map sweep, stop calibration) still get their turn.
+#
+# Every task keeps running totals of how it's doing -- a few ints each,
+# however long it runs -- for the 'stats' command.
+
+# Priorities, highest first
+PRIORITY_SENSORS = 3  # Reading the hardware before its buffers overflow
+PRIORITY_CONTROL = 2  # Pose and motors
+PRIORITY_PLANNING = 1
+PRIORITY_BACKGROUND = 0  # Network and display
+
+def _us():
+    return time.monotonic_ns() // 1000
+
+class PeriodicTask:
+    def __init__(self, name, fn, hz, priority):
+        self.name = name
+        self.fn = fn
+        self.priority = priority
+        self.enabled = True
+        self.set_rate(hz)
+        self.next_due = ticks_ms()
+        self.reset_stats()
+
+    def set_rate(self, hz):
+        self.period_ms = max(1, round(1000 / hz))
+        self.next_due = ticks_ms()
+
+    def reset_stats(self):
+        self.runs = 0
+        self.last_start = None
+        self.sum_period = 0  # ms between starts
+        self.max_period = 0
+        self.sum_late = 0    # ms from the deadline to the start (jitter)
+        self.max_late = 0
+        self.sum_exec = 0    # us running
+        self.max_exec = 0
+        self.overruns = 0    # Runs that ended after the next deadline
+        self.skipped = 0     # Deadlines missed altogether
+
+    def run(self, now):
+        late = ticks_diff(now, self.next_due)
+        start = _us()
+        self.fn()
+        exec_us = _us() - start
+        self.runs += 1
+        if self.last_start is not None:
+            period = ticks_diff(now, self.last_start)
+            self.sum_period += period
+            self.max_period = max(self.max_period, period)
+        self.last_start = now
+        self.sum_late += late
+        self.max_late = max(self.max_late, late)
+        self.sum_exec += exec_us
+        self.max_exec = max(self.max_exec, exec_us)
+
+        self.next_due = ticks_add(self.next_due, self.period_ms)
+        behind = ticks_diff(ticks_ms(), self.next_due)
+        if behind > 0:
+            self.overruns += 1
+            missed = behind // self.period_ms
+            if missed > 0:
+                self.skipped += missed
+                self.next_due = ticks_add(self.next_due, missed * self.period_ms)
+
+    def __str__(self):
+        if not self.enabled:
+            return f"{self.name}: off"
+        if self.runs < 2:
+            return f"{self.name}: {self.runs} runs"
+        mean_period = self.sum_period / (self.runs - 1)
+        return (f"{self.name}: {1000 / self.period_ms:.0f}Hz wanted, {1000 / mean_period:.1f}Hz got "
+                f"(period max {self.max_period}ms), late mean {self.sum_late / self.runs:.1f} max {self.max_late}ms, "
+                f"exec mean {self.sum_exec / self.runs / 1000:.2f} max {self.max_exec / 1000:.1f}ms, "
+                f"{self.overruns} overruns, {self.skipped} skipped")
+
+# Runs a task fast while there's something for it to do, and backs it off
+# to a slow rate while there isn't.  The task reports which by calling
+# busy() or idle() each run.  After 'linger' seconds without anything
+# busy, each idle run halves the rate, down to idle_hz.
+class AdaptiveRate:
+    def __init__(self, task, idle_hz, busy_hz, linger=2):
+        self.task = task
+        self.idle_period_ms = round(1000 / idle_hz)
+        self.busy_hz = busy_hz
+        self.linger_ms = round(linger * 1000)
+        self.last_busy = ticks_ms()
+        task.set_rate(idle_hz)
+
+    def busy(self):
+        self.last_busy = ticks_ms()
+        if self.task.period_ms > round(1000 / self.busy_hz):
+            self.task.set_rate(self.busy_hz)
+
+    def idle(self):
+        if self.task.period_ms < self.idle_period_ms and ticks_diff(ticks_ms(), self.last_busy) > self.linger_ms:
+            self.task.period_ms = min(self.task.period_ms * 2, self.idle_period_ms)
+
+class Scheduler:
+    def __init__(self):
+        self.tasks = []  # Highest priority first
+
+    def add(self, name, fn, hz, priority):
+        task = PeriodicTask(name, fn, hz, priority)
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: -t.priority)
+        return task
+
+    def _most_urgent(self, now):
+        # The first due task in priority order; of equal priorities, the
+        # most overdue
+        best = None
+        for task in self.tasks:
+            if best is not None and task.priority < best.priority:
+                break
+            if task.enabled and ticks_diff(now, task.next_due) >= 0:
+                if best is None or ticks_diff(task.next_due, best.next_due) < 0:
+                    best = task
+        return best
+
+    async def run(self):
+        now = ticks_ms()
+        for task in self.tasks:
+            task.next_due = now
+        while True:
+            now = ticks_ms()
+            task = self._most_urgent(now)
+            if task is None:
+                wait = min([ticks_diff(t.next_due, now) for t in self.tasks if t.enabled])
+                await async_sleep(wait / 1000)
+                continue
+            task.run(now)
+            await async_sleep(0)
+
+    def task(self, name):
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        return None
+
+    def reset_stats(self):
+        for task in self.tasks:
+            task.reset_stats()
+
+    def __str__(self):
+        return "\n".join([str(task) for task in self.tasks])
@@ -1,6 +1,10 @@
 from asyncio import sleep as async_sleep
 from adafruit_servokit import ServoKit
-from imu import current_heading, is_parked_flat
+from adafruit_ticks import ticks_ms, ticks_add, ticks_diff
+from imu import is_parked_flat
+from lidar import get_readings
+from occupancy import SWEEP_ANGLES, lidar_mount_bearing
+from pose import aim_lidar, current_pose_heading, get_pose, pause_lidar
 kit = ServoKit(channels=8)
 
 kit.servo[0].set_pulse_width_range(450, 2550)
@@ -18,9 +22,11 @@ async def _test_sweep():
 
 pause_tracking = False
 
+SERVO_CMDS = ['servo']
+
 def handle_servo_cmd(cmd):
     cmd_words = cmd.split()
-    if cmd_words[0] != 'servo':
+    if cmd_words[0] not in SERVO_CMDS:
         return (False, 'Not for me')
     try:
         snum = int(cmd_words[1])
@@ -36,6 +42,9 @@ def handle_servo_cmd(cmd):
 def set_servo(snum, angle):
     global pause_tracking
     pause_tracking = True
+    if snum == 0:
+        # Pointed by hand, not at the walls, until tracking is back on
+        aim_lidar(180)
     kit.servo[snum].angle = angle
 
 def enable_tracking():
@@ -51,15 +60,62 @@ def point_lidar_to_calibrated_heading(h):
     # To point to 90, send signal 0
     if h < 180:
         h += 360
-    h = clamp(h, 270, 450)
-    desired_angle = int((450 - h) * 166/180)
+    aimed = clamp(h, 270, 450)
+    # Past the ends the LIDARs aren't facing the walls, and the pose
+    # mustn't use them
+    aim_lidar(abs(aimed - h))
+    desired_angle = int((450 - aimed) * 166/180)
     kit.servo[0].angle = desired_angle
 
-async def loop_point_lidar():
-    global pause_tracking
-    while True:
-        if not pause_tracking and not is_parked_flat():
-            h = current_heading()
-            point_lidar_to_calibrated_heading(360-h)
-        await async_sleep(0.1)
-        
\ No newline at end of file
+# Run every POINT_INTERVAL by the scheduler.  The LIDARs lag the heading by
+# up to this, so turning at 200 deg/s they're 4 degrees off the walls
+# (aim_lidar()'s tolerance is 5); any slower to follow and a turn in place
+# throws the position out by tens of mm.
+POINT_INTERVAL = 0.02 # s
+
+def point_lidar_step():
+    if not pause_tracking and not is_parked_flat():
+        h = current_pose_heading()
+        point_lidar_to_calibrated_heading(360-h)
+        
+
+# Map sweeps: how long the servo takes to get to each angle, and then how
+# long a LIDAR reading takes (its timing budget), so only readings started
+# after the servo stopped count
+SWEEP_SETTLE = 0.15 # s
+SWEEP_READING_MS = 100
+SWEEP_TIMEOUT = 0.5 # s to wait for the readings at one angle
+
+sweeping = False
+
+# Turns the LIDARs through SWEEP_ANGLES and adds both readings at each angle
+# to the occupancy grid.  The rover has to stand still: the LIDARs can't
+# give its position meanwhile, so the pose is taken once, at the start.
+# Returns False if there's no pose to sweep from.
+async def sweep_lidar(grid):
+    global sweeping
+    (x, y, hdg, _, _) = get_pose()
+    if x is None or y is None:
+        return False
+    sweeping = True
+    pause_lidar(True)
+    try:
+        for angle in SWEEP_ANGLES:
+            set_servo(0, angle)
+            await async_sleep(SWEEP_SETTLE)
+            fresh_after = ticks_add(ticks_ms(), SWEEP_READING_MS)
+            waited = 0
+            readings = get_readings()
+            while waited < SWEEP_TIMEOUT and any([r is None or ticks_diff(r[1], fresh_after) < 0 for r in readings]):
+                await async_sleep(0.02)
+                waited += 0.02
+                readings = get_readings()
+            up = hdg + lidar_mount_bearing(angle)
+            for (r, bearing) in zip(readings, [up, up + 90]):
+                if r is not None and ticks_diff(r[1], fresh_after) >= 0:
+                    grid.add_ray(x, y, bearing, r[0])
+    finally:
+        pause_lidar(False)
+        enable_tracking()
+        sweeping = False
+    return True
@@ -0,0 +1,96 @@
+import asyncio
+import collections.abc
+import selectors
+import time
+
+# An asyncio event loop that runs on the simulated world's clock.
+#
+# Whenever every task is asleep, the loop jumps the world forward to the
+# next wake-up instead of waiting, so a run goes as fast as the desktop
+# can do the work.  Work isn't free, though: each task step is charged
+# STEP_COST of world time, plus the CPU time it really took times
+# CPU_SCALE, since the board's CircuitPython is much slower than desktop
+# CPython.  Stubs charge() for work the board's hardware does that the
+# desktop doesn't, like polling a socket.
+
+STEP_COST = 0.0005  # s of world time per task step
+CPU_SCALE = 20      # World seconds per second of desktop CPU
+
+class TaskStats:
+    def __init__(self, name):
+        self.name = name
+        self.steps = 0
+        self.cpu = 0.0  # s of world time charged
+
+# Wraps a task's coroutine to count its steps and time them
+class _CountedCoro(collections.abc.Coroutine):
+    def __init__(self, coro, loop):
+        self.coro = coro
+        self.loop = loop
+        name = getattr(coro, '__qualname__', type(coro).__name__)
+        self.stats = loop.task_stats.setdefault(name, TaskStats(name))
+
+    def _run(self, fn, *args):
+        start = time.perf_counter()
+        self.loop.running = self.stats
+        try:
+            return fn(*args)
+        finally:
+            self.loop.running = None
+            self.stats.steps += 1
+            self.loop.charge(self.loop.step_cost + (time.perf_counter() - start) * self.loop.cpu_scale, self.stats)
+
+    def send(self, value):
+        return self._run(self.coro.send, value)
+
+    def throw(self, *args):
+        return self._run(self.coro.throw, *args)
+
+    def close(self):
+        self.coro.close()
+
+    def __await__(self):
+        return self
+
+    def __next__(self):
+        return self.send(None)
+
+# Ignores real I/O; select() is where the world's time goes by
+class _WorldSelector(selectors.DefaultSelector):
+    def __init__(self, world):
+        super().__init__()
+        self.world = world
+        self.loop = None
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError("Nothing left to run in the simulation")
+        # The work done since last time, then any sleep still to go
+        self.world.advance(max(self.loop.owed, timeout))
+        self.loop.owed = 0
+        return []
+
+class SimEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, world, step_cost=STEP_COST, cpu_scale=CPU_SCALE):
+        selector = _WorldSelector(world)
+        # These are used from the selector, which the base class sets up
+        self.owed = 0.0
+        self.running = None  # TaskStats of the step being run
+        self.step_cost = step_cost
+        self.cpu_scale = cpu_scale
+        self.task_stats = {}
+        self.world = world
+        super().__init__(selector)
+        selector.loop = self
+        self.set_task_factory(lambda loop, coro, **kwargs: asyncio.Task(_CountedCoro(coro, loop), loop=loop, **kwargs))
+
+    def time(self):
+        return self.world.now
+
+    def charge(self, cost, stats=None):
+        """Adds cost seconds of work to the task step being run (or stats'
+        task), for the world to catch up on at the next select()"""
+        stats = stats or self.running
+        if stats is not None:
+            stats.cpu += cost
+        self.owed += cost
@@ -0,0 +1,7 @@
+class Label:
+    def __init__(self, font, text="", color=0xFFFFFF):
+        self.font = font
+        self.text = text
+        self.color = color
+        self.x = 0
+        self.y = 0
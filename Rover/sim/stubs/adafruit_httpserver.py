@@ -0,0 +1,81 @@
+# Just enough of the server for code.py: routes are recorded but never
+# served, and the websocket is a pair of queues the simulator fills and
+# empties.
+#
+# Polling isn't free on the board: an accept() or recv() on a socket with
+# nothing waiting still goes through the network stack.  These are rough
+# guesses at what one costs there, charged to the task that polls.
+
+import asyncio
+
+POLL_COST = 0.0005    # s per server.poll()
+RECEIVE_COST = 0.0003 # s per Websocket.receive()
+
+GET = "GET"
+POST = "POST"
+
+NO_REQUEST = "no_request"
+REQUEST_HANDLED_RESPONSE_SENT = "request_handled_response_sent"
+
+class Status:
+    def __init__(self, code, text):
+        self.code = code
+        self.text = text
+
+OK_200 = Status(200, "OK")
+
+class Request:
+    def __init__(self, path="/", method=GET, headers=None):
+        self.path = path
+        self.method = method
+        self.headers = headers or {}
+
+class Response:
+    def __init__(self, request, body="", content_type="text/plain", status=OK_200, headers=None):
+        self.request = request
+        self.body = body
+        self.content_type = content_type
+        self.status = status
+        self.headers = headers or {}
+
+class ChunkedResponse:
+    def __init__(self, request, body, content_type="text/plain", status=OK_200, headers=None):
+        self.request = request
+        self.body = body  # A function returning a generator of chunks
+        self.content_type = content_type
+        self.status = status
+        self.headers = headers or {}
+
+class Websocket:
+    def __init__(self, request=None):
+        self.incoming = []  # Messages from the client, oldest first
+        self.sent = []      # Messages to the client
+
+    def receive(self, fail_silently=False):
+        asyncio.get_event_loop().charge(RECEIVE_COST)
+        return self.incoming.pop(0) if self.incoming else None
+
+    def send_message(self, message, fail_silently=False):
+        # The real one has sent binary messages by the time it returns, so
+        # callers can reuse their buffers
+        self.sent.append(message if isinstance(message, str) else bytes(message))
+
+    def close(self):
+        pass
+
+class Server:
+    def __init__(self, pool, root_path=None, debug=False):
+        self.routes = {}
+
+    def route(self, path, method=GET):
+        def register(handler):
+            self.routes[(path, method)] = handler
+            return handler
+        return register
+
+    def start(self, host, port=80):
+        pass
+
+    def poll(self):
+        asyncio.get_event_loop().charge(POLL_COST)
+        return NO_REQUEST
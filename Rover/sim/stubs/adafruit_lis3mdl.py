@@ -0,0 +1,3 @@
+class LIS3MDL:
+    def __init__(self, i2c):
+        self.magnetic = (0.0, 0.0, 0.0)
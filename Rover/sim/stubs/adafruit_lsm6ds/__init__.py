@@ -0,0 +1,30 @@
+# The library's register codes, which imu.py relies on
+
+class Rate:
+    RATE_SHUTDOWN = 0
+    RATE_12_5_HZ = 1
+    RATE_26_HZ = 2
+    RATE_52_HZ = 3
+    RATE_104_HZ = 4
+    RATE_208_HZ = 5
+    RATE_416_HZ = 6
+    RATE_833_HZ = 7
+    RATE_1_66K_HZ = 8
+    RATE_3_33K_HZ = 9
+    RATE_6_66K_HZ = 10
+
+class AccelRange:
+    RANGE_2G = 0
+    RANGE_16G = 1
+    RANGE_4G = 2
+    RANGE_8G = 3
+
+class GyroRange:
+    RANGE_125_DPS = 125
+    RANGE_250_DPS = 0
+    RANGE_500_DPS = 1
+    RANGE_1000_DPS = 2
+    RANGE_2000_DPS = 3
+
+# Hz for each Rate code
+RATE_HZ = [0, 12.5, 26, 52, 104, 208, 416, 833, 1660, 3330, 6660]
@@ -0,0 +1,77 @@
+import math
+import struct
+from sim.world import world
+from adafruit_lsm6ds import RATE_HZ, Rate
+
+# An LSM6DSOX whose FIFO fills with tagged accel and gyro words at the
+# data rate, read through the registers imu.py uses.  Raw values are
+# scaled for the 4G and 500DPS ranges imu.py sets.
+
+_FIFO_CTRL4 = 0x0A
+_FIFO_STATUS1 = 0x3A
+_FIFO_DATA_OUT_TAG = 0x78
+_TAG_GYRO = 0x01
+_TAG_ACCEL = 0x02
+_ACCEL_LSB = 0.122 / 1000 * 9.80665      # m/s^2
+_GYRO_LSB = 17.5 / 1000 * math.pi / 180  # rad/s
+FIFO_WORDS = 438  # 3KB of 7-byte words
+
+def _raw(values, lsb):
+    return [max(-32768, min(32767, round(v / lsb))) for v in values]
+
+class _Device:
+    def __init__(self, sensor):
+        self.sensor = sensor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write(self, buf):
+        if len(buf) >= 2 and buf[0] == _FIFO_CTRL4 and buf[1] & 0x07 == 0:
+            self.sensor.fifo.clear()  # Bypass mode empties it
+
+    def write_then_readinto(self, out_buf, in_buf, in_end=None):
+        n = len(in_buf) if in_end is None else in_end
+        fifo = self.sensor.fifo
+        if out_buf[0] == _FIFO_STATUS1:
+            words = len(fifo)
+            in_buf[0] = words & 0xFF
+            in_buf[1] = ((words >> 8) & 0x03) | (0x40 if self.sensor.overrun else 0)
+            self.sensor.overrun = False
+        elif out_buf[0] == _FIFO_DATA_OUT_TAG:
+            for w in range(n // 7):
+                (tag, xyz) = fifo.pop(0) if fifo else (0, (0, 0, 0))
+                struct.pack_into("<Bhhh", in_buf, 7 * w, tag << 3, *xyz)
+
+class LSM6DSOX:
+    def __init__(self, i2c):
+        self.i2c_device = _Device(self)
+        self.accelerometer_range = None
+        self.gyro_range = None
+        self.accelerometer_data_rate = Rate.RATE_104_HZ
+        self.gyro_data_rate = Rate.RATE_104_HZ
+        self.fifo = []
+        self.overrun = False
+        self.next_sample = world.now
+        world.devices.append(self)
+
+    @property
+    def acceleration(self):
+        return world.accel()
+
+    @property
+    def gyro(self):
+        return world.gyro()
+
+    def update(self, now):
+        period = 1 / RATE_HZ[self.accelerometer_data_rate]
+        while now >= self.next_sample:
+            for (tag, xyz) in [(_TAG_GYRO, _raw(world.gyro(), _GYRO_LSB)), (_TAG_ACCEL, _raw(world.accel(), _ACCEL_LSB))]:
+                if len(self.fifo) >= FIFO_WORDS:
+                    self.fifo.pop(0)
+                    self.overrun = True
+                self.fifo.append((tag, xyz))
+            self.next_sample += period
@@ -0,0 +1,4 @@
+class MAX17048:
+    def __init__(self, i2c):
+        self.cell_percent = 87.5
+        self.cell_voltage = 3.9
@@ -0,0 +1,20 @@
+from sim.world import world
+
+# motor1 is the left wheel and motor2 the right, as driving.py has them
+
+class _Motor:
+    def __init__(self, side):
+        self.side = side
+
+    @property
+    def throttle(self):
+        return world.throttles[self.side]
+
+    @throttle.setter
+    def throttle(self, value):
+        world.throttles[self.side] = 0.0 if value is None else max(-1.0, min(1.0, value))
+
+class MotorKit:
+    def __init__(self, address=0x60, i2c=None):
+        self.motor1 = _Motor(0)
+        self.motor2 = _Motor(1)
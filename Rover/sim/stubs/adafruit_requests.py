@@ -0,0 +1,3 @@
+class Session:
+    def __init__(self, socket_pool, ssl_context=None):
+        pass
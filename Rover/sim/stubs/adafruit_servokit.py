@@ -0,0 +1,25 @@
+from sim.world import world
+
+# Servo 0 turns the LIDARs
+
+class _Servo:
+    def __init__(self, channel):
+        self.channel = channel
+        self._angle = 90
+
+    def set_pulse_width_range(self, min_pulse, max_pulse):
+        pass
+
+    @property
+    def angle(self):
+        return self._angle
+
+    @angle.setter
+    def angle(self, value):
+        self._angle = value
+        if self.channel == 0:
+            world.servo_angle = value
+
+class ServoKit:
+    def __init__(self, channels):
+        self.servo = [_Servo(i) for i in range(channels)]
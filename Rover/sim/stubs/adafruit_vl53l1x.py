@@ -0,0 +1,70 @@
+import struct
+import board
+from sim.world import world
+
+# A VL53L1X that ranges continuously once started: a reading every
+# inter-measurement period, from the world's geometry.  Each one raises
+# data_ready, and pulses the sensor's interrupt pin (board.LIDAR_INT_PINS)
+# unless the last reading hasn't been cleared yet.
+
+_CLOCK_PLL = 1000  # What the oscillator calibration register reads as
+
+class VL53L1X:
+    _count = 0
+
+    def __init__(self, i2c, address=0x29):
+        self.index = VL53L1X._count
+        VL53L1X._count += 1
+        self.address = address
+        self.int_pin = board.LIDAR_INT_PINS[self.index] if self.index < len(board.LIDAR_INT_PINS) else None
+        self._interrupt_polarity = 1
+        self.distance_mode = 2
+        self.timing_budget = 100
+        self.period_ms = 100
+        self.ranging = False
+        self.next_reading = None
+        self._ready = False
+        self._distance = None
+        world.devices.append(self)
+
+    def set_address(self, new_address):
+        self.address = new_address
+
+    def _read_register(self, address, length=1):
+        if address == 0x00DE:
+            return struct.pack(">H", _CLOCK_PLL)
+        return bytes(length)
+
+    def _write_register(self, address, data):
+        if address == 0x006C:
+            # lidar._set_inter_measurement()
+            self.period_ms = struct.unpack(">I", data)[0] / (_CLOCK_PLL * 1.075)
+
+    def start_ranging(self):
+        self.ranging = True
+        self.next_reading = world.now + max(self.period_ms, self.timing_budget) / 1000
+
+    def stop_ranging(self):
+        self.ranging = False
+
+    @property
+    def data_ready(self):
+        return self._ready
+
+    @property
+    def distance(self):
+        """cm, or None if nothing's in range"""
+        return self._distance
+
+    def clear_interrupt(self):
+        self._ready = False
+
+    def update(self, now):
+        while self.ranging and now >= self.next_reading:
+            dist = world.lidar_distance(self.index)
+            self._distance = None if dist is None else dist / 10
+            if not self._ready and self.int_pin is not None:
+                world.pin_edge(self.int_pin, True)
+                world.pin_edge(self.int_pin, False)
+            self._ready = True
+            self.next_reading += max(self.period_ms, self.timing_budget) / 1000
@@ -0,0 +1,42 @@
+# Simulated board: pins are just names, and the buses and display are
+# placeholders for the sensor stubs to be handed.
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"board.{self.name}"
+
+D0 = Pin("D0")
+D5 = Pin("D5")
+D6 = Pin("D6")
+D9 = Pin("D9")
+D10 = Pin("D10")
+
+# Which pin each VL53L1X's data-ready line is wired to, in the order
+# lidar.py creates them (as in its SENSOR_CONFIG)
+LIDAR_INT_PINS = [D9, D10]
+
+class _I2C:
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def scan(self):
+        return []
+
+def I2C():
+    return _I2C()
+
+def STEMMA_I2C():
+    return _I2C()
+
+class _Display:
+    width = 240
+    height = 135
+    root_group = None
+
+DISPLAY = _Display()
@@ -0,0 +1,7 @@
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+
+    def switch_to_output(self, value=False):
+        self.value = value
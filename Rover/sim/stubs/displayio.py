@@ -0,0 +1,21 @@
+class Group(list):
+    def __init__(self, scale=1, x=0, y=0):
+        super().__init__()
+        self.scale = scale
+        self.x = x
+        self.y = y
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        self.width = width
+        self.height = height
+
+class Palette(list):
+    def __init__(self, color_count):
+        super().__init__([0] * color_count)
+
+class TileGrid:
+    def __init__(self, bitmap, pixel_shader=None, x=0, y=0):
+        self.bitmap = bitmap
+        self.x = x
+        self.y = y
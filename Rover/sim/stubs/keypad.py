@@ -0,0 +1,31 @@
+from sim.world import world
+import adafruit_ticks
+
+# Pin edges come from the simulated sensors, through world.pin_edge()
+
+class Event:
+    def __init__(self, key_number, pressed, timestamp):
+        self.key_number = key_number
+        self.pressed = pressed
+        self.released = not pressed
+        self.timestamp = timestamp
+
+class EventQueue:
+    def __init__(self):
+        self.queue = []
+
+    def get(self):
+        return self.queue.pop(0) if self.queue else None
+
+    def clear(self):
+        self.queue.clear()
+
+class Keys:
+    def __init__(self, pins, value_when_pressed=False, pull=True, interval=0.02):
+        self.pins = list(pins)
+        self.events = EventQueue()
+        world.edge_listeners.append(self)
+
+    def edge(self, pin, pressed):
+        if pin in self.pins:
+            self.events.queue.append(Event(self.pins.index(pin), pressed, adafruit_ticks.ticks_ms()))
@@ -0,0 +1,3 @@
+class SocketPool:
+    def __init__(self, radio):
+        self.radio = radio
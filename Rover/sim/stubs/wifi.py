@@ -0,0 +1,7 @@
+class _Radio:
+    ipv4_address = "127.0.0.1"
+
+    def connect(self, ssid, password):
+        pass
+
+radio = _Radio()
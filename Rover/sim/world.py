@@ -0,0 +1,119 @@
+import math
+import random
+from occupancy import lidar_mount_bearing
+
+# The simulated arena and rover that the stub hardware modules in
+# sim/stubs read and drive.
+#
+# The rover is a differential drive: each wheel's speed follows its motor
+# throttle with a first-order lag, and throttles too small to turn the
+# motors do nothing.  Position and heading are integrated from the wheel
+# speeds in small fixed steps.  Sensors (sim/stubs) are 'devices' that
+# get update(now) after every step, so they can sample at their own rates.
+#
+# Everything runs on the world's clock, 'now', in seconds.  sim/loop.py
+# moves it forward as the asyncio tasks sleep.
+
+# As in driving.py and pose.py
+ARENA_WIDTH = 1160
+ARENA_HEIGHT = 1060
+WHEEL_SEP = 98
+
+MAX_WHEEL_SPEED = 300  # mm/s at full throttle
+MOTOR_LAG = 0.08       # s, time constant of a wheel getting up to speed
+STALL_THROTTLE = 0.2   # Throttles below this don't move the rover
+STEP = 0.001           # s per integration step
+
+LIDAR_NOISE = 3        # mm, standard deviation
+LIDAR_MAX_RANGE = 4000 # mm; beyond this the sensor reports None
+GYRO_NOISE = 0.005     # rad/s
+ACCEL_NOISE = 0.05     # m/s^2
+GRAVITY = 9.80665
+
+def _ray_to_box(x, y, dx, dy, box):
+    """Distance along the ray (x, y) + t(dx, dy) to the box (min_x, min_y,
+    max_x, max_y), or None if it misses"""
+    (t_near, t_far) = (0, math.inf)
+    for (p, d, lo, hi) in [(x, dx, box[0], box[2]), (y, dy, box[1], box[3])]:
+        if abs(d) < 1e-9:
+            if p < lo or p > hi:
+                return None
+            continue
+        (t1, t2) = sorted([(lo - p) / d, (hi - p) / d])
+        t_near = max(t_near, t1)
+        t_far = min(t_far, t2)
+    return t_near if t_near <= t_far else None
+
+class World:
+    def __init__(self):
+        self.now = 0.0
+        self.x = 300.0
+        self.y = 300.0
+        self.hdg = 0.0        # degrees clockwise from up
+        self.turn_rate = 0.0  # deg/s, clockwise
+        self.throttles = [0.0, 0.0]   # left, right, as last set
+        self.wheel_speeds = [0.0, 0.0] # mm/s
+        self.servo_angle = 83  # The LIDAR servo, which starts pointing the 'up' LIDAR ahead
+        self.boxes = []       # (min_x, min_y, max_x, max_y) things on the board
+        self.devices = []
+        self.edge_listeners = []  # keypad.Keys watching for pin edges
+        self.rng = random.Random(1)
+        self.distance_driven = 0.0
+
+    def set_pose(self, x, y, hdg):
+        (self.x, self.y, self.hdg) = (x, y, hdg % 360)
+
+    def pin_edge(self, pin, pressed):
+        for listener in self.edge_listeners:
+            listener.edge(pin, pressed)
+
+    def advance(self, dt):
+        """Moves the world on by dt seconds"""
+        end = self.now + dt
+        while self.now < end:
+            step = min(STEP, end - self.now)
+            self._integrate(step)
+            self.now += step
+            for device in self.devices:
+                device.update(self.now)
+
+    def _integrate(self, dt):
+        for i in (0, 1):
+            thr = self.throttles[i]
+            target = 0 if abs(thr) < STALL_THROTTLE else thr * MAX_WHEEL_SPEED
+            self.wheel_speeds[i] += (target - self.wheel_speeds[i]) * min(1, dt / MOTOR_LAG)
+        (left, right) = self.wheel_speeds
+        speed = (left + right) / 2
+        self.turn_rate = math.degrees((left - right) / WHEEL_SEP)
+        mid = math.radians(self.hdg + self.turn_rate * dt / 2)
+        self.x += speed * dt * math.sin(mid)
+        self.y += speed * dt * math.cos(mid)
+        self.hdg = (self.hdg + self.turn_rate * dt) % 360
+        self.distance_driven += abs(speed) * dt
+
+    def lidar_distance(self, which):
+        """What LIDAR 'which' (0 'up', 1 'over') measures now, in mm, or None
+        if there's nothing in range"""
+        bearing = self.hdg + lidar_mount_bearing(self.servo_angle) + 90 * which
+        dx = math.sin(math.radians(bearing))
+        dy = math.cos(math.radians(bearing))
+        # The walls are boxes round the outside
+        walls = [(-1e6, -1e6, 0, 1e6), (ARENA_WIDTH, -1e6, 1e6, 1e6), (-1e6, -1e6, 1e6, 0), (-1e6, ARENA_HEIGHT, 1e6, 1e6)]
+        hits = [_ray_to_box(self.x, self.y, dx, dy, box) for box in self.boxes + walls]
+        dist = min([h for h in hits if h is not None]) + self.rng.gauss(0, LIDAR_NOISE)
+        return None if dist > LIDAR_MAX_RANGE else max(0, dist)
+
+    def accel(self):
+        """The accelerometer's (x, y, z) in m/s^2: gravity, in the board's plane"""
+        h = math.radians(self.hdg)
+        return (-GRAVITY * math.sin(h) + self.rng.gauss(0, ACCEL_NOISE),
+                -GRAVITY * math.cos(h) + self.rng.gauss(0, ACCEL_NOISE),
+                self.rng.gauss(0, ACCEL_NOISE))
+
+    def gyro(self):
+        """The gyro's (x, y, z) in rad/s.  Its z axis turns the opposite way
+        to heading (pose.GYRO_SIGN)."""
+        return (self.rng.gauss(0, GYRO_NOISE), self.rng.gauss(0, GYRO_NOISE),
+                -math.radians(self.turn_rate) + self.rng.gauss(0, GYRO_NOISE))
+
+world = World()
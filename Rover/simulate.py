@@ -0,0 +1,177 @@
+# Runs the rover's code.py on a desktop against a simulated arena (see
+# sim/), faster than real time, and reports how the tasks kept up and
+# how well scripted moves went:
+#
+#   python3 simulate.py                                   # the default navto tour
+#   python3 simulate.py --cmd "navto 800 600 90" --cmd "wait 2" --cmd "navto 300 300 0"
+#   python3 simulate.py --box 450 300 600 750 --cmd "map sweep" --cmd "navto 900 500 90"
+#   python3 simulate.py --log sim.log                     # then python3 replay_log.py sim.log
+#
+# Commands go in through the websocket, like the client UI's.  navto waits
+# until the rover has arrived or given up (or --timeout), 'map sweep'
+# until the sweep is done, a mission until it's over (--timeout per
+# step), and 'wait N' just lets N seconds go by.
+
+import argparse
+import asyncio
+import math
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "sim", "stubs"))
+sys.modules.pop("code", None)  # The standard library has one too
+
+from sim.world import world
+from sim.loop import SimEventLoop, CPU_SCALE, STEP_COST
+
+DEFAULT_SCRIPT = [
+    "navto 800 700 90",
+    "navto 300 800 270",
+    "navto 600 300 180",
+    "navto 300 300 0",
+]
+
+def _wrap180(d):
+    return (d + 180) % 360 - 180
+
+def _print_sent(websocket):
+    import telemetry
+    frames = [msg for msg in websocket.sent if not isinstance(msg, str)]
+    for msg in websocket.sent:
+        if isinstance(msg, str):
+            print(f"  [{world.now:7.2f}s] {msg}")
+    if frames:
+        print(f"  [{world.now:7.2f}s] {len(frames)} telemetry frames, the last: {telemetry.unpack_frame(frames[-1])}")
+    websocket.sent.clear()
+
+async def _wait_for(condition, timeout, websocket, poll=0.05):
+    start = world.now
+    while not condition():
+        if world.now - start > timeout:
+            return False
+        await asyncio.sleep(poll)
+        _print_sent(websocket)
+    return True
+
+async def _send(websocket, cmd, timeout):
+    """Sends cmd and waits for the rover to take it off the websocket.  It
+    runs each command as it takes it, so the command has taken effect then."""
+    websocket.incoming.append(cmd)
+    return await _wait_for(lambda: len(websocket.incoming) == 0, timeout, websocket, poll=0.01)
+
+async def run_script(script, timeout):
+    import code as rover
+    import driving
+    import mission
+    import pose
+    import servos
+    from adafruit_httpserver import Websocket
+
+    rover.websocket = Websocket()
+    main = asyncio.ensure_future(rover.main())
+    await asyncio.sleep(1)  # Let the sensors and pose settle
+    results = []
+    for cmd in script:
+        words = cmd.split()
+        if words[0] == 'wait':
+            await asyncio.sleep(float(words[1]))
+            continue
+        start = world.now
+        driven = world.distance_driven
+        await _send(rover.websocket, cmd, timeout)
+        if words[0] == 'navto':
+            # navto refuses without a position, and otherwise sets a goal
+            # (unless it's there already)
+            refused = driving.nav_goal is None and pose.get_pose()[0] is None
+            arrived = await _wait_for(lambda: driving.nav_goal is None and len(driving.action_queue) == 0, timeout,
+                                      rover.websocket)
+            (goal_x, goal_y, goal_hdg) = [float(w) for w in words[1:4]]
+            (est_x, est_y, est_hdg, _, _) = pose.get_pose()
+            results.append({
+                'cmd': cmd,
+                'arrived': arrived,
+                'outcome': ('REFUSED' if refused else 'TIMED OUT' if not arrived
+                            else 'GAVE UP' if driving.navto_aborted else 'arrived'),
+                'time': world.now - start,
+                'driven': world.distance_driven - driven,
+                'pos_err': math.hypot(world.x - goal_x, world.y - goal_y),
+                'hdg_err': abs(_wrap180(world.hdg - goal_hdg)),
+                'est_err': math.hypot(world.x - est_x, world.y - est_y) if est_x is not None else None,
+            })
+            if not arrived:
+                await _send(rover.websocket, 'stop', timeout)
+                await asyncio.sleep(0.5)
+        elif cmd == 'map sweep':
+            await asyncio.sleep(0.1)  # For the sweep's task to start
+            await _wait_for(lambda: not servos.sweeping, timeout, rover.websocket)
+        elif words[0] == 'mission':
+            # mission.steps is the one just sent, unless it was turned down
+            # (and then it isn't running)
+            if not await _wait_for(lambda: not mission.running, timeout * len(mission.steps), rover.websocket):
+                await _send(rover.websocket, 'stop', timeout)
+            await asyncio.sleep(0.5)
+        else:
+            await asyncio.sleep(0.5)
+        _print_sent(rover.websocket)
+    main.cancel()
+    return results
+
+def report(loop, results, wall_time):
+    import code as rover
+    import driving
+    print(f"\n{world.now:.1f}s simulated in {wall_time:.1f}s ({world.now / wall_time:.1f}x real time)")
+    print("asyncio tasks (steps/s and share of the CPU, in simulated time):")
+    for stats in sorted(loop.task_stats.values(), key=lambda s: -s.steps):
+        print(f"  {stats.name:32} {stats.steps / world.now:8.1f}/s  {100 * stats.cpu / world.now:5.1f}%")
+    print("Scheduler:")
+    for line in str(rover.scheduler).split("\n"):
+        print(f"  {line}")
+    print(f"Replanning: {', '.join([f'{k} {v}' for (k, v) in driving.replan_stats.items()])}")
+    if results:
+        print("navto runs:")
+        for r in results:
+            est = "-" if r['est_err'] is None else f"{r['est_err']:.0f}mm"
+            print(f"  {r['cmd']:22} {r['outcome']:9} in {r['time']:5.1f}s, "
+                  f"drove {r['driven']:5.0f}mm, off by {r['pos_err']:4.0f}mm {r['hdg_err']:4.1f}deg, pose estimate off {est}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the rover code against a simulated arena")
+    parser.add_argument("--cmd", action="append", help="command to send (repeatable); default is a tour of navtos")
+    parser.add_argument("--start", type=float, nargs=3, default=[300, 300, 0], metavar=("X", "Y", "HDG"))
+    parser.add_argument("--box", type=float, nargs=4, action="append", default=[], metavar=("X0", "Y0", "X1", "Y1"),
+                        help="an obstacle on the board (repeatable)")
+    parser.add_argument("--timeout", type=float, default=30, help="simulated seconds to allow each command")
+    parser.add_argument("--step-cost", type=float, default=STEP_COST, help="simulated seconds each task step costs")
+    parser.add_argument("--cpu-scale", type=float, default=CPU_SCALE, help="how much slower the board is than this machine")
+    parser.add_argument("--log", help="where to write the flight recorder's log (default: keep it in RAM)")
+    args = parser.parse_args()
+
+    import recorder
+    if args.log and os.path.exists(args.log):
+        os.remove(args.log)
+    recorder.log_file = args.log
+
+    world.set_pose(*args.start)
+    world.boxes = [tuple(b) for b in args.box]
+    loop = SimEventLoop(world, args.step_cost, args.cpu_scale)
+    asyncio.set_event_loop(loop)
+    # The rover code's time.monotonic() and time.sleep() have to be on the
+    # simulated clock too
+    time.monotonic = lambda: world.now
+    time.sleep = world.advance
+
+    wall_start = time.perf_counter()
+    results = loop.run_until_complete(run_script(args.cmd or DEFAULT_SCRIPT, args.timeout))
+    report(loop, results, time.perf_counter() - wall_start)
+    if args.log:
+        # What's still only in RAM, as /log would have it
+        data = b"".join(recorder.log_chunks())
+        with open(args.log, "wb") as file:
+            file.write(data)
+        print(f"{recorder.status()}; wrote {len(data)} bytes to {args.log}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import struct
+
+# Telemetry frames: 'telemetry on <hz>' has code.py push one of these as
+# a binary websocket message at that rate, for client_ui.html to decode
+# and plot.  Binary because formatting text for every sample costs more
+# than the sampling does.
+#
+# Layout, little-endian (client_ui.html decodes the same thing):
+#   B  frame type, FRAME_TYPE
+#   I  ticks_ms() when the frame was packed
+#   h  'up' LIDAR distance, mm, or NO_DISTANCE
+#   h  'over' LIDAR distance, mm, or NO_DISTANCE
+#   h  pose x, mm, or NO_POSITION
+#   h  pose y, mm, or NO_POSITION
+#   H  heading, hundredths of a degree clockwise from up
+#   B  pose confidence, percent
+#   b  left throttle, percent
+#   b  right throttle, percent
+#   B  actions queued (at most 255)
+#   H  battery, tenths of a percent
+FRAME_FORMAT = "<BIhhhhHBbbBH"
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)  # 21 bytes
+FRAME_TYPE = 1
+NO_DISTANCE = -1
+NO_POSITION = -32768
+MAX_HZ = 50
+
+# Every frame is packed into the same buffer, so streaming doesn't allocate
+_frame = bytearray(FRAME_SIZE)
+
+def _mm(value, missing):
+    return missing if value is None else max(-32767, min(32767, int(value)))
+
+def pack_frame(ticks, distances, pose, throttles, queue_len, battery):
+    """Packs a frame into the shared buffer and returns it.  distances is
+    lidar.get_distances(), pose is pose.get_pose(), throttles is (left,
+    right) from -1 to 1, and battery is a percentage.  The buffer is reused
+    by the next call, so send it before packing another."""
+    (x, y, hdg, _, confidence) = pose
+    struct.pack_into(FRAME_FORMAT, _frame, 0, FRAME_TYPE, ticks,
+                     _mm(distances[0], NO_DISTANCE), _mm(distances[1], NO_DISTANCE),
+                     _mm(x, NO_POSITION), _mm(y, NO_POSITION),
+                     int(hdg % 360 * 100) % 36000, int(confidence * 100),
+                     int(throttles[0] * 100), int(throttles[1] * 100),
+                     min(queue_len, 255), max(0, int(battery * 10)))
+    return _frame
+
+FIELDS = ('type', 'ticks', 'up', 'over', 'x', 'y', 'heading', 'confidence', 'left', 'right', 'queued', 'battery')
+
+def unpack_frame(frame):
+    """The fields of a frame as a dict, in the units pack_frame() took them
+    in, with None for a missing distance or position"""
+    f = dict(zip(FIELDS, struct.unpack_from(FRAME_FORMAT, frame)))
+    for k in ('up', 'over'):
+        if f[k] == NO_DISTANCE:
+            f[k] = None
+    for k in ('x', 'y'):
+        if f[k] == NO_POSITION:
+            f[k] = None
+    f['heading'] /= 100
+    for k in ('confidence', 'left', 'right'):
+        f[k] /= 100
+    f['battery'] /= 10
+    return f
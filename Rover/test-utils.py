@@ -1,4 +1,4 @@
-from utils import HeadingStopper
+from nav_utils import HeadingStopper, XStopper, YStopper, PredictiveStopper, StopModel, analyze_stop_trace
 
 def one_test(curr_hdg, dir, target_hdg, hdgs_dont_stop, hdgs_do_stop):
     hs = HeadingStopper(curr_hdg, dir, target_hdg)
@@ -11,4 +11,65 @@ def one_test(curr_hdg, dir, target_hdg, hdgs_dont_stop, hdgs_do_stop):
 one_test(10, 'right', 270, [10, 20, 30, 260, 269], [270, 280, 290, 300])
 one_test(270, 'left', 10, [270, 260, 20, 11], [10, 5])
 one_test(270, 'right', 90, [270, 265, 280, 360, 0, 1, 89], [90, 91])
-one_test(300, 'left', 340, [300, 290, 10, 0, 360, 341], [340, 339])
\ No newline at end of file
+one_test(300, 'left', 340, [300, 290, 10, 0, 360, 341], [340, 339])
+
+# Predictive stopping, against simulated runs: the rover heads for the
+# target at a steady speed, sampled every sample_dt seconds, until the
+# stopper fires.  It then goes on for speed * latency, plus the coast.
+def where_it_stops(stopper, start, speed, sample_dt, latency, coast, position):
+    t = 0
+    p = start
+    while not stopper.should_stop(*position(p), t):
+        t += sample_dt
+        p += speed * sample_dt
+        assert t < 100, "Never stopped"
+    return p + speed * latency + (coast if speed > 0 else -coast)
+
+def xy_x(p):
+    return (p, 0, 0)
+
+def xy_y(p):
+    return (0, p, 0)
+
+def hdg(p):
+    return (0, 0, p % 360)
+
+def one_predictive_test(make_stopper, start, target, speed, sample_dt, latency, coast, position):
+    model = StopModel(latency, {1: coast}, {1: coast})
+    plain_end = where_it_stops(make_stopper(start, target), start, speed, sample_dt, latency, coast, position)
+    pred_end = where_it_stops(PredictiveStopper(make_stopper(start, target), 1, model),
+                              start, speed, sample_dt, latency, coast, position)
+    # Going the other way, the error's sign flips
+    sign = 1 if speed > 0 else -1
+    # Plain stoppers overshoot by the whole stopping distance...
+    assert sign * (plain_end - target) >= abs(speed) * latency + coast, f"Expected plain overshoot, stopped at {plain_end}"
+    # ...predictive ones come to rest short of the target, by less than one sample's travel
+    err = sign * (pred_end - target)
+    assert -abs(speed) * sample_dt <= err <= 0.001, f"Expected {target}, predictive stopped at {pred_end}"
+
+one_predictive_test(XStopper, 100, 500, 200, 0.1, 0.1, 15, xy_x)
+one_predictive_test(XStopper, 500, 100, -200, 0.1, 0.1, 15, xy_x)
+one_predictive_test(XStopper, 0, 300, 80, 0.05, 0.2, 3, xy_x)
+one_predictive_test(YStopper, 200, 900, 300, 0.1, 0.15, 25, xy_y)
+one_predictive_test(YStopper, 900, 200, -300, 0.1, 0.15, 25, xy_y)
+one_predictive_test(lambda s, t: HeadingStopper(s, 'right', t), 10, 270, 90, 0.01, 0.05, 8, hdg)
+one_predictive_test(lambda s, t: HeadingStopper(s, 'left', t % 360), 300, -20, -120, 0.01, 0.05, 10, hdg)
+
+# StopModel interpolates the coast between calibrated throttles
+model = StopModel(0.1, {0.4: 4, 1.0: 16})
+for (thr, coast) in [(0.4, 4), (0.7, 10), (1.0, 16), (-1.0, 16), (0.2, 2), (1.5, 16)]:
+    assert abs(model.coast(thr) - coast) < 0.001, f"Expected coast {coast} at throttle {thr}"
+
+# Calibration: a made-up trace at 200mm/s, stopped at 1s, that keeps going
+# for 0.1s and then coasts 10mm to a stop over 0.1s
+def made_up_position(t):
+    if t <= 1.1:
+        return 200 * t
+    if t <= 1.2:
+        return 220 + 10 * (1 - (1 - (t - 1.1) / 0.1) ** 2)
+    return 230
+trace = [(i * 0.02, made_up_position(i * 0.02)) for i in range(0, 111)]
+(speed, latency, coast) = analyze_stop_trace(trace, 1.0)
+assert abs(speed - 200) < 1, f"speed {speed}"
+assert abs(latency - 0.1) < 0.021, f"latency {latency}"
+assert abs(coast - 10) < 4.1, f"coast {coast}"